@@ -4,13 +4,13 @@ from datetime import datetime, timedelta, timezone
 
 import jwt
 from jwt import PyJWTError
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
 
-from database import SessionLocal
+from database import SessionLocal, get_async_sessionmaker
 from models.user import User
 from settings import settings
+from user_cache import CachedUser, user_cache
 
 _security = HTTPBearer()
 
@@ -23,6 +23,12 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """AsyncSession dependency for async routes, so queries don't block the event loop."""
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
 def create_access_token(*, subject: str, expires_delta: timedelta | None = None) -> str:
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
     payload = {
@@ -45,12 +51,65 @@ def decode_token(token: str) -> str:
     return subject
 
 
+def _bearer_token(request: Request) -> str | None:
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+    return auth_header.split(" ")[1]
+
+
+def resolve_principal(request: Request) -> str | None:
+    """
+    Return the JWT subject for this request, or None if there is no valid token.
+
+    The token is decoded at most once per request; the result is kept on
+    ``request.state`` and shared by the rate limiter key function and the
+    auth dependency.
+    """
+    token = _bearer_token(request)
+    if not token:
+        return None
+
+    cached = getattr(request.state, "principal", None)
+    if cached is not None and cached[0] == token:
+        return cached[1]
+
+    try:
+        subject = decode_token(token)
+    except HTTPException:
+        subject = None
+    request.state.principal = (token, subject)
+    return subject
+
+
+def load_user(email: str) -> CachedUser | None:
+    """Fetch the auth-relevant user fields, from the user cache when possible."""
+    user = user_cache.get(email)
+    if user is not None:
+        return user
+
+    db = SessionLocal()
+    try:
+        row = db.query(User).filter(User.email == email).first()
+    finally:
+        db.close()
+    if row is None:
+        return None
+
+    user = CachedUser.from_model(row)
+    user_cache.put(user)
+    return user
+
+
 def get_current_user(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(_security),
-    db: Session = Depends(get_db),
-) -> User:
-    subject = decode_token(credentials.credentials)
-    user = db.query(User).filter(User.email == subject).first()
+) -> CachedUser:
+    subject = resolve_principal(request)
+    if subject is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    user = load_user(subject)
     if user is None or not user.is_active:
         raise HTTPException(status_code=401, detail="Invalid user")
     return user
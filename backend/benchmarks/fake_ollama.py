@@ -0,0 +1,244 @@
+"""
+Fake Ollama server for benchmarks and load tests.
+
+Implements the parts of the Ollama HTTP API the backend uses (``/api/chat``
+streaming and non-streaming, ``/api/generate``, ``/api/tags``, ``/api/ps``)
+and answers with well-formed JSON for each feature's prompt, so every route
+can be exercised without a GPU:
+
+    python -m benchmarks.fake_ollama --port 11435 --latency-ms 800 \\
+        --latency-dist lognormal --tokens-per-sec 40 --error-rate 0.02
+
+Then start the API with ``ollama_base_url=http://127.0.0.1:11435``.
+
+Latency (non-streaming) is drawn from ``--latency-dist``; streaming
+responses wait ``--prompt-ms`` before the first token and then emit tokens
+at ``--tokens-per-sec``. Failures are injected per request with the given
+probabilities: HTTP 500s, model output that is not valid JSON (prose or a
+markdown fence around the object), malformed response bodies, and hangs
+that outlast the client timeout.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+
+@dataclass
+class FakeOllamaConfig:
+    model: str = "llama3:8b"
+    latency_ms: float = 500.0
+    latency_dist: str = "fixed"  # fixed | uniform | exponential | lognormal
+    latency_jitter: float = 0.25  # +-fraction for uniform, sigma for lognormal
+    prompt_ms: float = 100.0
+    tokens_per_sec: float = 40.0
+    error_rate: float = 0.0
+    invalid_json_rate: float = 0.0
+    malformed_rate: float = 0.0
+    hang_rate: float = 0.0
+    hang_seconds: float = 300.0
+    seed: int = 0
+
+
+def sample_latency(config: FakeOllamaConfig, rng: random.Random) -> float:
+    mean = config.latency_ms / 1000
+    if config.latency_dist == "uniform":
+        return max(0.0, rng.uniform(mean * (1 - config.latency_jitter), mean * (1 + config.latency_jitter)))
+    if config.latency_dist == "exponential":
+        return rng.expovariate(1 / mean) if mean > 0 else 0.0
+    if config.latency_dist == "lognormal":
+        sigma = config.latency_jitter
+        # Parameterized so the distribution's mean is latency_ms
+        return rng.lognormvariate(_log_mu(mean, sigma), sigma) if mean > 0 else 0.0
+    return mean
+
+
+def _log_mu(mean: float, sigma: float) -> float:
+    return math.log(mean) - sigma * sigma / 2
+
+
+def _bullet(text: str) -> Dict[str, str]:
+    return {
+        "original": text,
+        "enhanced": f"Led {text.strip()} end to end",
+        "impact_version": f"Delivered {text.strip()}, improving team throughput",
+    }
+
+
+def response_for(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """A plausible structured answer for the prompt built by services/ai_service.py."""
+    user = messages[-1]["content"] if messages else ""
+    if "LinkedIn post" in user:
+        topic = re.search(r'about "(.*?)"', user)
+        return {
+            "hook": f"What nobody tells you about {topic.group(1) if topic else 'this'}",
+            "body": "\n".join(f"Line {i} of a thoughtful post." for i in range(1, 8)),
+            "cta": "What has your experience been? Share below.",
+        }
+    batch = re.search(r"each of these (\d+) bullet", user)
+    if batch:
+        originals = re.findall(r"^\s*\d+\.\s*(.*)$", user.split("Originals:")[-1], re.MULTILINE)
+        count = int(batch.group(1))
+        originals = (originals + ["bullet"] * count)[:count]
+        return {"items": [_bullet(text) for text in originals]}
+    if "resume sections on its own" in user:
+        names = re.findall(r"^\s*\[(\w+)\]\s*$", user.split("Sections:")[-1], re.MULTILINE)
+        return {
+            "sections": [
+                {
+                    "section": name,
+                    "score": 60 + len(name) % 20,
+                    "strengths": [f"Clear {name} section"],
+                    "weaknesses": [f"{name.capitalize()} lacks measurable results"],
+                    "suggestions": [f"Add numbers to the {name} section"],
+                }
+                for name in names
+            ]
+        }
+    if "Rewrite this bullet" in user:
+        original = user.split("Original:")[-1].strip()
+        return _bullet(original)
+    return {
+        "score": 68,
+        "strengths": ["Relevant internships", "Solid programming fundamentals"],
+        "weaknesses": ["Few quantified results", "Generic summary"],
+        "suggestions": ["Quantify project impact", "Tailor the summary to the role"],
+    }
+
+
+def _tokens(text: str) -> List[str]:
+    # Roughly one token per 4 characters, like real tokenizers on English/JSON
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+def create_app(config: FakeOllamaConfig) -> FastAPI:
+    app = FastAPI(title="fake-ollama")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "errors": 0, "invalid_json": 0, "malformed": 0, "hangs": 0, "in_flight": 0}
+
+    def _final_stats(prompt: str, tokens: int, prompt_seconds: float, eval_seconds: float) -> Dict[str, Any]:
+        prompt_tokens = max(1, len(prompt) // 4)
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((prompt_seconds + eval_seconds) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_seconds * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(max(eval_seconds, 1e-6) * 1e9),
+        }
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        streaming = False
+        try:
+            if rng.random() < config.hang_rate:
+                stats["hangs"] += 1
+                await asyncio.sleep(config.hang_seconds)
+            if rng.random() < config.error_rate:
+                stats["errors"] += 1
+                await asyncio.sleep(sample_latency(config, rng) / 10)
+                return JSONResponse({"error": "injected failure"}, status_code=500)
+
+            messages = body.get("messages", [])
+            prompt = "".join(message.get("content", "") for message in messages)
+            content = json.dumps(response_for(messages))
+            if rng.random() < config.invalid_json_rate:
+                stats["invalid_json"] += 1
+                content = f"Sure! Here is the result:\n```json\n{content}\n```"
+            malformed = rng.random() < config.malformed_rate
+            if malformed:
+                stats["malformed"] += 1
+
+            if not body.get("stream"):
+                delay = sample_latency(config, rng)
+                await asyncio.sleep(delay)
+                if malformed:
+                    return PlainTextResponse('{"message": {"content": ', media_type="application/json")
+                prompt_seconds = min(delay, config.prompt_ms / 1000)
+                return {
+                    "model": body.get("model", config.model),
+                    "message": {"role": "assistant", "content": content},
+                    **_final_stats(prompt, len(_tokens(content)), prompt_seconds, delay - prompt_seconds),
+                }
+
+            tokens = _tokens(content)
+            interval = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+
+            async def generate():
+                try:
+                    started = time.perf_counter()
+                    await asyncio.sleep(config.prompt_ms / 1000)
+                    prompt_done = time.perf_counter()
+                    for index, token in enumerate(tokens):
+                        if malformed and index == len(tokens) // 2:
+                            yield '{"message": {"content": "\n'
+                            return
+                        chunk = {"model": config.model, "message": {"role": "assistant", "content": token}, "done": False}
+                        yield json.dumps(chunk) + "\n"
+                        if interval:
+                            await asyncio.sleep(interval)
+                    final = _final_stats(prompt, len(tokens), prompt_done - started, time.perf_counter() - prompt_done)
+                    yield json.dumps({"model": config.model, "message": {"role": "assistant", "content": ""}, **final}) + "\n"
+                finally:
+                    stats["in_flight"] -= 1
+
+            streaming = True
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
+        finally:
+            if not streaming:
+                stats["in_flight"] -= 1
+
+    @app.post("/api/generate")
+    async def generate_route(request: Request):
+        # Used for model warm-up (empty prompt loads the model)
+        body = await request.json()
+        return {"model": body.get("model", config.model), "response": "", "done": True}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": config.model, "model": config.model}]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": config.model, "model": config.model}]}
+
+    @app.get("/_fake/stats")
+    async def fake_stats():
+        return {"config": asdict(config), **stats}
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    defaults = FakeOllamaConfig()
+    for field, value in asdict(defaults).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    import uvicorn
+
+    args = parse_args(argv)
+    config = FakeOllamaConfig(**{field: getattr(args, field) for field in asdict(FakeOllamaConfig())})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Per-request overhead and multi-worker accuracy of the rate limit store.
+
+Reports the latency of one ``QuotaStore.hit`` (route limit plus a tier
+quota, as a limited route does it) for each backend, then starts several
+processes hammering the same key to check how many requests a shared limit
+actually lets through:
+
+    python -m benchmarks.limiter_bench --checks 5000 --workers 4 --limit 50
+
+With the memory backend each process allows ``limit`` requests (``limit *
+workers`` in total); with the SQLite backend the total stays at ``limit``.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+from services.quota_store import MemoryQuotaStore, QuotaCheck, SQLiteQuotaStore, parse_rate
+
+
+def _store(backend: str, path: str):
+    if backend == "memory":
+        return MemoryQuotaStore()
+    return SQLiteQuotaStore(path, busy_timeout_ms=5000)
+
+
+def bench_latency(backend: str, path: str, checks: int) -> dict:
+    store = _store(backend, path)
+    route = parse_rate(f"{checks * 10}/minute")
+    tier = parse_rate(f"{checks * 10}/day")
+    timings = []
+    for i in range(checks):
+        identity = f"user{i % 100}@bench"
+        batch = [
+            QuotaCheck(key=f"route:bench:{identity}", rate=route),
+            QuotaCheck(key=f"tier:free:{identity}", rate=tier),
+        ]
+        started = time.perf_counter()
+        store.hit(batch)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "backend": backend,
+        "checks": checks,
+        "mean_us": round(statistics.fmean(timings) * 1e6, 1),
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 1),
+        "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+    }
+
+
+def _worker(backend: str, path: str, key: str, limit: int, attempts: int, results) -> None:
+    store = _store(backend, path)
+    rate = parse_rate(f"{limit}/hour")
+    allowed = sum(store.hit([QuotaCheck(key=key, rate=rate)]).allowed for _ in range(attempts))
+    results.put(allowed)
+
+
+def bench_shared(backend: str, path: str, workers: int, limit: int) -> dict:
+    key = f"route:shared:{uuid.uuid4().hex}"
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_worker, args=(backend, path, key, limit, limit * 2, results))
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    allowed = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return {
+        "backend": backend,
+        "workers": workers,
+        "limit": limit,
+        "attempts": workers * limit * 2,
+        "allowed": allowed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--checks", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rate_limits.db")
+        report = {
+            "latency": [bench_latency(backend, path, args.checks) for backend in ("memory", "sqlite")],
+            "shared_limit": [bench_shared(backend, path, args.workers, args.limit) for backend in ("memory", "sqlite")],
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+"""
+Load test for the API routes, with machine-readable results.
+
+Drives one or more workloads at a fixed concurrency against a running API
+and reports throughput, latency percentiles, time to first token (streaming)
+and error rates as JSON:
+
+    python -m benchmarks.load_test run --base-url http://127.0.0.1:8000 \\
+        --workload analyze --workload history --concurrency 16 --requests 200 \\
+        --output after.json
+
+``--spawn`` makes the run self-contained: it starts ``benchmarks.fake_ollama``
+(configured with ``--fake "--latency-ms 800 --error-rate 0.02"``) and the API
+(``--api-workers`` uvicorn workers) on a scratch database, with rate limits
+off and a low bcrypt cost, and gives the benchmark users unlimited credits:
+
+    python -m benchmarks.load_test run --spawn --workload mixed --output before.json
+    python -m benchmarks.load_test compare before.json after.json
+
+Without ``--spawn``, make sure rate limits and credits on the target server
+allow the requested load (each registered user starts with 20 credits).
+
+Workloads: auth (register + login), login, analyze, analyze_stream,
+enhance, enhance_batch, linkedin, history, mixed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "bench-password"
+
+RESUME = (
+    "B.Tech Computer Science, 2025. Intern at Acme Analytics: built ETL jobs in Python and SQL. "
+    "Projects: campus event app (React, Firebase), sentiment classifier (scikit-learn). "
+    "Skills: Python, Java, SQL, Git, Docker."
+)
+BULLETS = [
+    "Built a REST API for the placement cell portal",
+    "Worked on a machine learning model for attendance prediction",
+    "Helped organize the college coding contest",
+    "Made dashboards for the sales team",
+]
+TOPICS = ["my first internship", "learning system design", "winning a hackathon", "open source contributions"]
+
+MIXED_WEIGHTS = {
+    "analyze": 3,
+    "enhance": 3,
+    "linkedin": 2,
+    "history": 4,
+    "analyze_stream": 1,
+}
+
+
+@dataclass
+class Sample:
+    latency: float
+    status: int
+    error: Optional[str] = None
+    ttft: Optional[float] = None
+
+
+@dataclass
+class BenchUser:
+    email: str
+    token: str
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class WorkloadContext:
+    client: httpx.AsyncClient
+    users: List[BenchUser]
+    unique_inputs: bool
+    rng: random.Random
+    counter: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def next_index(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    def user(self, index: int) -> BenchUser:
+        return self.users[index % len(self.users)]
+
+    def vary(self, text: str, index: int) -> str:
+        return f"{text} (variant {index})" if self.unique_inputs else text
+
+
+def _error(response: httpx.Response) -> Optional[str]:
+    if response.status_code < 400:
+        return None
+    try:
+        return str(response.json().get("detail"))[:200]
+    except ValueError:
+        return response.text[:200]
+
+
+async def _timed(coro) -> Sample:
+    started = time.perf_counter()
+    try:
+        response = await coro
+    except httpx.HTTPError as e:
+        return Sample(latency=time.perf_counter() - started, status=0, error=type(e).__name__)
+    return Sample(latency=time.perf_counter() - started, status=response.status_code, error=_error(response))
+
+
+async def _stream(ctx: WorkloadContext, path: str, payload: Dict[str, Any], user: BenchUser) -> Sample:
+    started = time.perf_counter()
+    ttft = None
+    error = None
+    try:
+        async with ctx.client.stream("POST", path, json=payload, headers=user.headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return Sample(time.perf_counter() - started, response.status_code, _error(response))
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                    if event == "token" and ttft is None:
+                        ttft = time.perf_counter() - started
+                elif line.startswith("data: ") and event == "error":
+                    error = json.loads(line[len("data: "):]).get("detail", "stream error")
+    except httpx.HTTPError as e:
+        return Sample(time.perf_counter() - started, 0, type(e).__name__, ttft)
+    return Sample(time.perf_counter() - started, 200 if error is None else 599, error, ttft)
+
+
+async def run_auth(ctx: WorkloadContext, index: int) -> Sample:
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    started = time.perf_counter()
+    sample = await _timed(ctx.client.post("/auth/register", json={"email": email, "password": PASSWORD}))
+    if sample.error is None:
+        sample = await _timed(ctx.client.post("/auth/login", json={"email": email, "password": PASSWORD}))
+    sample.latency = time.perf_counter() - started
+    return sample
+
+
+async def run_login(ctx: WorkloadContext, index: int) -> Sample:
+    user = ctx.user(index)
+    return await _timed(ctx.client.post("/auth/login", json={"email": user.email, "password": PASSWORD}))
+
+
+async def run_analyze(ctx: WorkloadContext, index: int) -> Sample:
+    user = ctx.user(index)
+    payload = {"resume_text": ctx.vary(RESUME, index)}
+    return await _timed(ctx.client.post("/resume/analyze", json=payload, headers=user.headers))
+
+
+async def run_analyze_stream(ctx: WorkloadContext, index: int) -> Sample:
+    return await _stream(ctx, "/resume/analyze/stream", {"resume_text": ctx.vary(RESUME, index)}, ctx.user(index))
+
+
+async def run_enhance(ctx: WorkloadContext, index: int) -> Sample:
+    user = ctx.user(index)
+    payload = {"bullet": ctx.vary(BULLETS[index % len(BULLETS)], index)}
+    return await _timed(ctx.client.post("/projects/enhance", json=payload, headers=user.headers))
+
+
+async def run_enhance_batch(ctx: WorkloadContext, index: int) -> Sample:
+    user = ctx.user(index)
+    payload = {"bullets": [ctx.vary(bullet, index) for bullet in BULLETS]}
+    return await _timed(ctx.client.post("/projects/enhance/batch", json=payload, headers=user.headers))
+
+
+async def run_linkedin(ctx: WorkloadContext, index: int) -> Sample:
+    user = ctx.user(index)
+    payload = {"topic": ctx.vary(TOPICS[index % len(TOPICS)], index), "tone": "confident"}
+    return await _timed(ctx.client.post("/linkedin/generate", json=payload, headers=user.headers))
+
+
+async def run_history(ctx: WorkloadContext, index: int) -> Sample:
+    user = ctx.user(index)
+    return await _timed(ctx.client.get("/history/", params={"limit": 20}, headers=user.headers))
+
+
+WORKLOADS = {
+    "auth": run_auth,
+    "login": run_login,
+    "analyze": run_analyze,
+    "analyze_stream": run_analyze_stream,
+    "enhance": run_enhance,
+    "enhance_batch": run_enhance_batch,
+    "linkedin": run_linkedin,
+    "history": run_history,
+}
+
+
+async def run_mixed(ctx: WorkloadContext, index: int) -> Sample:
+    name = ctx.rng.choices(list(MIXED_WEIGHTS), weights=list(MIXED_WEIGHTS.values()))[0]
+    sample = await WORKLOADS[name](ctx, index)
+    ctx.extra.setdefault("mix", {}).setdefault(name, 0)
+    ctx.extra["mix"][name] += 1
+    return sample
+
+
+WORKLOADS["mixed"] = run_mixed
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "mean": round(statistics.fmean(ordered) * 1000, 2),
+        "p50": round(pick(0.50) * 1000, 2),
+        "p90": round(pick(0.90) * 1000, 2),
+        "p95": round(pick(0.95) * 1000, 2),
+        "p99": round(pick(0.99) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    status_counts: Dict[str, int] = {}
+    error_counts: Dict[str, int] = {}
+    for sample in samples:
+        status_counts[str(sample.status)] = status_counts.get(str(sample.status), 0) + 1
+        if sample.error is not None:
+            error_counts[sample.error] = error_counts.get(sample.error, 0) + 1
+    ok = [sample for sample in samples if sample.error is None]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+        "ok_throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": _percentiles([sample.latency for sample in ok]),
+        "error_latency_ms": _percentiles([sample.latency for sample in samples if sample.error is not None]),
+        "ttft_ms": _percentiles([sample.ttft for sample in ok if sample.ttft is not None]),
+        "status_counts": status_counts,
+        "top_errors": dict(sorted(error_counts.items(), key=lambda item: -item[1])[:5]),
+    }
+
+
+async def run_workload(ctx: WorkloadContext, name: str, concurrency: int, requests: int, duration: float) -> Dict[str, Any]:
+    workload = WORKLOADS[name]
+    samples: List[Sample] = []
+    ctx.extra = {}
+    deadline = time.perf_counter() + duration if duration else None
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif remaining <= 0:
+                return
+            remaining -= 1
+            samples.append(await workload(ctx, ctx.next_index()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(samples, time.perf_counter() - started)
+    result["concurrency"] = concurrency
+    if "mix" in ctx.extra:
+        result["mix"] = ctx.extra["mix"]
+    return result
+
+
+async def register_users(client: httpx.AsyncClient, count: int, concurrency: int) -> List[BenchUser]:
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:8]
+
+    async def register(i: int) -> BenchUser:
+        email = f"bench-{run_id}-{i}@example.com"
+        async with semaphore:
+            response = await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+        response.raise_for_status()
+        return BenchUser(email=email, token=response.json()["access_token"])
+
+    return await asyncio.gather(*(register(i) for i in range(count)))
+
+
+async def scrape_metrics(client: httpx.AsyncClient, token: str) -> Dict[str, float]:
+    """Unlabelled totals from /metrics worth keeping next to the client-side numbers."""
+    if not token:
+        return {}
+    try:
+        response = await client.get("/metrics", headers={"Authorization": f"Bearer {token}"})
+    except httpx.HTTPError:
+        return {}
+    if response.status_code != 200:
+        return {}
+    totals: Dict[str, float] = {}
+    for line in response.text.splitlines():
+        if line.startswith("#") or " " not in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        base = name.split("{", 1)[0]
+        if base in ("llm_errors_total", "llm_tokens_total") or (base.endswith("_count") and base.startswith("llm_")):
+            totals[name] = float(value)
+    return totals
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+@contextmanager
+def spawned_stack(args: argparse.Namespace) -> Iterator[Dict[str, Any]]:
+    """Start fake Ollama and the API on free ports with a scratch database."""
+    with tempfile.TemporaryDirectory(prefix="arise-bench-") as scratch:
+        fake_port, api_port = _free_port(), _free_port()
+        processes = []
+        try:
+            fake_args = shlex.split(args.fake or "")
+            processes.append(
+                subprocess.Popen(
+                    [sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(fake_port), *fake_args],
+                    cwd=BACKEND_DIR,
+                )
+            )
+            _wait_for(f"http://127.0.0.1:{fake_port}/api/tags")
+
+            db_path = os.path.join(scratch, "bench.db")
+            # /metrics is token-gated; the spawned API gets one the scraper knows
+            args.stats_token = args.stats_token or uuid.uuid4().hex
+            env = {
+                **os.environ,
+                "SECRET_KEY": os.environ.get("SECRET_KEY", "bench-secret-key-not-for-production-use"),
+                "DATABASE_URL": f"sqlite:///{db_path}",
+                "ollama_base_url": f"http://127.0.0.1:{fake_port}",
+                "llm_cache_path": os.path.join(scratch, "llm_cache.db"),
+                "rate_limit_sqlite_path": os.path.join(scratch, "rate_limits.db"),
+                "rate_limit_enabled": "false",
+                "password_hash_rounds": str(args.bcrypt_rounds),
+                "stats_token": args.stats_token,
+            }
+            for assignment in args.api_env:
+                key, _, value = assignment.partition("=")
+                env[key] = value
+            processes.append(
+                subprocess.Popen(
+                    [
+                        sys.executable, "-m", "uvicorn", "main:app",
+                        "--host", "127.0.0.1", "--port", str(api_port),
+                        "--workers", str(args.api_workers), "--log-level", "warning",
+                    ],
+                    cwd=BACKEND_DIR,
+                    env=env,
+                )
+            )
+            _wait_for(f"http://127.0.0.1:{api_port}/health")
+            yield {"base_url": f"http://127.0.0.1:{api_port}", "db_path": db_path, "fake_args": fake_args}
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def grant_unlimited_credits(db_path: str) -> None:
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("UPDATE users SET credits = 1000000000, tier = 'pro' WHERE email LIKE 'bench-%'")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args: argparse.Namespace, base_url: str, db_path: Optional[str]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        users = await register_users(client, args.users, min(args.concurrency, 16))
+        if db_path:
+            grant_unlimited_credits(db_path)
+        ctx = WorkloadContext(client=client, users=users, unique_inputs=not args.repeat_inputs, rng=random.Random(args.seed))
+
+        if args.warmup:
+            for name in args.workload:
+                await run_workload(ctx, name, min(args.concurrency, args.warmup), args.warmup, 0)
+
+        results = {}
+        for name in args.workload:
+            results[name] = await run_workload(ctx, name, args.concurrency, args.requests, args.duration)
+        server = await scrape_metrics(client, args.stats_token)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "base_url": base_url,
+            "spawned": bool(args.spawn),
+            "api_workers": args.api_workers if args.spawn else None,
+            "fake_ollama": args.fake if args.spawn else None,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "duration": args.duration,
+            "users": args.users,
+            "unique_inputs": not args.repeat_inputs,
+        },
+        "results": results,
+        "server_metrics": server,
+    }
+
+
+def _delta(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if before is None or after is None or before == 0:
+        return None
+    return round((after - before) / before * 100, 2)
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """Percentage change per workload for throughput, latency percentiles and error rate."""
+    report = {}
+    for name in before.get("results", {}):
+        if name not in after.get("results", {}):
+            continue
+        old, new = before["results"][name], after["results"][name]
+        entry = {
+            "throughput_rps_pct": _delta(old.get("throughput_rps"), new.get("throughput_rps")),
+            "error_rate": {"before": old.get("error_rate"), "after": new.get("error_rate")},
+        }
+        for metric in ("latency_ms", "ttft_ms"):
+            for q in ("p50", "p95", "p99"):
+                change = _delta(old.get(metric, {}).get(q), new.get(metric, {}).get(q))
+                if change is not None:
+                    entry[f"{metric}_{q}_pct"] = change
+        report[name] = entry
+    return report
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run workloads and write a JSON report")
+    run.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run.add_argument("--workload", action="append", choices=sorted(WORKLOADS), help="Repeatable (default: mixed)")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--requests", type=int, default=100, help="Requests per workload")
+    run.add_argument("--duration", type=float, default=0.0, help="Seconds per workload (overrides --requests)")
+    run.add_argument("--users", type=int, default=20)
+    run.add_argument("--warmup", type=int, default=0, help="Unrecorded requests per workload first")
+    run.add_argument("--timeout", type=float, default=120.0)
+    run.add_argument("--repeat-inputs", action="store_true", help="Reuse identical inputs (exercises the LLM cache)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    run.add_argument("--spawn", action="store_true", help="Start fake Ollama and the API locally")
+    run.add_argument("--fake", default="", help="Arguments for benchmarks.fake_ollama when spawning")
+    run.add_argument("--api-workers", type=int, default=1)
+    run.add_argument("--api-env", action="append", default=[], help="KEY=VALUE for the spawned API (repeatable)")
+    run.add_argument("--bcrypt-rounds", type=int, default=4, help="password_hash_rounds for the spawned API")
+    run.add_argument("--stats-token", default="", help="The API's stats_token, to scrape /metrics (generated when spawning)")
+
+    cmp = commands.add_parser("compare", help="Compare two JSON reports")
+    cmp.add_argument("before")
+    cmp.add_argument("after")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.before) as f_before, open(args.after) as f_after:
+            print(json.dumps(compare(json.load(f_before), json.load(f_after)), indent=2))
+        return
+
+    args.workload = args.workload or ["mixed"]
+    if args.spawn:
+        with spawned_stack(args) as stack:
+            report = asyncio.run(run_benchmark(args, stack["base_url"], stack["db_path"]))
+    else:
+        report = asyncio.run(run_benchmark(args, args.base_url, None))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Throughput of the local resume pre-scorer.
+
+Generates synthetic resumes of realistic size and times
+``MLService.analyze_batch`` (full JSON-ready results) and
+``MLService.score_batch`` (arrays only) against a loop of single
+``analyze`` calls:
+
+    python -m benchmarks.ml_bench --resumes 5000 --batch-size 500
+"""
+import argparse
+import json
+import random
+import time
+
+from services.ml_service import ACTION_VERBS, SKILL_ALIASES, ml_service
+
+FILLER = (
+    "Worked with cross-functional teams on customer-facing features and internal tooling.",
+    "Participated in code reviews, design discussions and on-call rotations.",
+    "Collaborated with product and design to refine requirements.",
+)
+
+
+def synthetic_resume(rng: random.Random) -> str:
+    skills = rng.sample(sorted(SKILL_ALIASES), 12)
+    lines = ["Jane Doe", "jane@example.com | +1 555 0100", "", "Summary", "Engineer with a focus on reliable systems.", ""]
+    lines += ["Experience"]
+    for _ in range(rng.randint(6, 14)):
+        verb = rng.choice(ACTION_VERBS).capitalize()
+        skill = rng.choice(skills)
+        if rng.random() < 0.5:
+            lines.append(f"- {verb} {skill} services handling {rng.randint(2, 900)}k requests per day, cutting latency {rng.randint(5, 60)}%")
+        else:
+            lines.append(f"- {verb} {skill} tooling. {rng.choice(FILLER)}")
+    lines += ["", "Projects"] + [f"- {rng.choice(FILLER)} Used {rng.choice(skills)}." for _ in range(4)]
+    lines += ["", "Education", "B.Tech Computer Science, 2022", "", "Skills", ", ".join(skills)]
+    return "\n".join(lines)
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else float("inf")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--resumes", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--single", type=int, default=500, help="resumes scored one call at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    texts = [synthetic_resume(rng) for _ in range(args.resumes)]
+    batches = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+
+    ml_service.analyze(texts[0])  # warm caches
+
+    started = time.perf_counter()
+    for batch in batches:
+        ml_service.score_batch(batch)
+    score_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for batch in batches:
+        ml_service.analyze_batch(batch)
+    analyze_seconds = time.perf_counter() - started
+
+    single = texts[:args.single]
+    started = time.perf_counter()
+    for text in single:
+        ml_service.analyze(text)
+    single_seconds = time.perf_counter() - started
+
+    print(json.dumps({
+        "resumes": len(texts),
+        "avg_chars": round(sum(map(len, texts)) / len(texts)),
+        "batch_size": args.batch_size,
+        "score_batch_per_sec": _rate(len(texts), score_seconds),
+        "analyze_batch_per_sec": _rate(len(texts), analyze_seconds),
+        "analyze_single_per_sec": _rate(len(single), single_seconds),
+        "analyze_single_ms": round(single_seconds / len(single) * 1000, 3) if single else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
 from routes.health import router as health_router
 from routes.analyze import router as analyze_router
 from routes.resume import router as resume_router
@@ -10,29 +8,78 @@ from routes.projects import router as projects_router
 from routes.linkedin import router as linkedin_router
 from routes.auth import router as auth_router
 from routes.history import router as history_router
+from routes.jobs import router as jobs_router
 from settings import settings
 from rate_limiter import limiter
 from logger import logger
+from services.llm_client import close_client
+from services.llm_pool import llm_pool
+from services.warmup import model_warmer
+from services.bulk_jobs import bulk_job_runner
+from services.credits import run_reservation_sweeper
+from services.history_writer import history_writer
+from services.metrics import http_exceptions, http_request_duration, http_requests_in_flight
+from security import password_hasher
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import asyncio
 import time
 
 # Import models to ensure they are registered
 from models import user
 from models.user import User
-from models.history import AIHistory
+from models.history import AIHistory, HistoryBlob
+from models.credit import CreditReservation
+from models.bulk_job import BulkJob, BulkJobItem
 
-from database import engine, Base
+from database import engine, Base, dispose_async_engine
+from migrate_history import ensure_history_schema
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+# create_all skips columns and indexes on tables that already exist
+ensure_history_schema(engine)
+for index in AIHistory.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
 
-app = FastAPI(title=settings.app_name, debug=settings.debug)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Refund credit reservations left behind by crashed or killed requests
+    sweeper = asyncio.create_task(run_reservation_sweeper())
+    if settings.history_write_behind_enabled:
+        history_writer.start()
+    llm_pool.start_health_checks()
+    # Load models in the background; /health reports ready once they are warm
+    model_warmer.start()
+    # Claims queued bulk jobs and resumes ones whose worker died
+    bulk_job_runner.start()
+    yield
+    sweeper.cancel()
+    await bulk_job_runner.stop()
+    await model_warmer.stop()
+    await llm_pool.stop_health_checks()
+    # Drain buffered history rows before the process exits
+    await run_in_threadpool(history_writer.stop)
+    await dispose_async_engine()
+    await run_in_threadpool(password_hasher.shutdown)
+    # Release pooled upstream LLM connections on shutdown
+    await close_client()
+
+app = FastAPI(title=settings.app_name, debug=settings.debug, lifespan=lifespan)
+
+def _route_label(request: Request) -> str:
+    # Route template rather than the raw path, so ids don't explode cardinality
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
+    http_requests_in_flight.inc()
     try:
         response = await call_next(request)
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
+        http_request_duration.observe(process_time, request.method, _route_label(request), str(response.status_code))
 
         logger.info(
             f"{request.method} {request.url.path} "
@@ -41,7 +88,9 @@ async def log_requests(request: Request, call_next):
         )
         return response
     except Exception as e:
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
+        http_request_duration.observe(process_time, request.method, _route_label(request), "500")
+        http_exceptions.inc(type(e).__name__)
         logger.error(
             f"{request.method} {request.url.path} "
             f"Status: 500 "
@@ -49,6 +98,8 @@ async def log_requests(request: Request, call_next):
             f"Error: {str(e)}"
         )
         raise
+    finally:
+        http_requests_in_flight.dec()
 
 app.add_middleware(
     CORSMiddleware,
@@ -58,14 +109,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Rate limit exception handler
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
-    return JSONResponse(
-        status_code=429,
-        content={"detail": "Too many requests. Slow down."}
-    )
-
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -80,6 +123,7 @@ app.state.limiter = limiter
 
 app.include_router(auth_router)
 app.include_router(history_router)
+app.include_router(jobs_router)
 app.include_router(health_router)
 app.include_router(analyze_router)
 app.include_router(resume_router)
@@ -0,0 +1,90 @@
+"""
+Schema upgrade and data migration for the compact AIHistory format.
+
+``ensure_history_schema`` adds the new ai_history columns to databases
+created before they existed; it is cheap and runs at app startup.
+
+Running this module converts legacy rows (free-text input, Python-repr
+output) to the JSON/blob format in batches. The input is kept as the
+original string; only the output is parsed back into a structure:
+
+    python migrate_history.py [--batch-size 500] [--vacuum]
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from database import Base, SessionLocal, engine
+from logger import logger
+from models.history import AIHistory
+from services.history_store import fill_history_payloads, parse_legacy_text
+
+NEW_HISTORY_COLUMNS = ("input_blob_id", "input_preview", "output_encoding", "output_data", "output_preview")
+
+
+def ensure_history_schema(bind: Engine) -> None:
+    existing = {column["name"] for column in inspect(bind).get_columns(AIHistory.__tablename__)}
+    missing = [name for name in NEW_HISTORY_COLUMNS if name not in existing]
+    if not missing:
+        return
+
+    with bind.begin() as conn:
+        for name in missing:
+            column_type = AIHistory.__table__.c[name].type.compile(dialect=bind.dialect)
+            conn.execute(text(f"ALTER TABLE {AIHistory.__tablename__} ADD COLUMN {name} {column_type}"))
+    logger.info(f"Added ai_history columns: {', '.join(missing)}")
+
+
+def migrate_rows(batch_size: int = 500) -> int:
+    """Convert legacy rows in id order; safe to re-run and to interrupt."""
+    migrated = 0
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(AIHistory)
+                .filter(AIHistory.id > last_id, AIHistory.input_blob_id.is_(None), AIHistory.output_data.is_(None))
+                .order_by(AIHistory.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                return migrated
+
+            for row in rows:
+                fill_history_payloads(
+                    db,
+                    row,
+                    # Raw user text; parsing it would turn e.g. "123" or "null" into other types
+                    row.input_text if row.input_text is not None else "",
+                    parse_legacy_text(row.output_text),
+                )
+            db.commit()
+            migrated += len(rows)
+            last_id = rows[-1].id
+            logger.info(f"Migrated {migrated} history rows (last id {last_id})")
+        finally:
+            db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert AIHistory rows to the compact JSON/blob format.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true", help="Reclaim space afterwards (SQLite only)")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    ensure_history_schema(engine)
+    total = migrate_rows(args.batch_size)
+    print(f"Migrated {total} history rows")
+
+    if args.vacuum and engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+        print("Vacuumed database")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index, LargeBinary
+from sqlalchemy.sql import func
+from database import Base
+
+class BulkJob(Base):
+    __tablename__ = "bulk_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True, nullable=False)
+    feature_type = Column(String, nullable=False)  # resume
+    filename = Column(String)
+    status = Column(String, index=True, nullable=False, default="queued")  # queued | running | paused | completed | cancelled
+    total = Column(Integer, nullable=False, default=0)
+    succeeded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    # Worker currently processing the job; another worker may take over once the lease expires
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+class BulkJobItem(Base):
+    __tablename__ = "bulk_job_items"
+    __table_args__ = (
+        # Serves "next pending items of a job" and the ordered export
+        Index("ix_bulk_job_items_job_id_status_seq", "job_id", "status", "seq"),
+        Index("ix_bulk_job_items_job_id_seq", "job_id", "seq", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("bulk_jobs.id"), nullable=False)
+    seq = Column(Integer, nullable=False)  # position in the uploaded file
+    external_id = Column(String)  # "id" column/field of the record, if any
+    input_text = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | done | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    output_encoding = Column(String)  # json | json+zlib
+    output_data = Column(LargeBinary)
+    error = Column(Text)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
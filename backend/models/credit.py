@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+from database import Base
+
+class CreditReservation(Base):
+    __tablename__ = "credit_reservations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True, nullable=False)
+    feature_type = Column(String)
+    amount = Column(Integer, nullable=False)
+    status = Column(String, index=True, default="reserved")  # reserved | committed | refunded | expired
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
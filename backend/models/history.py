@@ -1,13 +1,38 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index, LargeBinary
 from sqlalchemy.sql import func
 from database import Base
 
+class HistoryBlob(Base):
+    """Content-addressed, per-user store for history input bodies."""
+    __tablename__ = "history_blobs"
+    __table_args__ = (
+        Index("ix_history_blobs_user_email_sha256", "user_email", "sha256", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    encoding = Column(String, nullable=False)  # json | json+zlib
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer)  # uncompressed JSON bytes
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class AIHistory(Base):
     __tablename__ = "ai_history"
+    __table_args__ = (
+        # Serves the per-user, newest-first keyset pagination in routes/history.py
+        Index("ix_ai_history_user_email_created_at", "user_email", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_email = Column(String, index=True)
     feature_type = Column(String)  # resume | project | linkedin
+    # Legacy free-text columns; new rows use the blob/encoded columns below
     input_text = Column(Text)
     output_text = Column(Text)
+    input_blob_id = Column(Integer, ForeignKey("history_blobs.id"))
+    input_preview = Column(Text)
+    output_encoding = Column(String)  # json | json+zlib
+    output_data = Column(LargeBinary)
+    output_preview = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
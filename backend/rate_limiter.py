@@ -1,25 +1,191 @@
 """
 Rate limiting configuration for the application.
+
+Limits are counted in ``services.quota_store`` (shared across worker
+processes with the default SQLite backend). A limited route checks its own
+per-route limit and, if it opts in with ``tier_cost``, the caller's tier
+quotas (``rate_limit_tier_quotas``) in one atomic store operation. Tier
+quota hits are refunded when the route raises, so only requests that got a
+result use up the allowance.
 """
-from fastapi import Request
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import asyncio
+import functools
+import logging
+from typing import Callable, Dict, List, Optional, Union
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from auth import resolve_principal
+from services.quota_store import QuotaCheck, QuotaDecision, QuotaStore, Rate, parse_rates, quota_store
 from settings import settings
-import jwt
+from user_cache import CachedUser
+
+logger = logging.getLogger(__name__)
+
+TIER_KEY_PREFIX = "tier:"
+
+
+class RateLimitExceeded(HTTPException):
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+def get_remote_address(request: Request) -> str:
+    return request.client.host if request.client else "127.0.0.1"
+
 
 def get_user_id_from_jwt(request: Request) -> str:
     """Extract user email from JWT token for per-user rate limiting"""
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return get_remote_address(request)  # Fallback to IP if no token
-    
-    token = auth_header.split(" ")[1]
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_email = payload.get("sub")
-        return user_email if user_email else get_remote_address(request)
-    except:
-        return get_remote_address(request)  # Fallback to IP if token invalid
+    # Decoded once per request and shared with get_current_user
+    user_email = resolve_principal(request)
+    return user_email if user_email else get_remote_address(request)  # Fallback to IP if no/invalid token
+
+
+class Limiter:
+    def __init__(self, key_func: Callable[[Request], str], store: QuotaStore, tier_quotas: Dict[str, str]):
+        self.key_func = key_func
+        self.store = store
+        self.enabled = settings.rate_limit_enabled
+        self.tier_quotas = {tier: parse_rates(rates) for tier, rates in tier_quotas.items()}
+
+    def _tier_checks(self, identity: str, tier: Optional[str], cost: int = 1) -> List[QuotaCheck]:
+        # Tier quotas are shared by every route that counts against them
+        return [
+            QuotaCheck(key=f"{TIER_KEY_PREFIX}{tier}:{rate.text}:{identity}", rate=rate, cost=cost)
+            for rate in self.tier_quotas.get(tier or "", [])
+        ]
+
+    def _checks(
+        self,
+        scope: str,
+        rates: List[Rate],
+        identity: str,
+        tier: Optional[str],
+        tier_cost: int = 0,
+    ) -> List[QuotaCheck]:
+        checks = [QuotaCheck(key=f"route:{scope}:{rate.text}:{identity}", rate=rate) for rate in rates]
+        if tier_cost > 0:
+            checks += self._tier_checks(identity, tier, tier_cost)
+        return checks
+
+    def _enforce(self, checks: List[QuotaCheck]) -> Optional[QuotaDecision]:
+        """Count the request or raise 429; returns the decision, or None if nothing was counted."""
+        try:
+            decision = self.store.hit(checks)
+        except Exception as e:
+            # Fail open: a broken limiter store must not take the API down
+            with self.store._stats_lock:
+                self.store.errors += 1
+            logger.error(f"Rate limit check failed: {str(e)}")
+            return None
+        if decision.allowed:
+            return decision
+        if decision.rejected.key.startswith(TIER_KEY_PREFIX):
+            detail = f"Usage quota for your plan reached ({decision.rejected.rate.text}). Try again later."
+        else:
+            detail = "Too many requests. Slow down."
+        raise RateLimitExceeded(detail, decision.retry_after)
+
+    def _refund_tier(self, checks: List[QuotaCheck], decision: Optional[QuotaDecision]) -> None:
+        tier_checks = [check for check in checks if check.key.startswith(TIER_KEY_PREFIX)]
+        if decision is None or not tier_checks:
+            return
+        try:
+            self.store.refund(tier_checks, decision.counted_at)
+        except Exception as e:
+            with self.store._stats_lock:
+                self.store.errors += 1
+            logger.error(f"Tier quota refund failed: {str(e)}")
+
+    def consume_tier_quota(self, identity: str, tier: Optional[str], cost: int = 1) -> Optional[QuotaDecision]:
+        """
+        Count ``cost`` requests against a user's tier quotas outside a route
+        (e.g. bulk job items), or raise 429. Pass the returned decision to
+        ``refund_tier_quota`` if the work then fails.
+        """
+        if not self.enabled:
+            return None
+        checks = self._tier_checks(identity, tier, cost)
+        return self._enforce(checks) if checks else None
+
+    def refund_tier_quota(self, identity: str, tier: Optional[str], decision: Optional[QuotaDecision], cost: int = 1) -> None:
+        self._refund_tier(self._tier_checks(identity, tier, cost), decision)
+
+    def limit(self, limit_value: str, tier_cost: Union[int, Callable[[Dict], int], None] = None) -> Callable:
+        """
+        Decorate a route with one or more rates (``"5/minute"``, ``"5/minute;100/day"``).
+
+        The route must take ``request: Request``. ``tier_cost`` opts the
+        route into the caller's tier quotas (it must also resolve a
+        ``CachedUser`` dependency): the number of requests a call counts, or
+        a function of the route's arguments returning it. Without it only the
+        route's own limit applies (routes that run no LLM work). Tier hits
+        are refunded when the route raises.
+        """
+        rates = parse_rates(limit_value)
+
+        def decorator(func: Callable) -> Callable:
+            scope = f"{func.__module__}.{func.__name__}"
+
+            def checks_for(kwargs) -> List[QuotaCheck]:
+                request = kwargs.get("request")
+                if not isinstance(request, Request):
+                    raise RuntimeError(f"{scope} must take a 'request: Request' argument to be rate limited")
+                user = next((value for value in kwargs.values() if isinstance(value, CachedUser)), None)
+                if tier_cost is None or user is None:
+                    cost = 0
+                else:
+                    cost = max(1, tier_cost(kwargs) if callable(tier_cost) else tier_cost)
+                return self._checks(scope, rates, self.key_func(request), user.tier if user else None, cost)
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    checks = checks_for(kwargs)
+                    in_process = self.store.backend == "memory"
+                    decision = self._enforce(checks) if in_process else await run_in_threadpool(self._enforce, checks)
+                    try:
+                        return await func(*args, **kwargs)
+                    except BaseException:
+                        if decision is None or len(checks) == len(rates):
+                            raise
+                        if in_process:
+                            self._refund_tier(checks, decision)
+                        else:
+                            # Shielded so a cancelled request still gets its refund
+                            await asyncio.shield(run_in_threadpool(self._refund_tier, checks, decision))
+                        raise
+                return async_wrapper
+
+            @functools.wraps(func)
+            def sync_wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                checks = checks_for(kwargs)
+                decision = self._enforce(checks)
+                try:
+                    return func(*args, **kwargs)
+                except BaseException:
+                    self._refund_tier(checks, decision)
+                    raise
+            return sync_wrapper
+
+        return decorator
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "tier_quotas": {tier: [rate.text for rate in rates] for tier, rates in self.tier_quotas.items()},
+            **self.store.stats(),
+        }
+
 
 # Create limiter instance
-limiter = Limiter(key_func=get_user_id_from_jwt)
+limiter = Limiter(
+    key_func=get_user_id_from_jwt,
+    store=quota_store,
+    tier_quotas=settings.rate_limit_tier_quotas,
+)
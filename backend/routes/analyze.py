@@ -1,16 +1,49 @@
-from fastapi import APIRouter, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from services.ml_service import ml_service
+from auth import get_current_user
+from user_cache import CachedUser
+from rate_limiter import limiter
+from settings import settings
 
 router = APIRouter()
 
 class AnalyzeRequest(BaseModel):
     text: str
+    role: Optional[str] = None
+
+class AnalyzeBatchRequest(BaseModel):
+    texts: List[str]
+    role: Optional[str] = None
 
 @router.post("/analyze")
 def analyze(request: AnalyzeRequest):
     try:
-        result = ml_service.analyze(request.text)
+        result = ml_service.analyze(request.text, request.role)
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analyze/batch")
+@limiter.limit("5/minute")
+def analyze_batch(
+    batch_request: AnalyzeBatchRequest,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    if not batch_request.texts:
+        raise HTTPException(status_code=400, detail="No texts provided")
+    if len(batch_request.texts) > settings.ml_batch_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many texts. Maximum is {settings.ml_batch_max_items} per batch.",
+        )
+    try:
+        return {"results": ml_service.analyze_batch(batch_request.texts, batch_request.role)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
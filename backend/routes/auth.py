@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from auth import create_access_token, get_current_user, get_db
+from auth import create_access_token, get_async_db, get_current_user
 from models.user import User
-from security import hash_password, verify_password
+from security import password_hasher
+from user_cache import CachedUser
 
 router = APIRouter(prefix="/auth")
 
@@ -27,7 +29,7 @@ class UserMeResponse(BaseModel):
     total_requests: int
 
 @router.get("/me", response_model=UserMeResponse)
-def me(current_user: User = Depends(get_current_user)):
+def me(current_user: CachedUser = Depends(get_current_user)):
     return UserMeResponse(
         email=current_user.email,
         credits=current_user.credits,
@@ -35,21 +37,22 @@ def me(current_user: User = Depends(get_current_user)):
     )
 
 @router.post("/register")
-def register(request: RegisterRequest, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        existing_user = db.query(User).filter(User.email == request.email).first()
+        existing_user = await db.scalar(select(User.id).where(User.email == request.email))
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already registered")
 
-        hashed_password = hash_password(request.password)
+        # Hashing runs in the password pool; the session holds no connection meanwhile
+        await db.rollback()
+        hashed_password = await password_hasher.hash(request.password)
         user = User(email=request.email, hashed_password=hashed_password)
         db.add(user)
         try:
-            db.commit()
+            await db.commit()
         except IntegrityError:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=400, detail="Email already registered")
-        db.refresh(user)
 
         access_token = create_access_token(subject=user.email)
         return TokenResponse(access_token=access_token)
@@ -59,13 +62,24 @@ def register(request: RegisterRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Register failed: {type(e).__name__}: {e}")
 
 @router.post("/login")
-def login(request: LoginRequest, db: Session = Depends(get_db)):
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        user = db.query(User).filter(User.email == request.email).first()
-        if not user or not verify_password(request.password, user.hashed_password):
+        stored_hash = await db.scalar(select(User.hashed_password).where(User.email == request.email))
+        await db.rollback()
+        if not stored_hash or not await password_hasher.verify(request.password, stored_hash):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        access_token = create_access_token(subject=user.email)
+        # Upgrade hashes made at a different cost while we have the plain password
+        new_hash = await password_hasher.rehash_if_needed(request.password, stored_hash)
+        if new_hash:
+            await db.execute(
+                update(User)
+                .where(User.email == request.email, User.hashed_password == stored_hash)
+                .values(hashed_password=new_hash)
+            )
+            await db.commit()
+
+        access_token = create_access_token(subject=request.email)
         return TokenResponse(access_token=access_token)
     except HTTPException:
         raise
@@ -1,7 +1,103 @@
-from fastapi import APIRouter
+import logging
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from rate_limiter import limiter
+from security import password_hasher
+from services.bulk_jobs import bulk_job_runner
+from services.cancellation import generation_tracker
+from services.history_writer import history_writer
+from services.idempotency import idempotency_store
+from services.llm_cache import llm_cache
+from services import llm_output
+from services.llm_pool import llm_pool
+from services import metrics
+from services.scheduler import llm_scheduler
+from services.singleflight import llm_singleflight
+from services.warmup import model_warmer
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def require_stats_token(request: Request) -> None:
+    """Allow the stats endpoints only with ``Authorization: Bearer <stats_token>``."""
+    if not settings.stats_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth_header = request.headers.get("Authorization", "")
+    token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else ""
+    if not secrets.compare_digest(token.encode("utf-8"), settings.stats_token.encode("utf-8")):
+        logger.warning(f"Rejected stats request to {request.url.path}")
+        raise HTTPException(status_code=401, detail="Invalid stats token", headers={"WWW-Authenticate": "Bearer"})
+
 
 router = APIRouter()
+# Operational stats and metrics: internal, token-gated
+stats_router = APIRouter(dependencies=[Depends(require_stats_token)])
 
 @router.get("/health")
-def health():
+def health(response: Response):
+    # Readiness: not ready until the configured models are loaded
+    if not model_warmer.ready:
+        response.status_code = 503
+        return {"status": "warming"}
     return {"status": "ok"}
+
+@router.get("/health/live")
+def liveness():
+    return {"status": "ok"}
+
+@stats_router.get("/health/warmup")
+def warmup_stats():
+    return model_warmer.stats()
+
+@stats_router.get("/health/cache")
+def cache_stats():
+    return llm_cache.stats()
+
+@stats_router.get("/health/singleflight")
+def singleflight_stats():
+    return llm_singleflight.stats()
+
+@stats_router.get("/health/scheduler")
+def scheduler_stats():
+    return llm_scheduler.stats()
+
+@stats_router.get("/health/history-writer")
+def history_writer_stats():
+    return history_writer.stats()
+
+@stats_router.get("/health/rate-limit")
+def rate_limit_stats():
+    return limiter.stats()
+
+@stats_router.get("/health/password-hasher")
+def password_hasher_stats():
+    return password_hasher.stats()
+
+@stats_router.get("/health/llm-backends")
+def llm_backend_stats():
+    return llm_pool.stats()
+
+@stats_router.get("/health/llm-output")
+def llm_output_stats():
+    return llm_output.stats()
+
+@stats_router.get("/health/bulk-jobs")
+def bulk_job_stats():
+    return bulk_job_runner.stats()
+
+@stats_router.get("/health/idempotency")
+def idempotency_stats():
+    return idempotency_store.stats()
+
+@stats_router.get("/health/cancellation")
+def cancellation_stats():
+    return generation_tracker.stats()
+
+@stats_router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+router.include_router(stats_router)
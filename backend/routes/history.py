@@ -1,31 +1,170 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+import base64
+import binascii
+import json
+from typing import Any, Optional
 
-from auth import get_current_user, get_db
-from models.history import AIHistory
-from models.user import User
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth import get_async_db, get_current_user
+from models.history import AIHistory, HistoryBlob
+from services.history_store import decode_payload, load_output, parse_legacy_text
+from settings import settings
+from user_cache import CachedUser
 
 router = APIRouter(prefix="/history")
 
+def _encode_cursor(record_id: int) -> str:
+    return base64.urlsafe_b64encode(str(record_id).encode()).decode()
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _as_text(payload: Any, legacy_text: Optional[str]) -> Optional[str]:
+    # input_text/output_text as the pre-pagination API returned them
+    if legacy_text is not None:
+        return legacy_text
+    if payload is None or isinstance(payload, str):
+        return payload
+    return json.dumps(payload, ensure_ascii=False)
+
 @router.get("/")
-def get_user_history(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+async def get_user_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    mode: str = Query("summary", pattern="^(summary|full)$"),
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Newest-first history, keyset-paginated on (created_at, id).
+
+    The response is ``{"items": [...], "next_cursor": ...}``; before
+    pagination it was a bare list of every row. ``summary`` mode (default)
+    returns metadata plus a short preview of the input and output; ``full``
+    mode returns the decoded ``input`` and ``output`` and, for clients of the
+    old list, the ``input_text`` / ``output_text`` fields it carried. Pass
+    the returned ``next_cursor`` back as ``cursor`` to fetch the next page.
+    """
+    if mode == "summary":
+        preview = settings.history_preview_chars
+        columns = [
+            AIHistory.id,
+            AIHistory.feature_type,
+            AIHistory.created_at,
+            # Legacy rows have no stored preview; cut one from the old text columns
+            func.coalesce(AIHistory.input_preview, func.substr(AIHistory.input_text, 1, preview)).label("input_preview"),
+            func.coalesce(AIHistory.output_preview, func.substr(AIHistory.output_text, 1, preview)).label("output_preview"),
+        ]
+    else:
+        columns = [
+            AIHistory.id,
+            AIHistory.feature_type,
+            AIHistory.created_at,
+            AIHistory.input_text,
+            AIHistory.output_text,
+            AIHistory.input_blob_id,
+            AIHistory.output_encoding,
+            AIHistory.output_data,
+        ]
+
+    query = select(*columns).where(AIHistory.user_email == current_user.email)
+
+    if cursor is not None:
+        cursor_id = _decode_cursor(cursor)
+        # Compare against the stored created_at of the cursor row so the
+        # comparison never depends on how the backend formats timestamps.
+        cursor_created_at = (
+            select(AIHistory.created_at)
+            .where(AIHistory.id == cursor_id, AIHistory.user_email == current_user.email)
+            .scalar_subquery()
+        )
+        query = query.where(
+            or_(
+                AIHistory.created_at < cursor_created_at,
+                and_(AIHistory.created_at == cursor_created_at, AIHistory.id < cursor_id),
+            )
+        )
+
+    result = await db.execute(
+        query.order_by(AIHistory.created_at.desc(), AIHistory.id.desc()).limit(limit + 1)
+    )
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if mode == "summary":
+        items = [
+            {
+                "id": r.id,
+                "user_email": current_user.email,
+                "feature_type": r.feature_type,
+                "input_preview": r.input_preview,
+                "output_preview": r.output_preview,
+                "created_at": r.created_at,
+            }
+            for r in rows
+        ]
+    else:
+        # One query for all input blobs on the page
+        blob_ids = {r.input_blob_id for r in rows if r.input_blob_id is not None}
+        blobs = {}
+        if blob_ids:
+            blob_rows = await db.execute(
+                select(HistoryBlob.id, HistoryBlob.encoding, HistoryBlob.data).where(HistoryBlob.id.in_(blob_ids))
+            )
+            blobs = {b.id: decode_payload(b.encoding, b.data) for b in blob_rows}
+        items = []
+        for r in rows:
+            input_payload = blobs.get(r.input_blob_id) if r.input_blob_id is not None else r.input_text
+            output_payload = (
+                decode_payload(r.output_encoding, r.output_data) if r.output_data is not None
+                else parse_legacy_text(r.output_text)
+            )
+            items.append({
+                "id": r.id,
+                "user_email": current_user.email,
+                "feature_type": r.feature_type,
+                "input": input_payload,
+                "output": output_payload,
+                "input_text": _as_text(input_payload, r.input_text),
+                "output_text": _as_text(output_payload, r.output_text),
+                "created_at": r.created_at,
+            })
+    return {
+        "items": items,
+        "next_cursor": _encode_cursor(rows[-1].id) if has_more else None,
+    }
+
+@router.get("/{history_id}")
+async def get_history_entry(
+    history_id: int,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    records = (
-        db.query(AIHistory)
-        .filter(AIHistory.user_email == current_user.email)
-        .order_by(AIHistory.created_at.desc())
-        .all()
+    result = await db.execute(
+        select(AIHistory).where(AIHistory.id == history_id, AIHistory.user_email == current_user.email)
     )
-    return [
-        {
-            "id": r.id,
-            "user_email": r.user_email,
-            "feature_type": r.feature_type,
-            "input_text": r.input_text,
-            "output_text": r.output_text,
-            "created_at": r.created_at,
-        }
-        for r in records
-    ]
+    record = result.scalars().first()
+    if record is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+
+    if record.input_blob_id is not None:
+        blob = await db.get(HistoryBlob, record.input_blob_id)
+        input_payload = decode_payload(blob.encoding, blob.data) if blob is not None else None
+    else:
+        # Legacy input is the user's raw text
+        input_payload = record.input_text
+
+    return {
+        "id": record.id,
+        "user_email": record.user_email,
+        "feature_type": record.feature_type,
+        "input": input_payload,
+        "output": load_output(record),
+        "created_at": record.created_at,
+    }
@@ -0,0 +1,132 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from auth import get_async_db, get_current_user
+from database import get_async_sessionmaker
+from models.bulk_job import BulkJob, BulkJobItem
+from rate_limiter import limiter
+from services.bulk_jobs import create_job, export_line, job_progress, parse_records, set_job_status
+from settings import settings
+from user_cache import CachedUser
+
+router = APIRouter(prefix="/jobs")
+
+EXPORT_PAGE_SIZE = 200
+
+async def _get_job(db: AsyncSession, job_id: int, user_email: str) -> BulkJob:
+    result = await db.execute(select(BulkJob).where(BulkJob.id == job_id, BulkJob.user_email == user_email))
+    job = result.scalars().first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/resume", status_code=202)
+@limiter.limit("5/minute")
+async def submit_resume_job(
+    request: Request,
+    file: UploadFile = File(...),
+    current_user: CachedUser = Depends(get_current_user),
+):
+    """
+    Queue a JSONL or CSV file of resumes for background analysis.
+
+    Each record needs a ``resume_text`` (or ``text``) field and may carry an
+    ``id`` that is echoed in the export. Every analyzed resume costs one
+    credit; a job pauses when the credits run out.
+    """
+    data = await file.read(settings.bulk_job_max_upload_bytes + 1)
+    if len(data) > settings.bulk_job_max_upload_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large. Maximum is {settings.bulk_job_max_upload_bytes} bytes.")
+    try:
+        records = parse_records(file.filename, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not records:
+        raise HTTPException(status_code=400, detail="No records in file")
+    if len(records) > settings.bulk_job_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many records. Maximum is {settings.bulk_job_max_items} per job.",
+        )
+
+    job = await run_in_threadpool(create_job, current_user.email, file.filename, records)
+    return {"job_id": job.id, "status": job.status, "total": job.total}
+
+@router.get("/")
+async def list_jobs(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    result = await db.execute(
+        select(BulkJob)
+        .where(BulkJob.user_email == current_user.email)
+        .order_by(BulkJob.created_at.desc(), BulkJob.id.desc())
+        .limit(limit)
+    )
+    return {"items": [job_progress(job) for job in result.scalars()]}
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: int,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return job_progress(await _get_job(db, job_id, current_user.email))
+
+@router.get("/{job_id}/results")
+async def export_job_results(
+    job_id: int,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Stream one JSON line per record, in upload order; available while the job runs."""
+    await _get_job(db, job_id, current_user.email)
+    await db.close()
+
+    async def lines():
+        after_seq = 0
+        while True:
+            # A short session per page so a slow client never pins a connection
+            async with get_async_sessionmaker()() as page_db:
+                rows = (
+                    await page_db.execute(
+                        select(
+                            BulkJobItem.seq,
+                            BulkJobItem.external_id,
+                            BulkJobItem.status,
+                            BulkJobItem.output_encoding,
+                            BulkJobItem.output_data,
+                            BulkJobItem.error,
+                        )
+                        .where(BulkJobItem.job_id == job_id, BulkJobItem.seq > after_seq)
+                        .order_by(BulkJobItem.seq)
+                        .limit(EXPORT_PAGE_SIZE)
+                    )
+                ).all()
+            if not rows:
+                return
+            yield "".join(export_line(row) for row in rows)
+            after_seq = rows[-1].seq
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="job-{job_id}-results.jsonl"'},
+    )
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: int, current_user: CachedUser = Depends(get_current_user)):
+    if not await run_in_threadpool(set_job_status, job_id, current_user.email, "cancelled", ("queued", "running", "paused")):
+        raise HTTPException(status_code=409, detail="Job is not queued, running or paused")
+    return {"job_id": job_id, "status": "cancelled"}
+
+@router.post("/{job_id}/resume")
+async def resume_job(job_id: int, current_user: CachedUser = Depends(get_current_user)):
+    """Requeue a paused or cancelled job; items already analyzed are not run again."""
+    if not await run_in_threadpool(set_job_status, job_id, current_user.email, "queued", ("paused", "cancelled")):
+        raise HTTPException(status_code=409, detail="Job is not paused or cancelled")
+    return {"job_id": job_id, "status": "queued"}
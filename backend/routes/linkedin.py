@@ -1,10 +1,15 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from services.ai_service import generate_linkedin_post
-from auth import get_current_user, get_db
-from models.user import User
-from models.history import AIHistory
+from starlette.concurrency import run_in_threadpool
+from services.ai_service import generate_linkedin_post, linkedin_prompts, stream_llm
+from services.cancellation import abort_on_disconnect
+from services.idempotency import idempotency_store
+from services.streaming import sse_response
+from services.scheduler import priority_for_tier
+from services.credits import commit_reservation, credit_reservation, refund_reservation, reserve_credits
+from auth import get_current_user
+from user_cache import CachedUser
 from rate_limiter import limiter
 
 router = APIRouter(prefix="/linkedin")
@@ -18,36 +23,52 @@ def get_linkedin():
     return {"message": "LinkedIn endpoint"}
 
 @router.post("/generate")
-@limiter.limit("5/minute")
-def generate_linkedin_route(
+@abort_on_disconnect()
+@idempotency_store.idempotent()
+@limiter.limit("5/minute", tier_cost=1)
+async def generate_linkedin_route(
     linkedin_request: LinkedInGenerateRequest,
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
 ):
-    if current_user.credits is not None and current_user.credits <= 0:
-        raise HTTPException(status_code=403, detail="No credits remaining")
-
-    # Check free tier limit
-    if current_user.tier == "free" and current_user.request_count >= 50:
-        raise HTTPException(status_code=429, detail="Free tier limit reached. Upgrade to continue.")
-    
+    input_payload = {"topic": linkedin_request.topic, "tone": linkedin_request.tone}
     try:
-        response = generate_linkedin_post(linkedin_request.topic, linkedin_request.tone)
-
-        history_entry = AIHistory(
-            user_email=current_user.email,
-            feature_type="linkedin",
-            input_text=str({"topic": linkedin_request.topic, "tone": linkedin_request.tone}),
-            output_text=str(response),
-        )
-        db.add(history_entry)
-        # Track usage
-        current_user.request_count += 1
-        current_user.total_requests += 1
-        if current_user.credits is not None:
-            current_user.credits -= 1
-        db.commit()
+        async with credit_reservation(current_user.email, "linkedin") as reservation:
+            response = await generate_linkedin_post(
+                linkedin_request.topic,
+                linkedin_request.tone,
+                priority_for_tier(current_user.tier),
+            )
+            await reservation.commit(input_payload, response)
         return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/generate/stream")
+@limiter.limit("5/minute", tier_cost=1)
+async def generate_linkedin_stream_route(
+    linkedin_request: LinkedInGenerateRequest,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    chunks = stream_llm(
+        *linkedin_prompts(linkedin_request.topic, linkedin_request.tone),
+        feature="linkedin",
+        priority=priority_for_tier(current_user.tier),
+    )
+
+    # Reserve once the input is prepared but before the response starts, so
+    # 403/429 are still plain HTTP errors and a failed setup holds no credit
+    reservation = await run_in_threadpool(reserve_credits, current_user.email, "linkedin")
+
+    def on_complete(response):
+        input_payload = {"topic": linkedin_request.topic, "tone": linkedin_request.tone}
+        commit_reservation(reservation, input_payload, response)
+
+    try:
+        return sse_response(chunks, on_complete, lambda: refund_reservation(reservation), feature="linkedin")
+    except BaseException:
+        await asyncio.shield(run_in_threadpool(refund_reservation, reservation))
+        raise
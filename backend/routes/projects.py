@@ -1,52 +1,111 @@
+import asyncio
+from typing import List
 from fastapi import APIRouter, HTTPException, Depends, Request
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from services.ai_service import enhance_bullet
-from auth import get_current_user, get_db
-from models.user import User
-from models.history import AIHistory
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from services.ai_service import enhance_bullet, enhance_bullets, bullet_prompts, stream_llm
+from services.cancellation import abort_on_disconnect
+from services.idempotency import idempotency_store
+from services.streaming import sse_response
+from services.scheduler import priority_for_tier
+from services.credits import commit_reservation, credit_reservation, refund_reservation, reserve_credits
+from auth import get_current_user
+from user_cache import CachedUser
 from rate_limiter import limiter
+from settings import settings
 
 router = APIRouter(prefix="/projects")
 
 class BulletEnhanceRequest(BaseModel):
     bullet: str
 
+class BulletBatchEnhanceRequest(BaseModel):
+    # Validated before the rate limiter counts the batch against the tier quotas
+    bullets: List[str] = Field(max_length=settings.projects_batch_max_bullets)
+
 @router.get("/")
 def get_projects():
     return {"message": "Projects endpoint"}
 
 @router.post("/enhance")
-@limiter.limit("5/minute")
-def enhance_bullet_route(
+@abort_on_disconnect()
+@idempotency_store.idempotent()
+@limiter.limit("5/minute", tier_cost=1)
+async def enhance_bullet_route(
     bullet_request: BulletEnhanceRequest,
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
 ):
-    if current_user.credits is not None and current_user.credits <= 0:
-        raise HTTPException(status_code=403, detail="No credits remaining")
-
-    # Check free tier limit
-    if current_user.tier == "free" and current_user.request_count >= 50:
-        raise HTTPException(status_code=429, detail="Free tier limit reached. Upgrade to continue.")
-    
     try:
-        response = enhance_bullet(bullet_request.bullet)
-
-        history_entry = AIHistory(
-            user_email=current_user.email,
-            feature_type="project",
-            input_text=bullet_request.bullet,
-            output_text=str(response),
-        )
-        db.add(history_entry)
-        # Track usage
-        current_user.request_count += 1
-        current_user.total_requests += 1
-        if current_user.credits is not None:
-            current_user.credits -= 1
-        db.commit()
+        async with credit_reservation(current_user.email, "project") as reservation:
+            response = await enhance_bullet(bullet_request.bullet, priority_for_tier(current_user.tier))
+            await reservation.commit(bullet_request.bullet, response)
         return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/enhance/stream")
+@limiter.limit("5/minute", tier_cost=1)
+async def enhance_bullet_stream_route(
+    bullet_request: BulletEnhanceRequest,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    chunks = stream_llm(
+        *bullet_prompts(bullet_request.bullet),
+        feature="project",
+        priority=priority_for_tier(current_user.tier),
+    )
+
+    # Reserve once the input is prepared but before the response starts, so
+    # 403/429 are still plain HTTP errors and a failed setup holds no credit
+    reservation = await run_in_threadpool(reserve_credits, current_user.email, "project")
+
+    def on_complete(response):
+        commit_reservation(reservation, bullet_request.bullet, response)
+
+    try:
+        return sse_response(chunks, on_complete, lambda: refund_reservation(reservation), feature="project")
+    except BaseException:
+        await asyncio.shield(run_in_threadpool(refund_reservation, reservation))
+        raise
+
+@router.post("/enhance/batch")
+@abort_on_disconnect()
+@idempotency_store.idempotent()
+# Each bullet counts as one request against the tier quotas
+@limiter.limit("5/minute", tier_cost=lambda kwargs: len(kwargs["batch_request"].bullets))
+async def enhance_bullets_batch_route(
+    batch_request: BulletBatchEnhanceRequest,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    bullets = batch_request.bullets
+    if not bullets:
+        raise HTTPException(status_code=400, detail="No bullets provided")
+
+    # Each bullet costs one credit and counts as one request; unused credits are refunded
+    async with credit_reservation(current_user.email, "project_batch", len(bullets)) as reservation:
+        outcomes = await enhance_bullets(bullets, priority_for_tier(current_user.tier))
+
+        results = []
+        succeeded = []
+        for index, (bullet, outcome) in enumerate(zip(bullets, outcomes)):
+            if isinstance(outcome, HTTPException):
+                results.append({"index": index, "bullet": bullet, "status": "error", "detail": outcome.detail})
+            else:
+                results.append({"index": index, "bullet": bullet, "status": "ok", "result": outcome})
+                succeeded.append(outcome)
+
+        # Only successfully enhanced bullets are charged; one history row per batch
+        if succeeded:
+            await reservation.commit(bullets, succeeded, used=len(succeeded))
+
+    return {
+        "results": results,
+        "succeeded": len(succeeded),
+        "failed": len(bullets) - len(succeeded),
+        "credits_charged": len(succeeded),
+    }
@@ -1,52 +1,91 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from services.ai_service import analyze_resume
-from auth import get_current_user, get_db
-from models.user import User
-from models.history import AIHistory
+from starlette.concurrency import run_in_threadpool
+from services.ai_service import analyze_resume, resume_prompts, stream_llm
+from services.prompt_compaction import compact_resume
+from services.resume_diff import analyze_resume_incremental
+from services.cancellation import abort_on_disconnect
+from services.idempotency import idempotency_store
+from services.streaming import sse_response
+from services.scheduler import priority_for_tier
+from services.credits import commit_reservation, credit_reservation, refund_reservation, reserve_credits
+from auth import get_current_user
+from user_cache import CachedUser
 from rate_limiter import limiter
+from settings import settings
 
 router = APIRouter(prefix="/resume")
 
 class ResumeAnalyzeRequest(BaseModel):
     resume_text: str
+    # Re-analyze only the sections changed since the last incremental analysis
+    incremental: bool = False
 
 @router.get("/")
 def get_resume():
     return {"message": "Resume endpoint"}
 
 @router.post("/analyze")
-@limiter.limit("5/minute")
-def analyze_resume_route(
+@abort_on_disconnect()
+@idempotency_store.idempotent()
+@limiter.limit("5/minute", tier_cost=1)
+async def analyze_resume_route(
     resume_request: ResumeAnalyzeRequest,
     request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    http_response: Response,
+    current_user: CachedUser = Depends(get_current_user),
 ):
-    if current_user.credits is not None and current_user.credits <= 0:
-        raise HTTPException(status_code=403, detail="No credits remaining")
-
-    # Check free tier limit
-    if current_user.tier == "free" and current_user.request_count >= 50:
-        raise HTTPException(status_code=429, detail="Free tier limit reached. Upgrade to continue.")
-    
     try:
-        response = analyze_resume(resume_request.resume_text)
-
-        history_entry = AIHistory(
-            user_email=current_user.email,
-            feature_type="resume",
-            input_text=resume_request.resume_text,
-            output_text=str(response),
-        )
-        db.add(history_entry)
-        # Track usage
-        current_user.request_count += 1
-        current_user.total_requests += 1
-        if current_user.credits is not None:
-            current_user.credits -= 1
-        db.commit()
+        compacted = compact_resume(resume_request.resume_text)
+        priority = priority_for_tier(current_user.tier)
+        async with credit_reservation(current_user.email, "resume") as reservation:
+            if resume_request.incremental and settings.resume_incremental_enabled:
+                response = await analyze_resume_incremental(compacted.text, current_user.email, priority)
+                tokens_sent = response["incremental"]["prompt_tokens"]
+                # Nothing changed since the last analysis: no LLM call, no charge
+                used = 0 if not response["incremental"]["analyzed_sections"] else None
+            else:
+                response = await analyze_resume(compacted.text, priority)
+                tokens_sent = None
+                used = None
+            await reservation.commit(resume_request.resume_text, response, used)
+        http_response.headers.update(compacted.headers(tokens_sent))
         return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analyze/stream")
+@limiter.limit("5/minute", tier_cost=1)
+async def analyze_resume_stream_route(
+    resume_request: ResumeAnalyzeRequest,
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+):
+    compacted = compact_resume(resume_request.resume_text)
+    chunks = stream_llm(
+        *resume_prompts(compacted.text),
+        feature="resume",
+        priority=priority_for_tier(current_user.tier),
+    )
+
+    # Reserve once the input is prepared but before the response starts, so
+    # 403/429 are still plain HTTP errors and a failed setup holds no credit
+    reservation = await run_in_threadpool(reserve_credits, current_user.email, "resume")
+
+    def on_complete(response):
+        commit_reservation(reservation, resume_request.resume_text, response)
+
+    try:
+        return sse_response(
+            chunks,
+            on_complete,
+            lambda: refund_reservation(reservation),
+            headers=compacted.headers(),
+            feature="resume",
+        )
+    except BaseException:
+        await asyncio.shield(run_in_threadpool(refund_reservation, reservation))
+        raise
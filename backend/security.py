@@ -1,11 +1,128 @@
+"""
+Password hashing.
+
+bcrypt is deliberately slow (~250ms of CPU at cost 12) and holds the GIL
+while it runs, so the async helpers run it in a small dedicated process
+pool instead of on the event loop or the shared threadpool. At most
+``password_hash_max_pending`` hashes may be queued or running; further
+register/login attempts are rejected with 503 rather than queueing without
+bound behind a login flood.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
 import bcrypt
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from settings import settings
 
-def hash_password(password: str) -> str:
+
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
     password_bytes = password.encode("utf-8")
-    hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds or settings.password_hash_rounds))
     return hashed.decode("utf-8")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     plain_bytes = plain_password.encode("utf-8")
     hashed_bytes = hashed_password.encode("utf-8")
     return bcrypt.checkpw(plain_bytes, hashed_bytes)
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """Cost factor of a ``$2b$<cost>$...`` hash, or None if it is not bcrypt."""
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hash_rounds(hashed_password) != settings.password_hash_rounds
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.rejected = 0
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sign-in attempts in progress. Please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        try:
+            executor = self._executor()
+            if executor is None:
+                return await run_in_threadpool(func, *args)
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(hash_password, password, settings.password_hash_rounds)
+        self.hashed += 1
+        return hashed
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        matches = await self._run(verify_password, plain_password, hashed_password)
+        self.verified += 1
+        return matches
+
+    async def rehash_if_needed(self, plain_password: str, hashed_password: str) -> Optional[str]:
+        """New hash at the configured cost if ``hashed_password`` uses another one."""
+        if not needs_rehash(hashed_password):
+            return None
+        try:
+            new_hash = await self.hash(plain_password)
+        except HTTPException:
+            # Under load the upgrade simply waits for a later login
+            return None
+        self.rehashed += 1
+        return new_hash
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rounds": settings.password_hash_rounds,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "hashed": self.hashed,
+            "verified": self.verified,
+            "rehashed": self.rehashed,
+            "rejected": self.rejected,
+        }
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
@@ -1,80 +1,282 @@
+import asyncio
 import json
 import logging
-import requests
-from typing import Dict, Any
+import time
+import httpx
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
 from fastapi import HTTPException
 from settings import settings
+from services.cancellation import deadline_scope, generation_tracker
+from services.llm_cache import cache_enabled_for, llm_cache, make_cache_key
+from services.llm_client import get_client
+from services.llm_output import decode, output_format, record_parse
+from services.llm_pool import Backend, llm_pool, status_error
+from services.metrics import UpstreamTimer, record_llm_error, record_ollama_stats
+from services.scheduler import PRIORITY_FREE, llm_scheduler
+from services.singleflight import llm_singleflight
 
 logger = logging.getLogger(__name__)
 
-def call_llm(system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+LLM_OPTIONS = {
+    "temperature": 0.3,
+    "top_p": 0.9
+}
+
+def _check_provider() -> None:
     if settings.provider != "ollama":
         error_msg = "Only Ollama provider enabled in this build."
         logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
-    
-    url = f"{settings.ollama_base_url}/api/chat"
-    
+
+def _chat_payload(system_prompt: str, user_prompt: str, stream: bool, feature: Optional[str] = None) -> Dict[str, Any]:
     data = {
         "model": settings.model_name,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        "stream": False,
-        "options": {
-            "temperature": 0.3,
-            "top_p": 0.9
-        }
+        "stream": stream,
+        "options": LLM_OPTIONS,
+        "keep_alive": settings.ollama_keep_alive
     }
-    
+    fmt = output_format(feature)
+    if fmt is not None:
+        data["format"] = fmt
+    return data
+
+def parse_llm_content(content: str, feature: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Parse the model's message content into the structured JSON output.
+
+    Output that is not valid JSON is repaired locally where possible
+    (see ``services.llm_output``) instead of failing the request.
+    """
+    if not content:
+        error_msg = "Ollama returned empty response"
+        logger.error(error_msg)
+        record_llm_error(settings.model_name, "empty_response")
+        raise HTTPException(status_code=500, detail=error_msg)
+
     try:
-        response = requests.post(url, json=data, timeout=60)
-        
+        result, step = decode(content)
+    except ValueError:
+        record_parse(feature, None, failed=True)
+        error_msg = "LLM returned invalid JSON format"
+        logger.error(error_msg)
+        record_llm_error(settings.model_name, "invalid_output_json")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    record_parse(feature, step)
+    if step is not None:
+        logger.info(f"Repaired LLM output for {feature or 'unknown'} ({step})")
+    return result
+
+def _raise_for_transport_error(e: httpx.HTTPError) -> None:
+    if isinstance(e, httpx.TimeoutException):
+        error_msg = "Ollama request timed out."
+        logger.error(error_msg)
+        record_llm_error(settings.model_name, "timeout")
+        raise HTTPException(status_code=408, detail=error_msg)
+    if isinstance(e, httpx.ConnectError):
+        error_msg = "Cannot connect to Ollama. Ensure Ollama is running."
+        logger.error(error_msg)
+        record_llm_error(settings.model_name, "connect")
+        raise HTTPException(status_code=500, detail=error_msg)
+    error_msg = f"API request failed: {str(e)}"
+    logger.error(error_msg)
+    record_llm_error(settings.model_name, "transport")
+    raise HTTPException(status_code=500, detail=error_msg)
+
+def _cache_key(system_prompt: str, user_prompt: str, feature: Optional[str] = None) -> str:
+    return make_cache_key(settings.model_name, LLM_OPTIONS, system_prompt, user_prompt, output_format(feature))
+
+async def call_llm(
+    system_prompt: str,
+    user_prompt: str,
+    feature: Optional[str] = None,
+    priority: int = PRIORITY_FREE,
+) -> Dict[str, Any]:
+    """
+    Run one chat completion and return the parsed JSON output.
+
+    When ``feature`` is given and caching is enabled for it, identical
+    requests are answered from the LLM result cache. Identical requests
+    that are already in flight share a single upstream call. Upstream
+    calls are admitted through the LLM scheduler at ``priority``. Inside a
+    request scope (``services.cancellation``) the queue wait and the call
+    are bounded by the request's deadline.
+    """
+    _check_provider()
+
+    key = _cache_key(system_prompt, user_prompt, feature)
+    use_cache = cache_enabled_for(feature)
+    if use_cache:
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+    async def generate() -> Dict[str, Any]:
+        async with llm_scheduler.slot(priority):
+            result = await _generate(system_prompt, user_prompt, feature)
+        if use_cache:
+            await llm_cache.set(key, feature, result)
+        return result
+
+    async with deadline_scope():
+        if not settings.llm_singleflight_enabled:
+            return await generate()
+        return await llm_singleflight.do(key, generate)
+
+async def _generate(system_prompt: str, user_prompt: str, feature: Optional[str] = None) -> Dict[str, Any]:
+    data = _chat_payload(system_prompt, user_prompt, stream=False, feature=feature)
+    client = get_client()
+
+    try:
+        with UpstreamTimer(settings.model_name, "generate") as timer:
+            async def send(backend: Backend) -> httpx.Response:
+                timer.connected = None
+                return await client.post(f"{backend.url}/api/chat", json=data, extensions={"trace": timer.trace})
+
+            started = time.monotonic()
+            try:
+                lease, response = await llm_pool.open(settings.model_name, send)
+            except asyncio.CancelledError:
+                # Closing the connection makes Ollama stop generating
+                generation_tracker.cancelled("generate", time.monotonic() - started)
+                raise
+            generation_tracker.completed("generate", time.monotonic() - started)
+            lease.finish(status_error(response))
+
         logger.info(f"Ollama status: {response.status_code}")
-        
+
         if response.status_code != 200:
             error_msg = f"Ollama error: {response.text}"
             logger.error(error_msg)
+            record_llm_error(settings.model_name, "upstream_status")
             raise HTTPException(status_code=500, detail=error_msg)
-        
+
         try:
             data = response.json()
         except json.JSONDecodeError:
             error_msg = "Ollama returned invalid JSON"
             logger.error(error_msg)
+            record_llm_error(settings.model_name, "invalid_upstream_json")
             raise HTTPException(status_code=500, detail=error_msg)
-        
+
+        record_ollama_stats(settings.model_name, data)
         content = data.get("message", {}).get("content")
-        if not content:
-            error_msg = "Ollama returned empty response"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
-        
+        return parse_llm_content(content, feature)
+
+    except httpx.HTTPError as e:
+        _raise_for_transport_error(e)
+
+async def stream_llm(
+    system_prompt: str,
+    user_prompt: str,
+    feature: Optional[str] = None,
+    priority: int = PRIORITY_FREE,
+) -> AsyncIterator[str]:
+    """
+    Stream the model's message content from Ollama chunk by chunk.
+
+    Yields the incremental ``message.content`` strings as Ollama produces
+    them. Callers are responsible for joining the chunks and parsing the
+    final text with ``parse_llm_content``. A cache hit is replayed as a
+    single chunk; a completed, parseable stream is written to the cache.
+    """
+    _check_provider()
+
+    use_cache = cache_enabled_for(feature)
+    if use_cache:
+        cache_key = _cache_key(system_prompt, user_prompt, feature)
+        cached = await llm_cache.get(cache_key)
+        if cached is not None:
+            yield json.dumps(cached)
+            return
+
+    parts = []
+    async with llm_scheduler.slot(priority):
+        async for content in _generate_stream(system_prompt, user_prompt, feature):
+            parts.append(content)
+            yield content
+
+    if use_cache:
+        # Parse without recording; the caller's parse of the same text is the one counted
         try:
-            structured_output = json.loads(content)
-        except json.JSONDecodeError:
-            error_msg = "LLM returned invalid JSON format"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
-        
-        return structured_output
-    
-    except requests.exceptions.Timeout:
-        error_msg = "Ollama request timed out."
-        logger.error(error_msg)
-        raise HTTPException(status_code=408, detail=error_msg)
-    except requests.exceptions.ConnectionError:
-        error_msg = "Cannot connect to Ollama. Ensure Ollama is running."
-        logger.error(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
-    except requests.exceptions.RequestException as e:
-        error_msg = f"API request failed: {str(e)}"
-        logger.error(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
+            result, _ = decode("".join(parts))
+        except ValueError:
+            return
+        await llm_cache.set(cache_key, feature, result)
+
+async def _generate_stream(system_prompt: str, user_prompt: str, feature: Optional[str] = None) -> AsyncIterator[str]:
+    data = _chat_payload(system_prompt, user_prompt, stream=True, feature=feature)
+    client = get_client()
+
+    try:
+        with UpstreamTimer(settings.model_name, "stream") as timer:
+            async def send(backend: Backend) -> httpx.Response:
+                timer.connected = None
+                request = client.build_request(
+                    "POST", f"{backend.url}/api/chat", json=data, extensions={"trace": timer.trace}
+                )
+                return await client.send(request, stream=True)
+
+            # Failover happens here, before any chunk has been yielded
+            started = time.monotonic()
+            lease, response = await llm_pool.open(settings.model_name, send)
+            error = None
+            try:
+                logger.info(f"Ollama status: {response.status_code}")
+
+                if response.status_code != 200:
+                    error = status_error(response)
+                    body = await response.aread()
+                    error_msg = f"Ollama error: {body.decode('utf-8', errors='replace')}"
+                    logger.error(error_msg)
+                    record_llm_error(settings.model_name, "upstream_status")
+                    raise HTTPException(status_code=500, detail=error_msg)
+
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except json.JSONDecodeError:
+                        error_msg = "Ollama returned invalid JSON"
+                        logger.error(error_msg)
+                        record_llm_error(settings.model_name, "invalid_upstream_json")
+                        raise HTTPException(status_code=500, detail=error_msg)
 
-def analyze_resume(resume_text: str) -> Dict[str, Any]:
-    system_prompt = "You are a strict technical recruiter. Score resumes realistically (0-100). Penalize weak resumes heavily. Reward quantified impact and technical skills. Return ONLY valid JSON. Do NOT use markdown. Do NOT add explanation. Do NOT add text outside JSON."
+                    if chunk.get("error"):
+                        error_msg = f"Ollama error: {chunk['error']}"
+                        logger.error(error_msg)
+                        record_llm_error(settings.model_name, "upstream_error")
+                        raise HTTPException(status_code=500, detail=error_msg)
+
+                    content = chunk.get("message", {}).get("content")
+                    if content:
+                        timer.mark_first_token()
+                        yield content
+                    if chunk.get("done"):
+                        record_ollama_stats(settings.model_name, chunk)
+                        generation_tracker.completed("stream", time.monotonic() - started)
+                        break
+            except (httpx.HTTPError, asyncio.CancelledError, GeneratorExit) as e:
+                error = e
+                if not isinstance(e, httpx.HTTPError):
+                    generation_tracker.cancelled("stream", time.monotonic() - started)
+                raise
+            finally:
+                await response.aclose()
+                lease.finish(error)
+
+    except httpx.HTTPError as e:
+        _raise_for_transport_error(e)
+
+RESUME_SYSTEM_PROMPT = "You are a strict technical recruiter. Score resumes realistically (0-100). Penalize weak resumes heavily. Reward quantified impact and technical skills. Return ONLY valid JSON. Do NOT use markdown. Do NOT add explanation. Do NOT add text outside JSON."
+
+def resume_prompts(resume_text: str) -> Tuple[str, str]:
+    system_prompt = RESUME_SYSTEM_PROMPT
     user_prompt = f"""
     Analyze this resume and respond with JSON in this exact format:
     {{
@@ -83,14 +285,40 @@ def analyze_resume(resume_text: str) -> Dict[str, Any]:
       "weaknesses": [],
       "suggestions": []
     }}
-    
+
     Resume: {resume_text}
     """
-    
-    return call_llm(system_prompt, user_prompt)
+    return system_prompt, user_prompt
 
-def enhance_bullet(bullet: str) -> Dict[str, Any]:
-    system_prompt = "You are an expert resume writer. Rewrite bullets to be strong, action-oriented, and concise. Create impact versions with quantification. Do NOT invent metrics, percentages, or impact numbers. Only improve wording. If no measurable data is provided, do not fabricate it. Return ONLY valid JSON. Do NOT use markdown. Do NOT add explanation. Do NOT add text outside JSON."
+def resume_section_prompts(sections: List[Tuple[str, str]], other_sections: List[str]) -> Tuple[str, str]:
+    system_prompt = RESUME_SYSTEM_PROMPT
+    rendered = "\n\n".join(f"[{name}]\n{text}" for name, text in sections)
+    others = ", ".join(other_sections) if other_sections else "none"
+    user_prompt = f"""
+    Analyze each of these {len(sections)} resume sections on its own and respond with JSON in this exact format:
+    {{
+      "sections": [
+        {{
+          "section": "...",
+          "score": number,
+          "strengths": [],
+          "weaknesses": [],
+          "suggestions": []
+        }}
+      ]
+    }}
+
+    Use the section names in square brackets. The resume also has these sections, analyzed separately: {others}.
+
+    Sections:
+    {rendered}
+    """
+    return system_prompt, user_prompt
+
+BULLET_SYSTEM_PROMPT = "You are an expert resume writer. Rewrite bullets to be strong, action-oriented, and concise. Create impact versions with quantification. Do NOT invent metrics, percentages, or impact numbers. Only improve wording. If no measurable data is provided, do not fabricate it. Return ONLY valid JSON. Do NOT use markdown. Do NOT add explanation. Do NOT add text outside JSON."
+
+def bullet_prompts(bullet: str) -> Tuple[str, str]:
+    system_prompt = BULLET_SYSTEM_PROMPT
     user_prompt = f"""
     Rewrite this bullet point and respond with JSON in this exact format:
     {{
@@ -98,13 +326,32 @@ def enhance_bullet(bullet: str) -> Dict[str, Any]:
       "enhanced": "...",
       "impact_version": "..."
     }}
-    
+
     Original: {bullet}
     """
-    
-    return call_llm(system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
+def bullet_batch_prompts(bullets: List[str]) -> Tuple[str, str]:
+    system_prompt = BULLET_SYSTEM_PROMPT
+    numbered = "\n".join(f"{i + 1}. {bullet}" for i, bullet in enumerate(bullets))
+    user_prompt = f"""
+    Rewrite each of these {len(bullets)} bullet points, keeping their order, and respond with JSON in this exact format:
+    {{
+      "items": [
+        {{
+          "original": "...",
+          "enhanced": "...",
+          "impact_version": "..."
+        }}
+      ]
+    }}
+
+    Originals:
+    {numbered}
+    """
+    return system_prompt, user_prompt
 
-def generate_linkedin_post(topic: str, tone: str) -> Dict[str, Any]:
+def linkedin_prompts(topic: str, tone: str) -> Tuple[str, str]:
     system_prompt = "You are a LinkedIn content expert. Create strong hooks, 6-10 line bodies, and engaging CTAs. Tone can be professional, confident, or storytelling. Return ONLY valid JSON. Do NOT use markdown. Do NOT add explanation. Do NOT add text outside JSON."
     user_prompt = f"""
     Generate a LinkedIn post about "{topic}" with a "{tone}" tone and respond with JSON in this exact format:
@@ -113,22 +360,81 @@ def generate_linkedin_post(topic: str, tone: str) -> Dict[str, Any]:
       "body": "...",
       "cta": "..."
     }}
-    
+
     Topic: {topic}
     Tone: {tone}
     """
-    
-    return call_llm(system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
+async def analyze_resume(resume_text: str, priority: int = PRIORITY_FREE) -> Dict[str, Any]:
+    # Routes pass text already run through prompt_compaction.compact_resume
+    return await call_llm(*resume_prompts(resume_text), feature="resume", priority=priority)
+
+async def enhance_bullet(bullet: str, priority: int = PRIORITY_FREE) -> Dict[str, Any]:
+    return await call_llm(*bullet_prompts(bullet), feature="project", priority=priority)
+
+async def generate_linkedin_post(topic: str, tone: str, priority: int = PRIORITY_FREE) -> Dict[str, Any]:
+    return await call_llm(*linkedin_prompts(topic, tone), feature="linkedin", priority=priority)
+
+BULLET_FIELDS = ("original", "enhanced", "impact_version")
+
+def _is_bullet_result(item: Any) -> bool:
+    return isinstance(item, dict) and all(isinstance(item.get(field), str) for field in BULLET_FIELDS)
+
+async def _enhance_bullets_packed(bullets: List[str], priority: int) -> List[Optional[Dict[str, Any]]]:
+    """One structured call for the whole list; unusable items come back as None."""
+    try:
+        response = await call_llm(*bullet_batch_prompts(bullets), feature="project_batch", priority=priority)
+    except HTTPException as e:
+        if e.status_code == 503:
+            # Overloaded: fanning out would only add more queued work
+            raise
+        logger.error(f"Packed bullet batch failed, falling back to fan-out: {e.detail}")
+        return [None] * len(bullets)
+
+    items = response.get("items") if isinstance(response, dict) else None
+    if not isinstance(items, list) or len(items) != len(bullets):
+        logger.error("Packed bullet batch returned a mismatched item list, falling back to fan-out")
+        return [None] * len(bullets)
+    return [item if _is_bullet_result(item) else None for item in items]
+
+async def enhance_bullets(
+    bullets: List[str],
+    priority: int = PRIORITY_FREE,
+) -> List[Union[Dict[str, Any], HTTPException]]:
+    """
+    Enhance a list of bullets, returning one result or error per bullet.
+
+    Small batches are packed into a single prompt so the long system prompt
+    is paid once. Larger batches, and any items the packed call could not
+    produce, are fanned out as individual calls with bounded concurrency.
+    """
+    results: List[Union[Dict[str, Any], HTTPException, None]] = [None] * len(bullets)
+    if len(bullets) <= settings.projects_batch_pack_threshold:
+        results = await _enhance_bullets_packed(bullets, priority)
+
+    semaphore = asyncio.Semaphore(settings.projects_batch_concurrency)
+
+    async def enhance_one(index: int) -> None:
+        async with semaphore:
+            try:
+                results[index] = await enhance_bullet(bullets[index], priority)
+            except HTTPException as e:
+                results[index] = e
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    await asyncio.gather(*(enhance_one(i) for i in pending))
+    return results
 
 class AIService:
-    def analyze_resume(self, resume_text: str):
-        return analyze_resume(resume_text)
+    async def analyze_resume(self, resume_text: str):
+        return await analyze_resume(resume_text)
 
-    def enhance_bullet(self, bullet: str):
-        return enhance_bullet(bullet)
+    async def enhance_bullet(self, bullet: str):
+        return await enhance_bullet(bullet)
 
-    def generate_linkedin_post(self, topic: str, tone: str):
-        return generate_linkedin_post(topic, tone)
+    async def generate_linkedin_post(self, topic: str, tone: str):
+        return await generate_linkedin_post(topic, tone)
 
     def analyze_projects(self, data):
         return {"analysis": "Mock projects analysis"}
@@ -0,0 +1,555 @@
+"""
+Bulk resume analysis jobs.
+
+A job is created from an uploaded JSONL or CSV file: every record becomes a
+``bulk_job_items`` row, so the upload itself is the checkpoint. The
+``BulkJobRunner`` in each API process claims runnable jobs with a
+time-limited lease, feeds their pending items through ``analyze_resume``
+at ``PRIORITY_BACKGROUND`` with ``bulk_job_concurrency`` items in flight,
+and stores each result together with its credit charge in one transaction
+(``commit_reservation`` with a checkpoint). After a crash or restart the
+lease runs out, the job is claimed again and only items that are still
+pending are processed.
+
+An item that fails is retried on a later pass until it has been attempted
+``bulk_job_max_attempts`` times; a 503 from the LLM scheduler (overload)
+does not count as an attempt, the item just waits for a later pass. A job
+whose owner runs out of credits or tier quota is paused and can be resumed
+once credits are topped up (or the quota window has moved on). An item
+takes its tier quota hit before the LLM call, and gets it back if no result
+is kept.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from models.bulk_job import BulkJob, BulkJobItem
+from models.user import User
+from rate_limiter import limiter
+from services.ai_service import analyze_resume
+from services.credits import credit_reservation
+from services.history_store import decode_payload, encode_payload
+from services.metrics import registry
+from services.prompt_compaction import compact_resume
+from services.scheduler import PRIORITY_BACKGROUND
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+TEXT_FIELDS = ("resume_text", "text")
+ACTIVE_STATUSES = ("queued", "running")
+INSERT_BATCH_SIZE = 500
+
+bulk_job_items = registry.counter(
+    "bulk_job_items_total",
+    "Bulk job items processed, by outcome (done, retry, deferred, failed).",
+    ("outcome",),
+)
+
+
+class JobPaused(Exception):
+    """The job's owner can no longer be charged (no credits, tier limit)."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _record(seq: int, record: Dict[str, Any]) -> Tuple[Optional[str], str]:
+    text = next((record[field] for field in TEXT_FIELDS if record.get(field)), None)
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError(f"Record {seq}: missing {' or '.join(TEXT_FIELDS)}")
+    external_id = record.get("id")
+    return (str(external_id) if external_id not in (None, "") else None), text
+
+
+def parse_records(filename: Optional[str], data: bytes) -> List[Tuple[Optional[str], str]]:
+    """(external id, resume text) per record of a JSONL or CSV upload."""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("File must be UTF-8 encoded")
+
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        is_jsonl = False
+    elif name.endswith((".jsonl", ".ndjson", ".json")):
+        is_jsonl = True
+    else:
+        is_jsonl = text.lstrip().startswith("{")
+
+    records = []
+    if is_jsonl:
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                raise ValueError(f"Line {line_number}: invalid JSON")
+            if not isinstance(record, dict):
+                raise ValueError(f"Line {line_number}: expected a JSON object")
+            records.append(_record(len(records) + 1, record))
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or not any(field in TEXT_FIELDS for field in map(str.lower, reader.fieldnames)):
+            raise ValueError(f"CSV needs a {' or '.join(TEXT_FIELDS)} column")
+        for row in reader:
+            records.append(_record(len(records) + 1, {k.lower(): v for k, v in row.items() if k}))
+    return records
+
+
+def create_job(user_email: str, filename: Optional[str], records: List[Tuple[Optional[str], str]]) -> BulkJob:
+    db = SessionLocal()
+    try:
+        job = BulkJob(
+            user_email=user_email,
+            feature_type="resume",
+            filename=filename,
+            status="queued",
+            total=len(records),
+            succeeded=0,
+            failed=0,
+        )
+        db.add(job)
+        db.flush()
+        for start in range(0, len(records), INSERT_BATCH_SIZE):
+            db.execute(
+                insert(BulkJobItem),
+                [
+                    {"job_id": job.id, "seq": seq, "external_id": external_id, "input_text": text, "status": "pending", "attempts": 0}
+                    for seq, (external_id, text) in enumerate(records[start:start + INSERT_BATCH_SIZE], start=start + 1)
+                ],
+            )
+        db.commit()
+        db.refresh(job)
+        return job
+    finally:
+        db.close()
+
+
+def set_job_status(job_id: int, user_email: str, status: str, from_statuses: Tuple[str, ...]) -> bool:
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(BulkJob)
+            .where(BulkJob.id == job_id, BulkJob.user_email == user_email, BulkJob.status.in_(from_statuses))
+            .values(status=status, error=None, lease_owner=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+
+def job_progress(job: BulkJob) -> Dict[str, Any]:
+    processed = job.succeeded + job.failed
+    progress = {
+        "id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "total": job.total,
+        "succeeded": job.succeeded,
+        "failed": job.failed,
+        "pending": job.total - processed,
+        "progress": round(processed / job.total, 4) if job.total else 1.0,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "items_per_minute": None,
+        "eta_seconds": None,
+    }
+    if job.started_at is not None and processed:
+        started_at = job.started_at if job.started_at.tzinfo else job.started_at.replace(tzinfo=timezone.utc)
+        finished_at = job.finished_at or _now()
+        if finished_at.tzinfo is None:
+            finished_at = finished_at.replace(tzinfo=timezone.utc)
+        elapsed = max((finished_at - started_at).total_seconds(), 1e-6)
+        rate = processed / elapsed
+        progress["items_per_minute"] = round(rate * 60, 2)
+        if job.status in ACTIVE_STATUSES:
+            progress["eta_seconds"] = round((job.total - processed) / rate, 1)
+    return progress
+
+
+def export_line(item: Any) -> str:
+    record: Dict[str, Any] = {"seq": item.seq, "id": item.external_id, "status": item.status}
+    if item.status == "done" and item.output_data is not None:
+        record["result"] = decode_payload(item.output_encoding, item.output_data)
+    elif item.error:
+        record["error"] = item.error
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class BulkJobRunner:
+    def __init__(
+        self,
+        enabled: bool,
+        concurrency: int,
+        max_attempts: int,
+        lease_seconds: float,
+        poll_interval: float,
+    ):
+        self.enabled = enabled
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._task: Optional[asyncio.Task] = None
+        self.current_job: Optional[int] = None
+        self.in_flight = 0
+        self.jobs_finished = 0
+        self.items_done = 0
+        self.items_failed = 0
+        self.item_retries = 0
+        self.items_deferred = 0
+
+    def _lease_expiry(self) -> datetime:
+        return _now() + timedelta(seconds=self.lease_seconds)
+
+    # -- DB steps (run in the threadpool) --
+
+    def _claim(self) -> Optional[int]:
+        now = _now()
+        claimable = or_(
+            BulkJob.status == "queued",
+            (BulkJob.status == "running") & (BulkJob.lease_expires_at < now),
+        )
+        db = SessionLocal()
+        try:
+            candidates = db.execute(
+                select(BulkJob.id).where(claimable).order_by(BulkJob.created_at, BulkJob.id).limit(5)
+            ).scalars().all()
+            for job_id in candidates:
+                result = db.execute(
+                    update(BulkJob)
+                    .where(BulkJob.id == job_id, claimable)
+                    .values(status="running", lease_owner=self.worker_id, lease_expires_at=self._lease_expiry())
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    db.execute(
+                        update(BulkJob)
+                        .where(BulkJob.id == job_id, BulkJob.started_at.is_(None))
+                        .values(started_at=now)
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.commit()
+                    return job_id
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+    def _renew_lease(self, job_id: int) -> bool:
+        """Extend the lease; False if the job is no longer ours (cancelled, paused or taken over)."""
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(BulkJob)
+                .where(BulkJob.id == job_id, BulkJob.status == "running", BulkJob.lease_owner == self.worker_id)
+                .values(lease_expires_at=self._lease_expiry())
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                db.rollback()
+                return False
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def _next_items(self, job_id: int, after_seq: int, limit: int) -> Optional[List[Any]]:
+        """Renew the lease and return the next pending items, or None if the job is no longer ours."""
+        if not self._renew_lease(job_id):
+            return None
+        db = SessionLocal()
+        try:
+            return db.execute(
+                select(BulkJobItem.id, BulkJobItem.seq, BulkJobItem.input_text, BulkJobItem.attempts)
+                .where(BulkJobItem.job_id == job_id, BulkJobItem.status == "pending", BulkJobItem.seq > after_seq)
+                .order_by(BulkJobItem.seq)
+                .limit(limit)
+            ).all()
+        finally:
+            db.close()
+
+    def _checkpoint_done(self, job_id: int, item_id: int, result: Dict[str, Any], db: Session) -> bool:
+        encoding, data, _ = encode_payload(result)
+        updated = db.execute(
+            update(BulkJobItem)
+            .where(BulkJobItem.id == item_id, BulkJobItem.status == "pending")
+            .values(status="done", output_encoding=encoding, output_data=data, error=None, attempts=BulkJobItem.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if updated.rowcount != 1:
+            # Another worker already stored this item; the charge is refunded
+            return False
+        db.execute(
+            update(BulkJob)
+            .where(BulkJob.id == job_id)
+            .values(succeeded=BulkJob.succeeded + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return True
+
+    def _record_failure(self, job_id: int, item_id: int, error: str, final: bool) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(BulkJobItem)
+                .where(BulkJobItem.id == item_id)
+                .values(status="failed" if final else "pending", error=error, attempts=BulkJobItem.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            if final:
+                db.execute(
+                    update(BulkJob)
+                    .where(BulkJob.id == job_id)
+                    .values(failed=BulkJob.failed + 1)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(BulkJob)
+                .where(BulkJob.id == job_id, BulkJob.status == "running", BulkJob.lease_owner == self.worker_id)
+                .values(
+                    status=status,
+                    error=error,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    finished_at=_now() if status == "completed" else None,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    # -- processing --
+
+    async def _process_item(self, job_id: int, user_email: str, tier: Optional[str], item: Any) -> None:
+        failure: Optional[HTTPException] = None
+        charged = False
+        try:
+            async with credit_reservation(user_email, "resume") as reservation:
+                # Each item counts against the owner's tier quotas before any LLM
+                # work; over quota, the reservation is refunded and the job pauses
+                quota = await run_in_threadpool(limiter.consume_tier_quota, user_email, tier)
+                try:
+                    compacted = compact_resume(item.input_text)
+                    result = await analyze_resume(compacted.text, PRIORITY_BACKGROUND)
+                except HTTPException as e:
+                    # Left unsettled, so the reservation is refunded on exit
+                    failure = e
+                else:
+                    charged = await reservation.commit(
+                        None,
+                        None,
+                        record_history=False,
+                        checkpoint=partial(self._checkpoint_done, job_id, item.id, result),
+                    )
+                finally:
+                    if not charged:
+                        # No result was kept (failed, cancelled or already done elsewhere)
+                        await asyncio.shield(
+                            run_in_threadpool(limiter.refund_tier_quota, user_email, tier, quota)
+                        )
+        except HTTPException as e:
+            # Only the reservation and the quota check raise here: the owner cannot be charged
+            raise JobPaused(e.detail)
+
+        if failure is None and not charged:
+            logger.warning(f"Bulk job {job_id} item {item.seq} was already completed by another worker")
+            return
+        if failure is None:
+            self.items_done += 1
+            bulk_job_items.inc("done")
+            return
+
+        if failure.status_code == 503:
+            # Overloaded (e.g. background work queued behind interactive traffic):
+            # the item stays pending with its attempts untouched; back off
+            self.items_deferred += 1
+            bulk_job_items.inc("deferred")
+            await asyncio.sleep(self.poll_interval)
+            return
+
+        final = item.attempts + 1 >= self.max_attempts
+        await run_in_threadpool(self._record_failure, job_id, item.id, str(failure.detail), final)
+        if final:
+            self.items_failed += 1
+            bulk_job_items.inc("failed")
+            logger.error(f"Bulk job {job_id} item {item.seq} failed: {failure.detail}")
+        else:
+            self.item_retries += 1
+            bulk_job_items.inc("retry")
+
+    async def _heartbeat(self, job_id: int, lost: asyncio.Event) -> None:
+        # Items can take minutes each (queue wait + generation), so renew on a
+        # timer rather than per batch
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await run_in_threadpool(self._renew_lease, job_id):
+                lost.set()
+                return
+
+    async def _run_job(self, job_id: int) -> None:
+        lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, lost))
+        try:
+            await self._process_job(job_id, lost)
+        finally:
+            heartbeat.cancel()
+
+    async def _process_job(self, job_id: int, lost: asyncio.Event) -> None:
+        user_email, tier = await run_in_threadpool(self._job_owner, job_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(item: Any) -> None:
+            async with semaphore:
+                if lost.is_set():
+                    return
+                self.in_flight += 1
+                try:
+                    await self._process_item(job_id, user_email, tier, item)
+                finally:
+                    self.in_flight -= 1
+
+        after_seq = 0
+        while True:
+            items = await run_in_threadpool(self._next_items, job_id, after_seq, self.concurrency * 4)
+            if items is None:
+                logger.info(f"Bulk job {job_id} stopped (cancelled, paused or taken over)")
+                return
+            if not items:
+                if after_seq == 0:
+                    await run_in_threadpool(self._finish, job_id, "completed")
+                    self.jobs_finished += 1
+                    logger.info(f"Bulk job {job_id} completed")
+                    return
+                # Start another pass for items left pending by failed attempts
+                after_seq = 0
+                continue
+
+            results = await asyncio.gather(*(process(item) for item in items), return_exceptions=True)
+            if lost.is_set():
+                logger.info(f"Bulk job {job_id} stopped (cancelled, paused or taken over)")
+                return
+            for result in results:
+                if isinstance(result, JobPaused):
+                    await run_in_threadpool(self._finish, job_id, "paused", str(result))
+                    logger.info(f"Bulk job {job_id} paused: {result}")
+                    return
+                if isinstance(result, BaseException):
+                    raise result
+            after_seq = items[-1].seq
+
+    def _job_owner(self, job_id: int) -> Tuple[str, Optional[str]]:
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                select(BulkJob.user_email, User.tier)
+                .outerjoin(User, User.email == BulkJob.user_email)
+                .where(BulkJob.id == job_id)
+            ).one()
+            return row.user_email, row.tier
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job_id = await run_in_threadpool(self._claim)
+                if job_id is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                self.current_job = job_id
+                logger.info(f"Bulk job {job_id} claimed by {self.worker_id}")
+                try:
+                    await self._run_job(job_id)
+                finally:
+                    # No-op once the job finished or paused; otherwise (error,
+                    # shutdown) pending items can be claimed again right away
+                    await asyncio.shield(run_in_threadpool(self._release_lease, job_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Bulk job runner failed: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+            finally:
+                self.current_job = None
+
+    def _release_lease(self, job_id: int) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(BulkJob)
+                .where(BulkJob.id == job_id, BulkJob.status == "running", BulkJob.lease_owner == self.worker_id)
+                .values(lease_expires_at=_now())
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # In-flight items stay pending; _run releases the lease on the way out
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "current_job": self.current_job,
+            "in_flight": self.in_flight,
+            "jobs_finished": self.jobs_finished,
+            "items_done": self.items_done,
+            "items_failed": self.items_failed,
+            "item_retries": self.item_retries,
+            "items_deferred": self.items_deferred,
+        }
+
+
+bulk_job_runner = BulkJobRunner(
+    enabled=settings.bulk_jobs_enabled,
+    concurrency=settings.bulk_job_concurrency,
+    max_attempts=settings.bulk_job_max_attempts,
+    lease_seconds=settings.bulk_job_lease_seconds,
+    poll_interval=settings.bulk_job_poll_interval,
+)
@@ -0,0 +1,251 @@
+"""
+Request deadlines and client-disconnect cancellation for LLM work.
+
+``abort_on_disconnect`` opens a ``RequestScope`` for a route: it carries the
+request's deadline (``request_deadline_seconds`` from the start of the
+route) and watches the connection. ``call_llm`` reads the scope, so the
+deadline covers the scheduler queue and the upstream call alike; once it
+passes, the call is cancelled and the route gets a 504. When the client
+disconnects, the route handler is cancelled. Either way the cancellation
+reaches the upstream HTTP request, which is closed, so Ollama stops
+generating and frees the slot. Streaming routes need no scope: Starlette
+already stops the stream when its client leaves.
+
+A request carrying an ``Idempotency-Key`` is not cancelled on disconnect:
+the client is expected to retry with the same key, and the retry should
+get this generation's result (see ``services.idempotency``) rather than
+start a new one. Its deadline still applies.
+
+Credits and history for cancelled work:
+
+- cancelled before the result exists (queued or generating): the credit
+  reservation is refunded and no history is written,
+- cancelled after the result exists (the reservation is being committed):
+  the commit finishes, the credits are kept and the history row is written,
+  since the user can still read the result from their history.
+
+Counters:
+
+- ``llm_generations_cancelled_total{mode,reason}``: upstream generations
+  aborted before they completed; ``llm_generation_reclaimed_seconds_total``
+  estimates the generation time saved from the average duration of
+  completed generations,
+- ``llm_generations_abandoned_total``: requests whose generation
+  completed although the client had already gone (disconnect noticed too
+  late, or ``abort_on_client_disconnect`` disabled),
+- ``http_requests_cancelled_total{route,reason}``: requests ended early by a
+  disconnect or deadline.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import HTTPException, Request, Response
+
+from services.idempotency import IDEMPOTENCY_HEADER
+from services.metrics import registry
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Non-standard status logged for requests whose client went away (nginx convention)
+CLIENT_CLOSED_REQUEST = 499
+
+generations_cancelled = registry.counter(
+    "llm_generations_cancelled_total",
+    "Upstream LLM generations aborted before completion, by mode and reason (client_disconnect, deadline, other).",
+    ("mode", "reason"),
+)
+generation_seconds_spent = registry.counter(
+    "llm_generation_cancelled_seconds_total",
+    "Upstream time already spent on generations that were then aborted.",
+    ("mode",),
+)
+generation_seconds_reclaimed = registry.counter(
+    "llm_generation_reclaimed_seconds_total",
+    "Estimated generation time saved by aborting upstream generations early.",
+    ("mode",),
+)
+generations_abandoned = registry.counter(
+    "llm_generations_abandoned_total",
+    "Requests whose generation completed although the client had already gone.",
+)
+requests_cancelled = registry.counter(
+    "http_requests_cancelled_total",
+    "Requests ended early because the client disconnected or the deadline passed.",
+    ("route", "reason"),
+)
+
+
+@dataclass
+class RequestScope:
+    deadline: Optional[float] = None  # time.monotonic() value
+    disconnected: bool = False
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+
+_scope: contextvars.ContextVar[Optional[RequestScope]] = contextvars.ContextVar("request_scope", default=None)
+
+
+def current_scope() -> Optional[RequestScope]:
+    return _scope.get()
+
+
+def cancel_reason(mode: str = "generate") -> str:
+    scope = _scope.get()
+    if scope is not None and scope.disconnected:
+        return "client_disconnect"
+    if scope is not None and scope.expired():
+        return "deadline"
+    # Streams are only closed early by their consumer going away
+    return "client_disconnect" if mode == "stream" else "other"
+
+
+class GenerationTracker:
+    """Average upstream generation time per mode, to estimate what an abort saves."""
+
+    def __init__(self):
+        self._avg_seconds: Dict[str, float] = {}
+
+    def completed(self, mode: str, seconds: float) -> None:
+        avg = self._avg_seconds.get(mode)
+        self._avg_seconds[mode] = seconds if avg is None else 0.8 * avg + 0.2 * seconds
+
+    def cancelled(self, mode: str, seconds: float) -> None:
+        reason = cancel_reason(mode)
+        generations_cancelled.inc(mode, reason)
+        generation_seconds_spent.inc(mode, amount=seconds)
+        reclaimed = max(0.0, self._avg_seconds.get(mode, 0.0) - seconds)
+        generation_seconds_reclaimed.inc(mode, amount=reclaimed)
+        logger.info(f"Aborted upstream {mode} call after {seconds:.2f}s ({reason})")
+
+    def stats(self) -> Dict[str, Any]:
+        modes = ("generate", "stream")
+        return {
+            "abort_on_client_disconnect": settings.abort_on_client_disconnect,
+            "request_deadline_seconds": settings.request_deadline_seconds,
+            "avg_generation_seconds": {mode: round(avg, 4) for mode, avg in self._avg_seconds.items()},
+            "cancelled": {
+                mode: {
+                    reason: int(generations_cancelled.value(mode, reason))
+                    for reason in ("client_disconnect", "deadline", "other")
+                }
+                for mode in modes
+            },
+            "spent_seconds": {mode: round(generation_seconds_spent.value(mode), 4) for mode in modes},
+            "reclaimed_seconds": {mode: round(generation_seconds_reclaimed.value(mode), 4) for mode in modes},
+            "abandoned": int(generations_abandoned.value()),
+        }
+
+
+generation_tracker = GenerationTracker()
+
+
+@asynccontextmanager
+async def deadline_scope() -> AsyncIterator[None]:
+    """Cancel the block when the current request's deadline passes; raises 504."""
+    scope = _scope.get()
+    remaining = scope.remaining() if scope is not None else None
+    if remaining is None:
+        yield
+        return
+    if remaining <= 0:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    try:
+        async with asyncio.timeout(remaining):
+            yield
+    except TimeoutError:
+        error_msg = "Request deadline exceeded"
+        logger.error(error_msg)
+        raise HTTPException(status_code=504, detail=error_msg)
+
+
+async def _wait_for_disconnect(request: Request, scope: RequestScope) -> None:
+    # The body has been read by the time the route runs, so the next
+    # message is the disconnect (or the end of the response)
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            scope.disconnected = True
+            return
+
+
+def abort_on_disconnect() -> Callable:
+    """
+    Decorate an async route so its LLM work runs under a request deadline
+    and is cancelled when the client disconnects.
+
+    The route must take ``request: Request``. Place it directly under the
+    ``@router`` decorator so it covers idempotency waits and rate limits.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs.get("request")
+            if not isinstance(request, Request):
+                return await func(*args, **kwargs)
+
+            deadline = settings.request_deadline_seconds
+            scope = RequestScope(deadline=time.monotonic() + deadline if deadline > 0 else None)
+            token = _scope.set(scope)
+            try:
+                # Tasks copy the context, so the handler and everything it awaits see the scope
+                handler = asyncio.ensure_future(func(*args, **kwargs))
+                watcher = asyncio.ensure_future(_wait_for_disconnect(request, scope))
+            finally:
+                _scope.reset(token)
+
+            route = getattr(request.scope.get("route"), "path", request.url.path)
+            # A retry with the same key picks up the result, so let it finish
+            keep_running = settings.idempotency_enabled and IDEMPOTENCY_HEADER in request.headers
+            try:
+                await asyncio.wait(
+                    {handler, watcher},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not handler.done() and settings.abort_on_client_disconnect and not keep_running:
+                    handler.cancel()
+                    try:
+                        await handler
+                    except asyncio.CancelledError:
+                        # Only the handler's own cancellation is expected here; one
+                        # aimed at this task (shutdown, an outer timeout) must propagate
+                        task = asyncio.current_task()
+                        if task is not None and task.cancelling():
+                            raise
+                    except Exception:
+                        pass
+                    requests_cancelled.inc(route, "client_disconnect")
+                    logger.info(f"Client disconnected from {request.method} {route}; cancelled its generation")
+                    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+                result = await handler
+                if scope.disconnected and not keep_running:
+                    generations_abandoned.inc()
+                return result
+            except HTTPException as e:
+                if e.status_code == 504 and scope.expired():
+                    requests_cancelled.inc(route, "deadline")
+                raise
+            finally:
+                watcher.cancel()
+                if not handler.done():
+                    # The route itself was cancelled (e.g. server shutdown)
+                    handler.cancel()
+
+        return wrapper
+
+    return decorator
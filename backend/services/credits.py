@@ -0,0 +1,305 @@
+"""
+Credit ledger for the AI routes.
+
+A request reserves its credits up front with one conditional ``UPDATE``
+(so concurrent requests from the same user cannot overspend), runs the LLM
+call without holding a DB session, then either commits the reservation
+together with its history row or refunds it. Reservations that are never
+settled (crashed worker, killed task) are refunded by ``expire_reservations``
+once they pass ``credit_reservation_ttl_seconds``.
+
+Reserving also counts the request against the free tier's lifetime
+request allowance (``request_count``), so that check is atomic as well and
+does not depend on rate limiting being enabled. Refunds give the request
+back. Tier quotas in the rate limiter only add rate windows on top.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import case, or_, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from models.credit import CreditReservation
+from models.user import User
+from services.history_store import build_history_entry
+from services.history_writer import PendingHistory, history_writer
+from settings import settings
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+FREE_TIER_REQUEST_LIMIT = 50
+
+
+@dataclass
+class Reservation:
+    id: int
+    user_email: str
+    feature_type: str
+    amount: int
+    settled: bool = False
+
+    async def commit(self, input_payload: Any, output_payload: Any, used: Optional[int] = None, **kwargs: Any) -> bool:
+        settle = asyncio.ensure_future(
+            run_in_threadpool(commit_reservation, self, input_payload, output_payload, used, **kwargs)
+        )
+        try:
+            return await asyncio.shield(settle)
+        except asyncio.CancelledError:
+            # The result exists: finish charging and recording it before the
+            # cancellation reaches credit_reservation, which would refund it
+            await settle
+            raise
+
+    async def refund(self) -> None:
+        await run_in_threadpool(refund_reservation, self)
+
+
+def _adjust_user(db, user_email: str, credits_delta: int, requests_delta: int, total_delta: int = 0) -> None:
+    db.execute(
+        update(User)
+        .where(User.email == user_email)
+        .values(
+            credits=User.credits + credits_delta,
+            request_count=User.request_count + requests_delta,
+            total_requests=User.total_requests + total_delta,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _recharge_expired(db, reservation: Reservation, used: int, total_delta: int) -> None:
+    """Charge ``used`` again for an expired reservation, never taking credits below zero."""
+    available = db.query(User.credits).filter(User.email == reservation.user_email).scalar()
+    if available is not None and available < used:
+        # The refunded credits were spent elsewhere meanwhile
+        logger.warning(
+            f"User {reservation.user_email} is {used - max(available, 0)} credits short for expired "
+            f"reservation {reservation.id}; charging only what is left"
+        )
+    db.execute(
+        update(User)
+        .where(User.email == reservation.user_email)
+        .values(
+            # Clamped in the statement itself, so a concurrent reservation cannot push it negative
+            credits=case((User.credits < used, 0), else_=User.credits - used),
+            request_count=User.request_count + used,
+            total_requests=User.total_requests + total_delta,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _rejection(db, user_email: str, amount: int) -> HTTPException:
+    user = db.query(User).filter(User.email == user_email).first()
+    if user is None or not user.is_active:
+        return HTTPException(status_code=401, detail="Invalid user")
+    if user.credits is not None and user.credits < amount:
+        if amount == 1:
+            return HTTPException(status_code=403, detail="No credits remaining")
+        return HTTPException(status_code=403, detail="Not enough credits for this batch")
+    return HTTPException(status_code=429, detail="Free tier limit reached. Upgrade to continue.")
+
+
+def reserve_credits(user_email: str, feature_type: str, amount: int = 1) -> Reservation:
+    """Atomically take ``amount`` credits, or raise 403/429 if the user cannot afford them."""
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=settings.credit_reservation_ttl_seconds)
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(User)
+            .where(
+                User.email == user_email,
+                User.is_active.is_(True),
+                or_(User.credits.is_(None), User.credits >= amount),
+                or_(User.tier != "free", User.request_count + amount <= FREE_TIER_REQUEST_LIMIT),
+            )
+            .values(
+                credits=User.credits - amount,
+                request_count=User.request_count + amount,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            raise _rejection(db, user_email, amount)
+
+        reservation = CreditReservation(
+            user_email=user_email,
+            feature_type=feature_type,
+            amount=amount,
+            status="reserved",
+            expires_at=expires_at,
+        )
+        db.add(reservation)
+        db.commit()
+        reservation_id = reservation.id
+    finally:
+        db.close()
+
+    user_cache.invalidate(user_email)
+    return Reservation(id=reservation_id, user_email=user_email, feature_type=feature_type, amount=amount)
+
+
+def commit_reservation(
+    reservation: Reservation,
+    input_payload: Any,
+    output_payload: Any,
+    used: Optional[int] = None,
+    record_history: bool = True,
+    checkpoint: Optional[Callable[[Session], bool]] = None,
+) -> bool:
+    """
+    Settle a reservation: keep ``used`` credits (default: all) and refund the
+    rest. The history row and usage counter are written in the same
+    transaction, or handed to the write-behind stage when it is running.
+
+    ``checkpoint`` runs inside the settlement transaction, so callers that
+    keep their own record of the result (bulk jobs) persist it atomically
+    with the charge; they usually pass ``record_history=False``. A
+    checkpoint that returns False (the result was already recorded, e.g. by
+    another worker) rolls the settlement back and the reservation is
+    refunded instead. Returns whether the reservation was charged.
+    """
+    used = reservation.amount if used is None else used
+    deferred = history_writer.running and record_history
+    total_delta = 0 if deferred else used
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(CreditReservation)
+            .where(CreditReservation.id == reservation.id, CreditReservation.status == "reserved")
+            .values(status="committed", amount=used)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            unused = reservation.amount - used
+            _adjust_user(db, reservation.user_email, unused, -unused, total_delta=total_delta)
+        else:
+            # Expired and refunded while the generation was still running;
+            # the user got the result, so charge it again.
+            logger.warning(f"Credit reservation {reservation.id} settled after expiry")
+            _recharge_expired(db, reservation, used, total_delta)
+
+        if checkpoint is not None and not checkpoint(db):
+            db.rollback()
+            charged = False
+        else:
+            if record_history and not deferred:
+                db.add(
+                    build_history_entry(
+                        db,
+                        reservation.user_email,
+                        reservation.feature_type,
+                        input_payload,
+                        output_payload,
+                    )
+                )
+            db.commit()
+            charged = True
+    finally:
+        db.close()
+
+    if not charged:
+        refund_reservation(reservation)
+        return False
+
+    reservation.settled = True
+    user_cache.invalidate(reservation.user_email)
+
+    if deferred:
+        history_writer.submit(
+            PendingHistory(
+                user_email=reservation.user_email,
+                feature_type=reservation.feature_type,
+                input_payload=input_payload,
+                output_payload=output_payload,
+                used=used,
+            )
+        )
+    return True
+
+
+def _release(reservation_id: int, user_email: str, amount: int, status: str) -> bool:
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(CreditReservation)
+            .where(CreditReservation.id == reservation_id, CreditReservation.status == "reserved")
+            .values(status=status)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            return False
+        _adjust_user(db, user_email, amount, -amount)
+        db.commit()
+    finally:
+        db.close()
+
+    user_cache.invalidate(user_email)
+    return True
+
+
+def refund_reservation(reservation: Reservation) -> None:
+    if reservation.settled:
+        return
+    _release(reservation.id, reservation.user_email, reservation.amount, "refunded")
+    reservation.settled = True
+
+
+def expire_reservations() -> int:
+    """Refund reservations that were never settled. Returns how many were expired."""
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        stale = (
+            db.query(CreditReservation.id, CreditReservation.user_email, CreditReservation.amount)
+            .filter(CreditReservation.status == "reserved", CreditReservation.expires_at < now)
+            .all()
+        )
+    finally:
+        db.close()
+
+    expired = 0
+    for reservation_id, user_email, amount in stale:
+        if _release(reservation_id, user_email, amount, "expired"):
+            expired += 1
+    if expired:
+        logger.info(f"Expired {expired} orphaned credit reservations")
+    return expired
+
+
+async def run_reservation_sweeper() -> None:
+    """Background loop that periodically expires orphaned reservations."""
+    while True:
+        try:
+            await run_in_threadpool(expire_reservations)
+        except Exception as e:
+            logger.error(f"Credit reservation sweep failed: {str(e)}")
+        await asyncio.sleep(settings.credit_reservation_sweep_seconds)
+
+
+@asynccontextmanager
+async def credit_reservation(user_email: str, feature_type: str, amount: int = 1) -> AsyncIterator[Reservation]:
+    """
+    Reserve credits for the duration of the block.
+
+    The block is expected to call ``reservation.commit(...)`` once it has a
+    result; if it exits without doing so (error, cancellation), the
+    reservation is refunded.
+    """
+    reservation = await run_in_threadpool(reserve_credits, user_email, feature_type, amount)
+    try:
+        yield reservation
+    finally:
+        if not reservation.settled:
+            # Shielded so a cancelled request still gets its refund
+            await asyncio.shield(run_in_threadpool(refund_reservation, reservation))
@@ -0,0 +1,124 @@
+"""
+Compact storage format for AIHistory payloads.
+
+Inputs and outputs are stored as real JSON. Bodies larger than
+``history_compress_min_bytes`` are zlib-compressed. Input bodies go through
+the per-user, content-addressed ``history_blobs`` table, so the same resume
+analyzed ten times is stored once. Each row also keeps short previews so
+the history list never has to load or decompress the bodies.
+
+Rows written before this format (free-text ``input_text``/``output_text``,
+output as a Python repr) are still readable; ``migrate_history.py``
+converts them in place.
+"""
+import ast
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.history import AIHistory, HistoryBlob
+from settings import settings
+
+ENCODING_JSON = "json"
+ENCODING_JSON_ZLIB = "json+zlib"
+
+
+def _compact_json(payload: Any, sort_keys: bool = False) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+def encode_payload(payload: Any) -> Tuple[str, bytes, int]:
+    """Return (encoding, data, uncompressed size) for a JSON-serializable payload."""
+    raw = _compact_json(payload)
+    if len(raw) >= settings.history_compress_min_bytes:
+        return ENCODING_JSON_ZLIB, zlib.compress(raw, 6), len(raw)
+    return ENCODING_JSON, raw, len(raw)
+
+
+def decode_payload(encoding: str, data: bytes) -> Any:
+    if encoding == ENCODING_JSON_ZLIB:
+        data = zlib.decompress(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def make_preview(payload: Any) -> str:
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    return text[: settings.history_preview_chars]
+
+
+def parse_legacy_text(text: Optional[str]) -> Any:
+    """Best-effort conversion of a legacy column (JSON, Python repr or plain text)."""
+    if text is None:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+
+def get_or_create_blob(db: Session, user_email: str, payload: Any) -> int:
+    # Key order must not change the address of an otherwise identical body
+    digest = hashlib.sha256(_compact_json(payload, sort_keys=True)).hexdigest()
+
+    existing = (
+        db.query(HistoryBlob.id)
+        .filter(HistoryBlob.user_email == user_email, HistoryBlob.sha256 == digest)
+        .first()
+    )
+    if existing is not None:
+        return existing.id
+
+    encoding, data, size = encode_payload(payload)
+    blob = HistoryBlob(user_email=user_email, sha256=digest, encoding=encoding, data=data, size=size)
+    try:
+        with db.begin_nested():
+            db.add(blob)
+    except IntegrityError:
+        # A concurrent writer stored the same body first
+        return (
+            db.query(HistoryBlob.id)
+            .filter(HistoryBlob.user_email == user_email, HistoryBlob.sha256 == digest)
+            .one()
+            .id
+        )
+    return blob.id
+
+
+def fill_history_payloads(db: Session, entry: AIHistory, input_payload: Any, output_payload: Any) -> AIHistory:
+    """Populate the compact columns of ``entry`` from the given payloads."""
+    entry.input_blob_id = get_or_create_blob(db, entry.user_email, input_payload)
+    entry.input_preview = make_preview(input_payload)
+    entry.output_encoding, entry.output_data, _ = encode_payload(output_payload)
+    entry.output_preview = make_preview(output_payload)
+    entry.input_text = None
+    entry.output_text = None
+    return entry
+
+
+def build_history_entry(
+    db: Session,
+    user_email: str,
+    feature_type: str,
+    input_payload: Any,
+    output_payload: Any,
+    created_at: Optional[datetime] = None,
+) -> AIHistory:
+    entry = AIHistory(user_email=user_email, feature_type=feature_type)
+    if created_at is not None:
+        entry.created_at = created_at
+    return fill_history_payloads(db, entry, input_payload, output_payload)
+
+
+def load_output(entry: AIHistory) -> Any:
+    if entry.output_data is None:
+        return parse_legacy_text(entry.output_text)
+    return decode_payload(entry.output_encoding, entry.output_data)
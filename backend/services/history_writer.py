@@ -0,0 +1,230 @@
+"""
+Optional write-behind stage for history rows and usage counters.
+
+With ``history_write_behind_enabled``, settled requests hand their history
+row and ``total_requests`` increment to ``history_writer`` instead of
+committing them inline. A background thread writes everything buffered in
+one transaction per batch (``history_write_behind_batch_size``) or per time
+window (``history_write_behind_interval_seconds``), which keeps the AI
+routes off SQLite's single-writer lock and per-commit fsync.
+
+Credit reservation and settlement stay synchronous in services/credits.py;
+only bookkeeping that no correctness check depends on is deferred. History
+appears in /history/ within one flush window. The buffer is drained on
+shutdown, and if it grows past ``history_write_behind_max_pending`` the
+submitting request flushes inline (backpressure rather than unbounded
+memory).
+
+Rows keep the time they were submitted as ``created_at``, not the time of
+the flush. A batch that fails is re-queued up to
+``history_write_behind_max_retries`` times; after that it is split and
+written in halves, so one bad row cannot hold back the rest. A row that
+still fails on its own is dropped and logged (dead-lettered) with its user,
+feature and submit time.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import update
+
+from database import SessionLocal
+from models.user import User
+from services.history_store import build_history_entry
+from services.metrics import registry
+from settings import settings
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+history_rows_dead_lettered = registry.counter(
+    "history_write_behind_dead_lettered_total",
+    "History rows dropped by the write-behind stage after failing on their own.",
+)
+
+
+@dataclass
+class PendingHistory:
+    user_email: str
+    feature_type: str
+    input_payload: Any
+    output_payload: Any
+    used: int
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    attempts: int = 0
+
+
+def write_history_batch(batch: List[PendingHistory]) -> None:
+    """Insert all history rows and apply aggregated usage increments in one transaction."""
+    usage: Dict[str, int] = defaultdict(int)
+    db = SessionLocal()
+    try:
+        for item in batch:
+            db.add(
+                build_history_entry(
+                    db,
+                    item.user_email,
+                    item.feature_type,
+                    item.input_payload,
+                    item.output_payload,
+                    created_at=item.created_at,
+                )
+            )
+            usage[item.user_email] += item.used
+        for user_email, used in usage.items():
+            db.execute(
+                update(User)
+                .where(User.email == user_email)
+                .values(total_requests=User.total_requests + used)
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+    finally:
+        db.close()
+
+    for user_email in usage:
+        user_cache.invalidate(user_email)
+
+
+class HistoryWriter:
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, max_retries: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self._pending: List[PendingHistory] = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stopping
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop the background thread after draining everything buffered."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything submitted after the thread's last pass; failed rows are
+        # retried until they are written or dead-lettered
+        for _ in range(max(1, self.max_retries)):
+            if not self._pending:
+                break
+            self.flush()
+        if self._pending:
+            logger.error(f"History writer stopped with {len(self._pending)} unwritten rows")
+
+    def submit(self, item: PendingHistory) -> None:
+        with self._cond:
+            self._pending.append(item)
+            pending = len(self._pending)
+            if pending >= self.batch_size:
+                self._cond.notify()
+        if pending >= self.max_pending:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                write_history_batch(batch)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"History write-behind flush of {len(batch)} rows failed: {str(e)}")
+                retry = []
+                exhausted = []
+                for item in batch:
+                    item.attempts += 1
+                    (retry if item.attempts < self.max_retries else exhausted).append(item)
+                if retry:
+                    with self._cond:
+                        self._pending[:0] = retry
+                written = self._write_split(exhausted) if exhausted else 0
+                self.rows_written += written
+                return written
+
+            self.flushes += 1
+            self.rows_written += len(batch)
+            self.last_flush_seconds = time.perf_counter() - started
+            return len(batch)
+
+    def _write_split(self, batch: List[PendingHistory]) -> int:
+        """Write ``batch``, halving it until the failing rows are isolated; returns rows written."""
+        try:
+            write_history_batch(batch)
+            return len(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                return self._write_split(batch[:middle]) + self._write_split(batch[middle:])
+            item = batch[0]
+            history_rows_dead_lettered.inc()
+            logger.error(
+                f"Dropping history row for {item.user_email} ({item.feature_type}, submitted "
+                f"{item.created_at.isoformat()}, {item.used} credits) after {item.attempts} failed flushes: {str(e)}"
+            )
+            return 0
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_interval)
+                stopping = self._stopping
+            if self.flush() == 0 and self._pending and not stopping:
+                # The flush failed; back off instead of spinning on the DB
+                time.sleep(self.flush_interval)
+            if stopping:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.running,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failures": self.failures,
+            "dead_lettered": int(history_rows_dead_lettered.value()),
+            "last_flush_seconds": round(self.last_flush_seconds, 6),
+        }
+
+
+history_writer = HistoryWriter(
+    batch_size=settings.history_write_behind_batch_size,
+    flush_interval=settings.history_write_behind_interval_seconds,
+    max_pending=settings.history_write_behind_max_pending,
+    max_retries=settings.history_write_behind_max_retries,
+)
+
+registry.gauge(
+    "history_write_behind_pending",
+    "History rows buffered for the write-behind stage.",
+    callback=lambda: [((), len(history_writer._pending))],
+)
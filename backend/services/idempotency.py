@@ -0,0 +1,333 @@
+"""
+``Idempotency-Key`` support for the AI POST routes.
+
+A client that retries a slow request with the same ``Idempotency-Key``
+header gets the original call's result instead of starting a second
+generation and paying a second credit:
+
+- the first request with a key runs normally; its JSON response is stored
+  for ``idempotency_ttl_seconds``,
+- a retry while it is still running waits for it: in the same process it
+  attaches to the running call directly; in another worker it polls the
+  shared SQLite store for up to ``idempotency_wait_timeout`` seconds,
+- a retry after it finished gets the stored response, including the
+  status code and headers the route set on its ``Response``, marked with
+  ``Idempotent-Replayed: true``,
+- reusing a key with a different request body is rejected with 422.
+
+Keys are scoped per user and per route. Failed requests (any exception,
+including HTTP errors) are not stored, so a retry after a failure runs
+again. An in-progress marker left by a crashed worker expires after
+``idempotency_in_progress_ttl`` seconds.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from services.metrics import registry
+from settings import settings
+from user_cache import CachedUser
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+idempotency_requests = registry.counter(
+    "idempotency_requests_total",
+    "Requests carrying an Idempotency-Key, by outcome (executed, replayed, attached, conflict).",
+    ("outcome",),
+)
+
+
+class _OwnerFailed(Exception):
+    """The call a retry attached to did not produce a response."""
+
+
+def request_fingerprint(kwargs: Dict[str, Any]) -> str:
+    """Digest of the request body models among a route's arguments."""
+    bodies = sorted(
+        (type(value).__name__, value.model_dump(mode="json"))
+        for value in kwargs.values()
+        if isinstance(value, BaseModel)
+    )
+    return hashlib.sha256(json.dumps(bodies, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def response_meta(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Status code and headers a route set on its injected ``Response``."""
+    response = next((value for value in kwargs.values() if isinstance(value, Response)), None)
+    if response is None:
+        return {}
+    return {
+        "status_code": response.status_code,
+        "headers": [(name, value) for name, value in response.headers.items() if name != "content-length"],
+    }
+
+
+def _load_meta(meta: Optional[str]) -> Dict[str, Any]:
+    return json.loads(meta) if meta else {}
+
+
+class IdempotencyStore:
+    # Drop expired keys every this many new keys
+    PURGE_EVERY = 1000
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float,
+        in_progress_ttl: float,
+        wait_timeout: float,
+        poll_interval: float,
+        enabled: bool,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.in_progress_ttl = in_progress_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+
+        self._local = threading.local()
+        self._inflight: Dict[Tuple[str, str, str], Tuple[str, asyncio.Future]] = {}
+        self._new_keys = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly below
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                " user_email TEXT NOT NULL,"
+                " scope TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " fingerprint TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " body TEXT,"
+                " expires_at REAL NOT NULL,"
+                " response_meta TEXT,"
+                " PRIMARY KEY (user_email, scope, key))"
+            )
+            try:
+                # Stores created before response metadata was kept
+                conn.execute("ALTER TABLE idempotency_keys ADD COLUMN response_meta TEXT")
+            except sqlite3.OperationalError:
+                pass
+            self._local.conn = conn
+        return conn
+
+    def _begin(self, ident: Tuple[str, str, str], fingerprint: str) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        Claim the key or report its state: ("new" | "in_progress" |
+        "completed" | "conflict", stored body, stored response metadata).
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT fingerprint, status, body, expires_at, response_meta FROM idempotency_keys"
+                " WHERE user_email = ? AND scope = ? AND key = ?",
+                ident,
+            ).fetchone()
+            if row is not None and row[3] < now:
+                row = None
+            if row is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys"
+                    " (user_email, scope, key, fingerprint, status, body, expires_at)"
+                    " VALUES (?, ?, ?, ?, 'in_progress', NULL, ?)",
+                    (*ident, fingerprint, now + self.in_progress_ttl),
+                )
+                state = ("new", None, None)
+            elif row[0] != fingerprint:
+                state = ("conflict", None, None)
+            else:
+                state = (row[1], row[2], row[4])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if state[0] == "new":
+            self._new_keys += 1
+            if self._new_keys % self.PURGE_EVERY == 0:
+                self.purge()
+        return state
+
+    def _complete(self, ident: Tuple[str, str, str], body: str, meta: str) -> None:
+        self._connection().execute(
+            "UPDATE idempotency_keys SET status = 'completed', body = ?, response_meta = ?, expires_at = ?"
+            " WHERE user_email = ? AND scope = ? AND key = ?",
+            (body, meta, time.time() + self.ttl_seconds, *ident),
+        )
+
+    def _abandon(self, ident: Tuple[str, str, str]) -> None:
+        self._connection().execute(
+            "DELETE FROM idempotency_keys WHERE user_email = ? AND scope = ? AND key = ? AND status = 'in_progress'",
+            ident,
+        )
+
+    def _lookup(self, ident: Tuple[str, str, str]) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        row = self._connection().execute(
+            "SELECT status, body, expires_at, response_meta FROM idempotency_keys"
+            " WHERE user_email = ? AND scope = ? AND key = ?",
+            ident,
+        ).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return row[0], row[1], row[3]
+
+    def purge(self) -> int:
+        cursor = self._connection().execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    async def _wait_elsewhere(self, ident: Tuple[str, str, str]) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Poll for another worker's result; None if that worker gave up."""
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            state = await run_in_threadpool(self._lookup, ident)
+            if state is None:
+                return None
+            if state[0] == "completed":
+                return json.loads(state[1]), _load_meta(state[2])
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": str(max(1, int(self.poll_interval * 4)))},
+        )
+
+    async def run(
+        self,
+        ident: Tuple[str, str, str],
+        fingerprint: str,
+        call: Callable[[], Awaitable[Tuple[Any, Dict[str, Any]]]],
+    ) -> Tuple[Any, Dict[str, Any], bool]:
+        """
+        Run ``call`` once per key. ``call`` returns (result, response
+        metadata); returns (result, response metadata, replayed).
+        """
+        while True:
+            local = self._inflight.get(ident)
+            if local is not None:
+                if local[0] != fingerprint:
+                    idempotency_requests.inc("conflict")
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+                try:
+                    result, meta = await asyncio.shield(local[1])
+                except _OwnerFailed:
+                    continue
+                idempotency_requests.inc("attached")
+                return result, meta, True
+
+            state, body, meta = await run_in_threadpool(self._begin, ident, fingerprint)
+            if state == "conflict":
+                idempotency_requests.inc("conflict")
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            if state == "completed":
+                idempotency_requests.inc("replayed")
+                return json.loads(body), _load_meta(meta), True
+            if state == "in_progress":
+                stored = await self._wait_elsewhere(ident)
+                if stored is None:
+                    continue
+                idempotency_requests.inc("attached")
+                return stored[0], stored[1], True
+
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[ident] = (fingerprint, future)
+            try:
+                result, meta = await call()
+                encoded = jsonable_encoder(result)
+                await run_in_threadpool(self._complete, ident, json.dumps(encoded), json.dumps(meta))
+            except BaseException:
+                # Nothing is stored for a failed call; attached retries run it themselves
+                future.set_exception(_OwnerFailed())
+                future.exception()  # retrieved here, so an unattended future does not log
+                await asyncio.shield(run_in_threadpool(self._abandon, ident))
+                raise
+            else:
+                future.set_result((encoded, meta))
+            finally:
+                self._inflight.pop(ident, None)
+            idempotency_requests.inc("executed")
+            return result, meta, False
+
+    def idempotent(self) -> Callable:
+        """
+        Decorate an async route so requests carrying ``Idempotency-Key`` run
+        once per (user, route, key).
+
+        The route must take ``request: Request`` and resolve a ``CachedUser``
+        dependency; requests without the header are not affected. Place it
+        above ``limiter.limit`` so replays do not count against rate limits.
+        """
+        def decorator(func: Callable) -> Callable:
+            scope = f"{func.__module__}.{func.__name__}"
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.get("request")
+                user = next((value for value in kwargs.values() if isinstance(value, CachedUser)), None)
+                key = request.headers.get(IDEMPOTENCY_HEADER) if isinstance(request, Request) else None
+                if not self.enabled or key is None or user is None:
+                    return await func(*args, **kwargs)
+                if not key or len(key) > MAX_KEY_LENGTH:
+                    raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+
+                async def call() -> Tuple[Any, Dict[str, Any]]:
+                    result = await func(*args, **kwargs)
+                    return result, response_meta(kwargs)
+
+                result, meta, replayed = await self.run(
+                    (user.email, scope, key),
+                    request_fingerprint(kwargs),
+                    call,
+                )
+                if replayed:
+                    return JSONResponse(
+                        content=result,
+                        status_code=meta.get("status_code") or 200,
+                        headers={**dict(meta.get("headers", [])), REPLAYED_HEADER: "true"},
+                    )
+                return result
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._inflight),
+            "ttl_seconds": self.ttl_seconds,
+            **{
+                outcome: int(idempotency_requests.value(outcome))
+                for outcome in ("executed", "replayed", "attached", "conflict")
+            },
+        }
+
+
+idempotency_store = IdempotencyStore(
+    path=settings.idempotency_sqlite_path,
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    in_progress_ttl=settings.idempotency_in_progress_ttl,
+    wait_timeout=settings.idempotency_wait_timeout,
+    poll_interval=settings.idempotency_poll_interval,
+    enabled=settings.idempotency_enabled,
+)
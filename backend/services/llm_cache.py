@@ -0,0 +1,223 @@
+"""
+Two-tier, content-addressed cache for structured LLM results.
+
+Entries are keyed by a SHA-256 of the model name, sampling options, system
+prompt and whitespace-normalized user prompt, so changing any prompt or the
+configured model naturally misses and old entries simply age out.
+
+Tier 1 is an in-process LRU bounded by size and TTL. Tier 2 is a SQLite
+file that survives restarts; hits there are promoted back into tier 1.
+"""
+import copy
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def make_cache_key(
+    model: str,
+    options: Dict[str, Any],
+    system_prompt: str,
+    user_prompt: str,
+    output_format: Any = None,
+) -> str:
+    fields = {
+        "model": model,
+        "options": options,
+        "system": normalize_prompt(system_prompt),
+        "user": normalize_prompt(user_prompt),
+    }
+    if output_format is not None:
+        # A changed schema (or structured output toggled) must not serve old results
+        fields["format"] = output_format
+    material = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        db_path: Optional[str],
+        persistent_ttl_seconds: float,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.persistent_ttl_seconds = persistent_ttl_seconds
+
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_failed = False
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    # -- tier 1 ---------------------------------------------------------
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def _memory_set(self, key: str, value: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (time.monotonic(), copy.deepcopy(value))
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # -- tier 2 ---------------------------------------------------------
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path or self._db_failed:
+            return None
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " feature TEXT,"
+                    " value TEXT NOT NULL,"
+                    " created_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE created_at < ?",
+                    (time.time() - self.persistent_ttl_seconds,),
+                )
+                conn.commit()
+                self._conn = conn
+            except sqlite3.Error as e:
+                logger.error(f"LLM cache disabled persistent tier: {str(e)}")
+                self._db_failed = True
+                return None
+        return self._conn
+
+    def _persistent_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                value, created_at = row
+                if time.time() - created_at > self.persistent_ttl_seconds:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                return json.loads(value)
+            except (sqlite3.Error, json.JSONDecodeError) as e:
+                logger.error(f"LLM cache read failed: {str(e)}")
+                return None
+
+    def _persistent_set(self, key: str, feature: Optional[str], value: Dict[str, Any]) -> None:
+        with self._db_lock:
+            conn = self._connection()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, feature, value, created_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, feature, json.dumps(value), time.time()),
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"LLM cache write failed: {str(e)}")
+
+    # -- public API -----------------------------------------------------
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        value = await run_in_threadpool(self._persistent_get, key)
+        if value is not None:
+            self.persistent_hits += 1
+            self._memory_set(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, feature: Optional[str], value: Dict[str, Any]) -> None:
+        self.stores += 1
+        self._memory_set(key, value)
+        await run_in_threadpool(self._persistent_set, key, feature, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        with self._db_lock:
+            conn = self._connection()
+            if conn is not None:
+                conn.execute("DELETE FROM llm_cache")
+                conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        hits = self.memory_hits + self.persistent_hits
+        return {
+            "enabled": settings.llm_cache_enabled,
+            "disabled_features": list(settings.llm_cache_disabled_features),
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def cache_enabled_for(feature: Optional[str]) -> bool:
+    if not settings.llm_cache_enabled or feature is None:
+        return False
+    return feature not in settings.llm_cache_disabled_features
+
+
+llm_cache = LLMCache(
+    max_entries=settings.llm_cache_max_entries,
+    ttl_seconds=settings.llm_cache_ttl_seconds,
+    db_path=settings.llm_cache_path or None,
+    persistent_ttl_seconds=settings.llm_cache_persistent_ttl_seconds,
+)
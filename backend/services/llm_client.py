@@ -0,0 +1,43 @@
+"""
+Shared async HTTP client for the LLM provider.
+
+A single ``httpx.AsyncClient`` is kept for the lifetime of the process so
+upstream connections are reused (keep-alive) instead of being re-opened for
+every generation. Pool limits and timeouts come from ``Settings``.
+"""
+from typing import Optional
+
+import httpx
+
+from settings import settings
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    timeout = httpx.Timeout(
+        settings.ollama_timeout,
+        connect=settings.ollama_connect_timeout,
+    )
+    limits = httpx.Limits(
+        max_connections=settings.ollama_max_connections,
+        max_keepalive_connections=settings.ollama_max_keepalive_connections,
+        keepalive_expiry=settings.ollama_keepalive_expiry,
+    )
+    return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide client, creating it lazily on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client and release pooled connections."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -0,0 +1,227 @@
+"""
+Structured output for the LLM features: JSON schemas and local JSON repair.
+
+Each feature's schema is sent as Ollama's ``format`` so decoding is
+constrained to a matching JSON object (``llm_structured_output="json"``
+sends plain ``"json"`` mode instead, for Ollama versions without schema
+support). Output that still does not parse goes through ``decode``, which
+retries only the parsing: strip markdown fences, cut out the outermost
+JSON object, then drop trailing commas. A repaired answer is used as is;
+the model is never asked to generate again.
+"""
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from services.metrics import registry
+from settings import settings
+
+PARSE_OUTCOMES = ("ok", "repaired", "failed")
+
+output_parses = registry.counter(
+    "llm_output_parse_total",
+    "Parsed model outputs by outcome (ok, repaired locally, failed).",
+    ("feature", "outcome"),
+)
+output_repairs = registry.counter(
+    "llm_output_repairs_total",
+    "Model outputs made parseable by a local repair step.",
+    ("feature", "step"),
+)
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+_BULLET_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "original": {"type": "string"},
+        "enhanced": {"type": "string"},
+        "impact_version": {"type": "string"},
+    },
+    "required": ["original", "enhanced", "impact_version"],
+}
+
+_RESUME_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer", "minimum": 0, "maximum": 100},
+        "strengths": _STRING_LIST,
+        "weaknesses": _STRING_LIST,
+        "suggestions": _STRING_LIST,
+    },
+    "required": ["score", "strengths", "weaknesses", "suggestions"],
+}
+
+_RESUME_SECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"section": {"type": "string"}, **_RESUME_SCHEMA["properties"]},
+    "required": ["section", *_RESUME_SCHEMA["required"]],
+}
+
+FEATURE_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "resume": _RESUME_SCHEMA,
+    "resume_sections": {
+        "type": "object",
+        "properties": {"sections": {"type": "array", "items": _RESUME_SECTION_SCHEMA}},
+        "required": ["sections"],
+    },
+    "project": _BULLET_SCHEMA,
+    "project_batch": {
+        "type": "object",
+        "properties": {"items": {"type": "array", "items": _BULLET_SCHEMA}},
+        "required": ["items"],
+    },
+    "linkedin": {
+        "type": "object",
+        "properties": {
+            "hook": {"type": "string"},
+            "body": {"type": "string"},
+            "cta": {"type": "string"},
+        },
+        "required": ["hook", "body", "cta"],
+    },
+}
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)\s*```", re.DOTALL)
+
+
+def output_format(feature: Optional[str]) -> Optional[Any]:
+    """The ``format`` value for an Ollama chat request, or None to leave it unconstrained."""
+    mode = settings.llm_structured_output
+    if mode == "schema" and feature in FEATURE_SCHEMAS:
+        return FEATURE_SCHEMAS[feature]
+    if mode in ("schema", "json"):
+        return "json"
+    return None
+
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def _extract_object(text: str) -> str:
+    """The first balanced ``{...}`` in ``text``, ignoring braces inside strings."""
+    start = text.find("{")
+    if start < 0:
+        return text
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+
+def _drop_trailing_commas(text: str) -> str:
+    """Remove commas directly before ``}`` or ``]`` outside of strings."""
+    out = []
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            rest = text[index + 1:].lstrip()
+            if rest[:1] in ("}", "]"):
+                continue
+        out.append(char)
+    return "".join(out)
+
+
+REPAIR_STEPS = (
+    ("strip_fences", _strip_fences),
+    ("extract_object", _extract_object),
+    ("trailing_commas", _drop_trailing_commas),
+)
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def decode(content: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Parse model output into a JSON object.
+
+    Returns the object and the name of the last repair step that was needed
+    (None when the content parsed as is). Raises ValueError when no repair
+    produces a JSON object.
+    """
+    value = _loads_object(content)
+    if value is not None:
+        return value, None
+    if not settings.llm_json_repair_enabled:
+        raise ValueError("invalid JSON")
+
+    text = content.strip()
+    for step, repair in REPAIR_STEPS:
+        repaired = repair(text)
+        if repaired == text:
+            continue
+        text = repaired
+        value = _loads_object(text)
+        if value is not None:
+            return value, step
+    raise ValueError("invalid JSON")
+
+
+def record_parse(feature: Optional[str], step: Optional[str], failed: bool = False) -> None:
+    feature = feature or "unknown"
+    if failed:
+        output_parses.inc(feature, "failed")
+    elif step is None:
+        output_parses.inc(feature, "ok")
+    else:
+        output_parses.inc(feature, "repaired")
+        output_repairs.inc(feature, step)
+
+
+def stats() -> Dict[str, Any]:
+    features = {}
+    for feature in list(FEATURE_SCHEMAS) + ["unknown"]:
+        counts = {outcome: int(output_parses.value(feature, outcome)) for outcome in PARSE_OUTCOMES}
+        total = sum(counts.values())
+        if not total:
+            continue
+        features[feature] = {
+            **counts,
+            "repair_rate": round(counts["repaired"] / total, 4),
+            "failure_rate": round(counts["failed"] / total, 4),
+            "repairs": {
+                step: int(output_repairs.value(feature, step))
+                for step, _ in REPAIR_STEPS
+                if output_repairs.value(feature, step)
+            },
+        }
+    return {
+        "structured_output": settings.llm_structured_output,
+        "repair_enabled": settings.llm_json_repair_enabled,
+        "features": features,
+    }
@@ -0,0 +1,378 @@
+"""
+Pool of Ollama backends with health-aware load balancing and failover.
+
+Backends come from ``ollama_backends`` (url, weight, optional model list),
+or from ``ollama_base_url`` alone when that is empty. A weight of 0 drains
+a backend: it stays configured (stats, health checks) but gets no requests;
+negative weights are rejected at startup. Each request goes to
+the backend with the fewest outstanding requests relative to its weight,
+among those that serve the model, passed their last health check and do not
+have an open circuit.
+
+A backend's circuit opens after ``ollama_circuit_failure_threshold``
+consecutive connection errors or timeouts and stays open for
+``ollama_circuit_reset_seconds``; after that one trial request is let
+through (half-open) and its outcome closes or re-opens the circuit. A
+successful health check closes it too.
+
+Failures where the backend never started the generation (connection
+refused, connect/pool timeouts, 502/503/504) are retried on a different
+backend, up to ``ollama_retry_attempts`` extra attempts. Read timeouts are
+not retried: the generation may still be running and would be paid twice.
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from services.llm_client import get_client
+from services.metrics import registry
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {502, 503, 504}
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+backend_requests = registry.counter(
+    "llm_backend_requests_total",
+    "Upstream attempts per backend by outcome (ok, error, retried).",
+    ("backend", "outcome"),
+)
+
+
+@dataclass
+class Backend:
+    url: str
+    weight: float = 1.0
+    # Models this backend is configured for; None means "whatever it has loaded"
+    models: Optional[Set[str]] = None
+
+    healthy: bool = True
+    discovered_models: Optional[Set[str]] = None
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    circuit: str = CIRCUIT_CLOSED
+    open_until: float = 0.0
+    trial_in_flight: bool = False
+
+    requests: int = 0
+    failures: int = 0
+    retries: int = 0
+    total_seconds: float = 0.0
+    last_error: Optional[str] = None
+    last_health_check: Optional[float] = None
+
+    @property
+    def drained(self) -> bool:
+        return self.weight <= 0
+
+    def serves(self, model: str) -> bool:
+        if self.models is not None:
+            return model in self.models
+        if self.discovered_models is not None:
+            return model in self.discovered_models
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "drained": self.drained,
+            "models": sorted(self.models) if self.models is not None else None,
+            "discovered_models": sorted(self.discovered_models) if self.discovered_models is not None else None,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "avg_seconds": round(self.total_seconds / self.requests, 4) if self.requests else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+@dataclass
+class Lease:
+    """One attempt on one backend; ``finish`` must be called exactly once."""
+
+    pool: "BackendPool"
+    backend: Backend
+    started: float = field(default_factory=time.monotonic)
+    finished: bool = False
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        self.pool._release(self, error)
+
+
+def status_error(response: httpx.Response) -> Optional[httpx.HTTPStatusError]:
+    """Error to finish a lease with for a non-200 upstream response (None for 200)."""
+    if response.status_code == 200:
+        return None
+    return httpx.HTTPStatusError(f"status {response.status_code}", request=response.request, response=response)
+
+
+def is_circuit_failure(error: Optional[BaseException]) -> bool:
+    return isinstance(error, (httpx.ConnectError, httpx.TimeoutException))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True when the backend cannot have started the generation."""
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class BackendPool:
+    def __init__(
+        self,
+        backends: List[Backend],
+        failure_threshold: int,
+        reset_seconds: float,
+        retry_attempts: int,
+        health_check_interval: float,
+    ):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.retry_attempts = retry_attempts
+        self.health_check_interval = health_check_interval
+        self._health_task: Optional[asyncio.Task] = None
+        self.unavailable = 0
+
+    # -- routing ----------------------------------------------------------
+
+    def _refresh_circuit(self, backend: Backend, now: float) -> None:
+        if backend.circuit == CIRCUIT_OPEN and now >= backend.open_until:
+            backend.circuit = CIRCUIT_HALF_OPEN
+            backend.trial_in_flight = False
+
+    def _pick(self, model: str, exclude: List[Backend]) -> Optional[Backend]:
+        now = time.monotonic()
+        ready: List[Backend] = []
+        trial: List[Backend] = []
+        unhealthy: List[Backend] = []
+        for backend in self.backends:
+            if backend in exclude or backend.drained or not backend.serves(model):
+                continue
+            self._refresh_circuit(backend, now)
+            if backend.circuit == CIRCUIT_CLOSED:
+                (ready if backend.healthy else unhealthy).append(backend)
+            elif backend.circuit == CIRCUIT_HALF_OPEN and not backend.trial_in_flight:
+                trial.append(backend)
+
+        # Backends failing health checks are a last resort, not excluded outright
+        candidates = ready or trial or unhealthy
+        if not candidates:
+            return None
+        best = min((backend.outstanding + 1) / backend.weight for backend in candidates)
+        tied = [backend for backend in candidates if (backend.outstanding + 1) / backend.weight == best]
+        return random.choice(tied)
+
+    def acquire(self, model: str, exclude: Optional[List[Backend]] = None) -> Lease:
+        backend = self._pick(model, exclude or [])
+        if backend is None:
+            self.unavailable += 1
+            error_msg = f"No healthy Ollama backend available for model {model}."
+            logger.error(error_msg)
+            retry_after = max(1, int(self.reset_seconds))
+            raise HTTPException(status_code=503, detail=error_msg, headers={"Retry-After": str(retry_after)})
+        if backend.circuit == CIRCUIT_HALF_OPEN:
+            backend.trial_in_flight = True
+        backend.outstanding += 1
+        backend.requests += 1
+        return Lease(pool=self, backend=backend)
+
+    def _release(self, lease: Lease, error: Optional[BaseException]) -> None:
+        backend = lease.backend
+        backend.outstanding -= 1
+        backend.total_seconds += time.monotonic() - lease.started
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # The caller went away; says nothing about the backend
+            backend.trial_in_flight = False
+            return
+        if error is None:
+            backend_requests.inc(backend.url, "ok")
+            backend.healthy = True
+            backend.consecutive_failures = 0
+            if backend.circuit != CIRCUIT_CLOSED:
+                logger.info(f"Ollama backend {backend.url} recovered; closing circuit")
+            backend.circuit = CIRCUIT_CLOSED
+            backend.trial_in_flight = False
+            return
+
+        backend_requests.inc(backend.url, "error")
+        backend.failures += 1
+        backend.last_error = f"{type(error).__name__}: {error}"
+        if not is_circuit_failure(error):
+            if backend.circuit == CIRCUIT_HALF_OPEN:
+                # The backend answered, so it is reachable again
+                backend.circuit = CIRCUIT_CLOSED
+                backend.trial_in_flight = False
+            return
+        backend.consecutive_failures += 1
+        if backend.circuit == CIRCUIT_HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+            if backend.circuit != CIRCUIT_OPEN:
+                logger.error(
+                    f"Opening circuit for Ollama backend {backend.url} after "
+                    f"{backend.consecutive_failures} consecutive failures"
+                )
+            backend.circuit = CIRCUIT_OPEN
+            backend.open_until = time.monotonic() + self.reset_seconds
+            backend.trial_in_flight = False
+
+    async def open(
+        self,
+        model: str,
+        send: Callable[[Backend], Awaitable[httpx.Response]],
+    ) -> Tuple[Lease, httpx.Response]:
+        """
+        Send a request through the pool, failing over to another backend on
+        retryable errors. Returns the lease (finish it once the response has
+        been consumed) and the response.
+        """
+        tried: List[Backend] = []
+        while True:
+            lease = self.acquire(model, tried)
+            tried.append(lease.backend)
+            can_retry = len(tried) <= self.retry_attempts
+            try:
+                response = await send(lease.backend)
+            except httpx.HTTPError as e:
+                lease.finish(e)
+                if can_retry and is_retryable(e) and self._has_alternative(model, tried):
+                    self._note_retry(lease.backend, e)
+                    continue
+                raise
+            except BaseException as e:
+                lease.finish(e)
+                raise
+
+            if response.status_code in RETRYABLE_STATUS and can_retry and self._has_alternative(model, tried):
+                await response.aclose()
+                lease.finish(status_error(response))
+                self._note_retry(lease.backend, f"status {response.status_code}")
+                continue
+            return lease, response
+
+    def _has_alternative(self, model: str, tried: List[Backend]) -> bool:
+        return self._pick(model, tried) is not None
+
+    def _note_retry(self, backend: Backend, reason: Any) -> None:
+        backend.retries += 1
+        backend_requests.inc(backend.url, "retried")
+        logger.warning(f"Ollama backend {backend.url} failed ({reason}); retrying on another backend")
+
+    # -- health checks ----------------------------------------------------
+
+    async def check_backend(self, backend: Backend) -> bool:
+        backend.last_health_check = time.time()
+        try:
+            response = await get_client().get(
+                f"{backend.url}/api/tags",
+                timeout=settings.ollama_connect_timeout,
+            )
+            response.raise_for_status()
+            models = response.json().get("models", [])
+        except (httpx.HTTPError, ValueError) as e:
+            if backend.healthy:
+                logger.error(f"Ollama backend {backend.url} failed health check: {str(e)}")
+            backend.healthy = False
+            backend.last_error = f"health check: {type(e).__name__}: {e}"
+            return False
+
+        backend.discovered_models = {m.get("name") or m.get("model") for m in models} - {None}
+        if not backend.healthy:
+            logger.info(f"Ollama backend {backend.url} passed health check")
+        backend.healthy = True
+        if backend.circuit != CIRCUIT_CLOSED:
+            backend.circuit = CIRCUIT_CLOSED
+            backend.consecutive_failures = 0
+            backend.trial_in_flight = False
+        return True
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check_backend(backend) for backend in self.backends))
+
+    async def _health_loop(self) -> None:
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"Ollama health check loop failed: {str(e)}")
+            await asyncio.sleep(self.health_check_interval)
+
+    def start_health_checks(self) -> None:
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop_health_checks(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retry_attempts": self.retry_attempts,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "unavailable": self.unavailable,
+            "backends": [backend.stats() for backend in self.backends],
+        }
+
+
+def backends_from_settings() -> List[Backend]:
+    if not settings.ollama_backends:
+        return [Backend(url=settings.ollama_base_url.rstrip("/"))]
+    backends = []
+    for entry in settings.ollama_backends:
+        models = entry.get("models")
+        weight = float(entry.get("weight", 1.0))
+        if weight < 0:
+            raise ValueError(f"ollama_backends: weight for {entry['url']} must be >= 0 (0 drains it), got {weight}")
+        backends.append(
+            Backend(
+                url=str(entry["url"]).rstrip("/"),
+                weight=weight,
+                models=set(models) if models else None,
+            )
+        )
+    return backends
+
+
+llm_pool = BackendPool(
+    backends=backends_from_settings(),
+    failure_threshold=settings.ollama_circuit_failure_threshold,
+    reset_seconds=settings.ollama_circuit_reset_seconds,
+    retry_attempts=settings.ollama_retry_attempts,
+    health_check_interval=settings.ollama_health_check_interval,
+)
+
+registry.gauge(
+    "llm_backend_outstanding",
+    "Requests currently open against each Ollama backend.",
+    ("backend",),
+    callback=lambda: [((b.url,), b.outstanding) for b in llm_pool.backends],
+)
+registry.gauge(
+    "llm_backend_up",
+    "1 when the backend passed its last health check and its circuit is not open.",
+    ("backend",),
+    callback=lambda: [
+        ((b.url,), 1 if b.healthy and b.circuit != CIRCUIT_OPEN else 0) for b in llm_pool.backends
+    ],
+)
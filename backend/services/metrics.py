@@ -0,0 +1,332 @@
+"""
+Process-local metrics rendered in the Prometheus text exposition format.
+
+Counters, gauges and histograms are plain dicts keyed by label tuples behind
+one lock each, so recording a sample costs a bisect and a few dict updates
+(low microseconds) on the request path. Gauges that mirror state owned by
+another component (scheduler queue, write-behind buffer) are read through
+callbacks when ``/metrics`` is scraped instead of being kept in sync.
+
+With several uvicorn workers each process exposes its own series; scrape
+every worker or aggregate them in Prometheus.
+"""
+import bisect
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500, 1000, 2500)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self._header()
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        if self._callback is not None:
+            items = list(self._callback())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        lines = self._header()
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items()]
+        lines = self._header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# -- HTTP ---------------------------------------------------------------
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time to response start by route template, method and status.",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled.",
+)
+http_exceptions = registry.counter(
+    "http_unhandled_exceptions_total",
+    "Requests that ended in an unhandled exception, by exception type.",
+    ("type",),
+)
+
+# -- LLM upstream -------------------------------------------------------
+
+llm_phase_duration = registry.histogram(
+    "llm_upstream_phase_seconds",
+    "Upstream LLM call time by phase: connect (pool wait, TCP, request sent), "
+    "first_token (streaming only) and generation (request sent to response complete).",
+    ("model", "mode", "phase"),
+)
+llm_queue_wait = registry.histogram(
+    "llm_scheduler_wait_seconds",
+    "Time spent waiting for an LLM scheduler slot.",
+    ("priority",),
+)
+llm_upstream_in_flight = registry.gauge(
+    "llm_upstream_in_flight",
+    "Upstream LLM calls currently open.",
+    ("model",),
+)
+llm_errors = registry.counter(
+    "llm_errors_total",
+    "Failed LLM calls by failure type.",
+    ("model", "type"),
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total",
+    "Tokens reported by Ollama (prompt_eval_count / eval_count).",
+    ("model", "kind"),
+)
+llm_ollama_duration = registry.histogram(
+    "llm_ollama_duration_seconds",
+    "Ollama-reported durations: load, prompt_eval and eval.",
+    ("model", "phase"),
+)
+llm_tokens_per_second = registry.histogram(
+    "llm_tokens_per_second",
+    "Throughput derived from Ollama's counts and durations (prompt = prompt processing, completion = generation).",
+    ("model", "kind"),
+    buckets=TOKEN_RATE_BUCKETS,
+)
+
+# -- Database -----------------------------------------------------------
+
+db_connection_hold = registry.histogram(
+    "db_connection_hold_seconds",
+    "Time a pooled DB connection stays checked out by a session.",
+    ("engine",),
+    buckets=DB_BUCKETS,
+)
+db_connections_in_use = registry.gauge(
+    "db_connections_in_use",
+    "DB connections currently checked out.",
+    ("engine",),
+)
+
+
+def record_ollama_stats(model: str, data: Dict[str, Any]) -> None:
+    """Record token counts and throughput from a final Ollama response/chunk."""
+    for phase in ("load", "prompt_eval", "eval"):
+        nanos = data.get(f"{phase}_duration")
+        if nanos:
+            llm_ollama_duration.observe(nanos / 1e9, model, phase)
+
+    for kind, count_field, duration_field in (
+        ("prompt", "prompt_eval_count", "prompt_eval_duration"),
+        ("completion", "eval_count", "eval_duration"),
+    ):
+        count = data.get(count_field)
+        if not count:
+            continue
+        llm_tokens.inc(model, kind, amount=count)
+        nanos = data.get(duration_field)
+        if nanos:
+            llm_tokens_per_second.observe(count / (nanos / 1e9), model, kind)
+
+
+class UpstreamTimer:
+    """
+    Phase timing for one upstream call; pass ``trace`` as the httpx
+    ``trace`` extension so the connect phase ends when request headers go out.
+    """
+
+    def __init__(self, model: str, mode: str):
+        self.model = model
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.connected: Optional[float] = None
+        self.first_token: Optional[float] = None
+
+    async def trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if self.connected is None and event_name.endswith("send_request_headers.started"):
+            self.connected = time.perf_counter()
+
+    def mark_first_token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def __enter__(self) -> "UpstreamTimer":
+        llm_upstream_in_flight.inc(self.model)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        llm_upstream_in_flight.dec(self.model)
+        if exc_type is not None or self.connected is None:
+            return
+        finished = time.perf_counter()
+        llm_phase_duration.observe(self.connected - self.started, self.model, self.mode, "connect")
+        if self.first_token is not None:
+            llm_phase_duration.observe(self.first_token - self.connected, self.model, self.mode, "first_token")
+        llm_phase_duration.observe(finished - self.connected, self.model, self.mode, "generation")
+
+
+def record_llm_error(model: str, error_type: str) -> None:
+    llm_errors.inc(model, error_type)
+
+
+def render() -> str:
+    return registry.render()
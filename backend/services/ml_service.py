@@ -1,6 +1,291 @@
+"""
+Local resume pre-scorer.
+
+Scores a resume in well under a millisecond without calling the LLM, so
+``/analyze`` can be used freely while a user iterates and the credit-charged
+``/resume/analyze`` pass is kept for the final version.
+
+The score combines:
+
+- role fit: cosine similarity between the resume's skill vector
+  (sublinear TF x IDF over the skill vocabulary) and each role profile,
+- quantified impact: lines that carry a number with a unit, percentage or
+  currency,
+- section coverage: summary, education, experience, projects and skills
+  headings,
+- action verbs at the start of bullets, and a length sanity check.
+
+Text features are extracted with one compiled regex per feature; everything
+after that runs on NumPy arrays and a SciPy CSR matrix for the whole batch,
+so ``analyze_batch`` scores thousands of resumes per second on one core.
+"""
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy import sparse
+
+from services.prompt_compaction import SECTION_HEADINGS
+
+MODEL_VERSION = "local-v1"
+
+# Canonical skill -> other spellings found in resumes
+SKILL_ALIASES = {
+    "python": (), "java": (), "javascript": ("js", "es6"), "typescript": ("ts",), "c++": ("cpp",),
+    "c#": ("csharp",), "golang": ("go lang",), "rust": (), "kotlin": (), "swift": (), "scala": (),
+    "sql": (), "html": ("html5",), "css": ("css3",), "bash": ("shell scripting",),
+    "react": ("reactjs", "react.js"), "angular": ("angularjs",), "vue": ("vuejs", "vue.js"),
+    "next.js": ("nextjs",), "redux": (), "tailwind": ("tailwindcss",),
+    "node.js": ("nodejs", "node"), "express": ("expressjs", "express.js"), "django": (), "flask": (),
+    "fastapi": (), "spring boot": ("spring framework",), ".net": ("dotnet", "asp.net"),
+    "rest api": ("rest apis", "restful"), "graphql": (), "grpc": (), "microservices": (),
+    "postgresql": ("postgres",), "mysql": (), "mongodb": ("mongo",), "redis": (), "sqlite": (),
+    "elasticsearch": (), "kafka": (), "rabbitmq": (),
+    "docker": (), "kubernetes": ("k8s",), "aws": ("amazon web services",), "gcp": ("google cloud",),
+    "azure": (), "terraform": (), "ansible": (), "ci/cd": ("cicd", "continuous integration"),
+    "jenkins": (), "github actions": (), "linux": (), "git": (), "nginx": (), "prometheus": (),
+    "grafana": (), "monitoring": ("observability",),
+    "machine learning": ("ml",), "deep learning": (), "nlp": ("natural language processing",),
+    "computer vision": ("opencv",), "pytorch": (), "tensorflow": (), "keras": (),
+    "scikit-learn": ("sklearn", "scikit learn"), "pandas": (), "numpy": (), "statistics": (),
+    "llm": ("llms", "large language models"), "mlops": (), "spark": ("pyspark", "apache spark"),
+    "airflow": (), "etl": (), "data pipelines": ("data pipeline",), "tableau": (), "power bi": ("powerbi",),
+    "excel": (), "a/b testing": ("ab testing", "experimentation"), "data visualization": (),
+    "system design": (), "distributed systems": (), "data structures": (), "algorithms": (),
+    "unit testing": ("pytest", "junit", "jest", "testing"), "agile": ("scrum",),
+    "figma": (), "ux": ("user experience", "ui/ux"), "android": (), "ios": (), "flutter": (),
+    "react native": (), "product management": ("product roadmap", "roadmap"),
+    "stakeholder management": ("stakeholders",), "jira": (), "analytics": (),
+}
+
+# Role -> {skill: weight}; weights 3 = core, 2 = expected, 1 = a plus
+ROLE_PROFILES = {
+    "backend": {
+        "python": 3, "java": 2, "golang": 2, "node.js": 2, "sql": 3, "postgresql": 2, "mysql": 1, "redis": 2,
+        "rest api": 3, "microservices": 2, "docker": 2, "kubernetes": 1, "aws": 2, "django": 1, "flask": 1,
+        "fastapi": 1, "spring boot": 1, "kafka": 1, "system design": 2, "distributed systems": 2, "git": 1,
+        "unit testing": 2, "linux": 1, "grpc": 1,
+    },
+    "frontend": {
+        "javascript": 3, "typescript": 3, "react": 3, "html": 2, "css": 2, "next.js": 2, "redux": 1,
+        "vue": 1, "angular": 1, "tailwind": 1, "rest api": 1, "graphql": 1, "figma": 1, "ux": 1,
+        "unit testing": 2, "git": 1,
+    },
+    "fullstack": {
+        "javascript": 3, "typescript": 2, "react": 3, "node.js": 3, "express": 2, "html": 1, "css": 1,
+        "rest api": 2, "sql": 2, "mongodb": 2, "postgresql": 1, "docker": 1, "aws": 1, "git": 1,
+        "next.js": 1, "unit testing": 1,
+    },
+    "data_scientist": {
+        "python": 3, "machine learning": 3, "statistics": 3, "pandas": 2, "numpy": 2, "scikit-learn": 2,
+        "sql": 2, "deep learning": 1, "pytorch": 1, "tensorflow": 1, "nlp": 1, "data visualization": 2,
+        "a/b testing": 2, "spark": 1,
+    },
+    "ml_engineer": {
+        "python": 3, "machine learning": 3, "deep learning": 3, "pytorch": 2, "tensorflow": 2,
+        "mlops": 2, "docker": 2, "kubernetes": 1, "aws": 1, "llm": 2, "nlp": 1, "computer vision": 1,
+        "data pipelines": 1, "distributed systems": 1, "scikit-learn": 1, "numpy": 1,
+    },
+    "data_engineer": {
+        "python": 3, "sql": 3, "spark": 3, "airflow": 2, "etl": 3, "data pipelines": 3, "kafka": 2,
+        "aws": 2, "gcp": 1, "postgresql": 1, "docker": 1, "scala": 1, "distributed systems": 1,
+    },
+    "data_analyst": {
+        "sql": 3, "excel": 3, "tableau": 2, "power bi": 2, "python": 2, "statistics": 2,
+        "data visualization": 3, "pandas": 1, "a/b testing": 1, "analytics": 2,
+    },
+    "devops": {
+        "docker": 3, "kubernetes": 3, "aws": 3, "terraform": 2, "ci/cd": 3, "linux": 3, "bash": 2,
+        "ansible": 1, "jenkins": 1, "github actions": 1, "prometheus": 1, "grafana": 1, "monitoring": 2,
+        "python": 1, "gcp": 1, "azure": 1, "nginx": 1, "git": 1,
+    },
+    "mobile": {
+        "android": 3, "ios": 3, "kotlin": 2, "swift": 2, "flutter": 2, "react native": 2, "java": 1,
+        "rest api": 1, "git": 1, "unit testing": 1, "figma": 1,
+    },
+    "product_manager": {
+        "product management": 3, "stakeholder management": 3, "agile": 2, "analytics": 2,
+        "a/b testing": 2, "sql": 1, "jira": 1, "ux": 2, "figma": 1, "data visualization": 1,
+    },
+}
+
+CORE_SECTIONS = ("summary", "education", "experience", "projects", "skills")
+
+ACTION_VERBS = (
+    "achieved", "automated", "architected", "built", "created", "cut", "delivered", "deployed", "designed",
+    "developed", "drove", "engineered", "established", "implemented", "improved", "increased", "integrated",
+    "launched", "led", "managed", "mentored", "migrated", "optimized", "optimised", "owned", "reduced",
+    "refactored", "scaled", "shipped", "spearheaded", "streamlined",
+)
+
+# Weights of the score components (sum to 100)
+WEIGHT_ROLE_FIT = 40
+WEIGHT_IMPACT = 25
+WEIGHT_SECTIONS = 20
+WEIGHT_VERBS = 10
+WEIGHT_LENGTH = 5
+
+# Cosine similarity treated as a full role match; real resumes rarely exceed it
+ROLE_FIT_FULL = 0.6
+IMPACT_FULL = 5
+VERBS_FULL = 8
+MIN_WORDS = 150
+MAX_WORDS = 1200
+MISSING_SKILLS_LIMIT = 5
+
+_METRIC = (
+    r"\d[\d,.]*\s*(?:%|percent|x\b|k\b|m\b|\+|million|billion|thousand|lakh|crore|users|customers|clients"
+    r"|requests|ms\b|seconds|hours|days|people|members|engineers|students)|[$₹€£]\s*\d"
+)
+_QUANTIFIED_LINE = re.compile(rf"^[^\n]*?(?:{_METRIC})[^\n]*", re.MULTILINE | re.IGNORECASE)
+_ACTION_LINE = re.compile(
+    r"^[ \t]*(?:[-•*▪●◦‣][ \t]*)?(?:" + "|".join(ACTION_VERBS) + r")\b",
+    re.MULTILINE | re.IGNORECASE,
+)
+_HEADING_NAMES = {
+    spelling: name for name, spellings in SECTION_HEADINGS.items() for spelling in spellings
+}
+_HEADING_LINE = re.compile(
+    r"^[#*\s]*("
+    + "|".join(re.escape(spelling) for spelling in sorted(_HEADING_NAMES, key=len, reverse=True))
+    + r")[\s:*#]*$",
+    re.MULTILINE | re.IGNORECASE,
+)
+_WORD = re.compile(r"\S+")
+
+
 class MLService:
-    def analyze(self, text: str) -> dict:
-        # Placeholder for ML model
-        return {"sentiment": "positive", "confidence": 0.95, "analysis": f"Mock analysis for: {text}"}
+    def __init__(self, aliases: Dict[str, Sequence[str]], profiles: Dict[str, Dict[str, float]]):
+        self.skills = sorted(aliases)
+        self.index = {skill: i for i, skill in enumerate(self.skills)}
+        self.roles = sorted(profiles)
+        self.profiles = profiles
+
+        self._canonical = {}
+        for skill, spellings in aliases.items():
+            for spelling in (skill, *spellings):
+                self._canonical[spelling] = skill
+        surface = sorted(self._canonical, key=len, reverse=True)
+        self._skill_pattern = re.compile(
+            r"(?<![\w+#.])(?:" + "|".join(re.escape(s) for s in surface) + r")(?![\w+#]|\.\w)",
+        )
+
+        # IDF over role profiles: a skill every role asks for says little about fit
+        vocab = len(self.skills)
+        profile_matrix = np.zeros((len(self.roles), vocab))
+        for r, role in enumerate(self.roles):
+            for skill, weight in profiles[role].items():
+                profile_matrix[r, self.index[skill]] = weight
+        document_frequency = np.count_nonzero(profile_matrix, axis=0)
+        self.idf = np.log((1 + len(self.roles)) / (1 + document_frequency)) + 1.0
+        profile_matrix *= self.idf
+        profile_matrix /= np.linalg.norm(profile_matrix, axis=1, keepdims=True)
+        self._profiles_t = profile_matrix.T.copy()
+
+        self._ranked_skills = {
+            role: sorted(profiles[role], key=lambda skill: -profiles[role][skill]) for role in self.roles
+        }
+
+    def _skill_counts(self, text: str) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for match in self._skill_pattern.findall(text.lower()):
+            column = self.index[self._canonical[match]]
+            counts[column] = counts.get(column, 0) + 1
+        return counts
+
+    def _skill_matrix(self, counts: List[Dict[int, int]]) -> sparse.csr_matrix:
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in counts])
+        indices = np.fromiter((col for row in counts for col in row), dtype=np.int32, count=indptr[-1])
+        data = np.fromiter((n for row in counts for n in row.values()), dtype=np.float64, count=indptr[-1])
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(counts), len(self.skills)))
+        # Sublinear TF so a skill repeated ten times does not dominate, then IDF and L2 norm
+        matrix.data = (1.0 + np.log(matrix.data)) * self.idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ matrix
+
+    def score_batch(self, texts: Sequence[str], role: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Feature arrays and scores for a batch, one row per text.
+
+        ``role`` pins the role fit to one profile; otherwise each resume is
+        matched to its best-fitting role.
+        """
+        if role is not None and role not in self.profiles:
+            raise ValueError(f"Unknown role '{role}'. Expected one of: {', '.join(self.roles)}")
+
+        counts = [self._skill_counts(text) for text in texts]
+        quantified = np.fromiter((len(_QUANTIFIED_LINE.findall(t)) for t in texts), dtype=np.float64, count=len(texts))
+        verbs = np.fromiter((len(_ACTION_LINE.findall(t)) for t in texts), dtype=np.float64, count=len(texts))
+        words = np.fromiter((len(_WORD.findall(t)) for t in texts), dtype=np.float64, count=len(texts))
+        sections = [
+            {_HEADING_NAMES[h.strip().lower()] for h in _HEADING_LINE.findall(t)} for t in texts
+        ]
+        coverage = np.fromiter(
+            (sum(name in found for name in CORE_SECTIONS) for found in sections),
+            dtype=np.float64,
+            count=len(texts),
+        )
+
+        similarity = np.asarray(self._skill_matrix(counts) @ self._profiles_t)
+        if role is None:
+            best = similarity.argmax(axis=1) if len(texts) else np.zeros(0, dtype=np.int64)
+        else:
+            best = np.full(len(texts), self.roles.index(role))
+        fit = similarity[np.arange(len(texts)), best] if len(texts) else np.zeros(0)
+
+        length = np.where(
+            words < MIN_WORDS,
+            words / MIN_WORDS,
+            np.where(words > MAX_WORDS, np.maximum(0.0, 1.0 - (words - MAX_WORDS) / MAX_WORDS), 1.0),
+        )
+        scores = (
+            WEIGHT_ROLE_FIT * np.minimum(fit / ROLE_FIT_FULL, 1.0)
+            + WEIGHT_IMPACT * np.minimum(quantified / IMPACT_FULL, 1.0)
+            + WEIGHT_SECTIONS * coverage / len(CORE_SECTIONS)
+            + WEIGHT_VERBS * np.minimum(verbs / VERBS_FULL, 1.0)
+            + WEIGHT_LENGTH * length
+        )
+        return {
+            "scores": np.rint(scores).astype(np.int64),
+            "similarity": similarity,
+            "role_index": best,
+            "role_fit": fit,
+            "quantified": quantified,
+            "action_verbs": verbs,
+            "words": words,
+            "sections": sections,
+            "skills": counts,
+        }
+
+    def analyze_batch(self, texts: Sequence[str], role: Optional[str] = None) -> List[Dict[str, Any]]:
+        batch = self.score_batch(texts, role)
+        results = []
+        for i in range(len(texts)):
+            matched_role = self.roles[batch["role_index"][i]]
+            found = {self.skills[column] for column in batch["skills"][i]}
+            results.append({
+                "score": int(batch["scores"][i]),
+                "role": matched_role,
+                "role_fit": round(float(batch["role_fit"][i]), 3),
+                "role_scores": {
+                    name: round(float(value), 3) for name, value in zip(self.roles, batch["similarity"][i])
+                },
+                "skills": sorted(found),
+                "missing_skills": [
+                    skill for skill in self._ranked_skills[matched_role] if skill not in found
+                ][:MISSING_SKILLS_LIMIT],
+                "quantified_lines": int(batch["quantified"][i]),
+                "action_verbs": int(batch["action_verbs"][i]),
+                "word_count": int(batch["words"][i]),
+                "sections": [name for name in CORE_SECTIONS if name in batch["sections"][i]],
+                "missing_sections": [name for name in CORE_SECTIONS if name not in batch["sections"][i]],
+                "model": MODEL_VERSION,
+            })
+        return results
+
+    def analyze(self, text: str, role: Optional[str] = None) -> dict:
+        return self.analyze_batch([text], role)[0]
 
-ml_service = MLService()
+ml_service = MLService(SKILL_ALIASES, ROLE_PROFILES)
@@ -0,0 +1,316 @@
+"""
+Resume text compaction before it is put into an LLM prompt.
+
+Text pasted from PDFs carries layout noise that costs prompt-evaluation time
+without helping the model: runs of whitespace, bullet glyphs, page numbers,
+headers/footers repeated on every page, separator lines and boilerplate
+("References available upon request"). ``compact_resume`` removes that,
+splits the text into sections by their headings and, if the result is still
+over ``resume_prompt_token_budget``, drops low-value sections first
+(references, hobbies, declarations) and then trims the rest line by line,
+keeping the start of every section. Lines too long to drop whole (a resume
+pasted as one paragraph) are cut at a word boundary, and the rendered text
+is capped at the budget as a last resort, so the result never exceeds it.
+
+Token counts are estimates (about four characters per token for English
+text), which is close enough for budgeting and reporting savings.
+"""
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from services.metrics import registry
+from settings import settings
+
+TRUNCATION_MARK = "[...]"
+
+# Lines this close to a page number or separator can be a page header/footer
+PAGE_EDGE_LINES = 2
+
+# Canonical section name -> heading spellings
+SECTION_HEADINGS = {
+    "summary": ("summary", "profile", "professional summary", "about me", "objective", "career objective"),
+    "education": ("education", "academic background", "academics", "academic qualifications", "qualifications"),
+    "experience": (
+        "experience", "work experience", "professional experience", "employment", "employment history",
+        "internships", "internship", "work history",
+    ),
+    "projects": ("projects", "academic projects", "personal projects", "key projects"),
+    "skills": ("skills", "technical skills", "core skills", "key skills", "technologies", "tools"),
+    "achievements": ("achievements", "awards", "honors", "honours", "accomplishments"),
+    "certifications": ("certifications", "certificates", "courses", "training"),
+    "publications": ("publications", "research"),
+    "activities": (
+        "extracurricular activities", "extra-curricular activities", "activities", "leadership",
+        "positions of responsibility", "volunteering", "volunteer experience",
+    ),
+    "languages": ("languages",),
+    "interests": ("interests", "hobbies", "hobbies and interests"),
+    "personal": ("personal details", "personal information", "personal profile"),
+    "declaration": ("declaration",),
+    "references": ("references", "referees"),
+}
+
+# Higher keeps more of its text under budget pressure; 0 is dropped first
+SECTION_PRIORITY = {
+    "experience": 5,
+    "projects": 5,
+    "skills": 4,
+    "header": 3,
+    "education": 3,
+    "summary": 2,
+    "achievements": 2,
+    "certifications": 2,
+    "publications": 2,
+    "activities": 1,
+    "other": 1,
+    "languages": 0,
+    "interests": 0,
+    "personal": 0,
+    "declaration": 0,
+    "references": 0,
+}
+
+_HEADING_LOOKUP = {
+    spelling: name for name, spellings in SECTION_HEADINGS.items() for spelling in spellings
+}
+
+_BULLETS = re.compile(r"^[•‣▪▫●○◦⁃∙➢✓✔·*\-–—>]+\s*")
+_SPACES = re.compile(r"[ \t\f\v  -​  　]+")
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f﻿]")
+_SEPARATOR = re.compile(r"^[\s\-_=~*.—–|#]{3,}$")
+_PAGE_NUMBER = re.compile(
+    r"^(?:page\s*)?\d{1,3}(?:\s*(?:of|/)\s*\d{1,3})?$|^-\s*\d{1,3}\s*-$",
+    re.IGNORECASE,
+)
+_BOILERPLATE = re.compile(
+    r"^(?:references?\s+(?:are\s+)?available\s+(?:up)?on\s+request\.?"
+    r"|curriculum\s+vitae|resume|r[eé]sum[eé]|cv"
+    r"|i\s+hereby\s+declare\b.*)$",
+    re.IGNORECASE,
+)
+# Contact details, which resume templates repeat in every page's header or footer
+_CONTACT = re.compile(
+    r"[\w.+-]+@[\w-]+\.[\w.-]+|\+?\d[\d ().-]{7,}\d|\b(?:linkedin|github)\.com/",
+    re.IGNORECASE,
+)
+_HEADING_TEXT = re.compile(r"^[#*\s]*([A-Za-z][A-Za-z &/\-]{1,40}?)[\s:*#]*$")
+
+prompt_tokens_original = registry.counter(
+    "llm_prompt_input_tokens_original_total",
+    "Estimated tokens of user-supplied prompt input before compaction.",
+    ("feature",),
+)
+prompt_tokens_sent = registry.counter(
+    "llm_prompt_input_tokens_sent_total",
+    "Estimated tokens of user-supplied prompt input after compaction.",
+    ("feature",),
+)
+
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+@dataclass
+class Section:
+    name: str
+    heading: Optional[str]
+    lines: List[str] = field(default_factory=list)
+
+    def render(self) -> str:
+        return "\n".join(([self.heading] if self.heading else []) + self.lines)
+
+
+@dataclass
+class CompactedText:
+    text: str
+    original_tokens: int
+    tokens: int
+    sections: List[str]
+    dropped_sections: List[str]
+    truncated_sections: List[str]
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.tokens)
+
+    def headers(self, tokens_sent: Optional[int] = None) -> Dict[str, str]:
+        # tokens_sent overrides the compacted size when only part of it was sent
+        sent = self.tokens if tokens_sent is None else tokens_sent
+        return {
+            "X-Prompt-Tokens-Original": str(self.original_tokens),
+            "X-Prompt-Tokens-Sent": str(sent),
+            "X-Prompt-Tokens-Saved": str(max(0, self.original_tokens - sent)),
+        }
+
+
+def normalize_lines(text: str) -> List[str]:
+    """Normalized, non-empty lines with bullet glyphs unified to ``- ``."""
+    text = unicodedata.normalize("NFKC", text)
+    text = _CONTROL.sub("", text).replace("\r\n", "\n").replace("\r", "\n")
+    lines = []
+    for raw in text.split("\n"):
+        line = _SPACES.sub(" ", raw).strip()
+        if not line:
+            continue
+        bullet = _BULLETS.match(line)
+        if bullet and len(line) > bullet.end():
+            line = "- " + line[bullet.end():]
+        lines.append(line)
+    return lines
+
+
+def _is_noise(line: str) -> bool:
+    return bool(_SEPARATOR.match(line) or _PAGE_NUMBER.match(line) or _BOILERPLATE.match(line))
+
+
+def _heading(line: str) -> Optional[str]:
+    match = _HEADING_TEXT.match(line)
+    if match is None:
+        return None
+    return _HEADING_LOOKUP.get(match.group(1).strip().lower())
+
+
+def strip_noise(lines: List[str]) -> List[str]:
+    """
+    Drop layout noise, consecutive duplicate lines and page headers/footers.
+
+    A line seen earlier is only treated as a header/footer when it is a
+    contact line or a non-bullet line next to a page break (page number or
+    separator); the same bullet under two different entries is kept.
+    """
+    page_edges = set()
+    for index, line in enumerate(lines):
+        if _PAGE_NUMBER.match(line) or _SEPARATOR.match(line):
+            page_edges.update(range(index - PAGE_EDGE_LINES, index + PAGE_EDGE_LINES + 1))
+
+    seen = set()
+    kept = []
+    previous = None
+    for index, line in enumerate(lines):
+        if _is_noise(line):
+            continue
+        key = line.lower()
+        if _heading(line) is None:
+            if key == previous:
+                continue
+            if key in seen and (_CONTACT.search(line) or (index in page_edges and not line.startswith("- "))):
+                continue
+        seen.add(key)
+        kept.append(line)
+        previous = key
+    return kept
+
+
+def split_sections(lines: List[str]) -> List[Section]:
+    sections = [Section(name="header", heading=None)]
+    for line in lines:
+        name = _heading(line)
+        if name is not None:
+            if sections[-1].name == name:
+                # Same heading repeated (e.g. "Experience (contd.)" on page 2)
+                continue
+            sections.append(Section(name=name, heading=line.rstrip(":").strip() + ":"))
+        else:
+            sections[-1].lines.append(line)
+    return [section for section in sections if section.lines]
+
+
+def _render(sections: List[Section]) -> str:
+    return "\n\n".join(section.render() for section in sections)
+
+
+def _shorten(text: str, max_chars: int) -> str:
+    """Cut ``text`` to at most ``max_chars``, at a word boundary where possible, marking the cut."""
+    if len(text) <= max_chars:
+        return text
+    keep = max_chars - len(TRUNCATION_MARK) - 1
+    if keep <= 0:
+        return TRUNCATION_MARK if max_chars >= len(TRUNCATION_MARK) else text[:max(max_chars, 0)]
+    cut = text[:keep]
+    space = cut.rfind(" ")
+    # Only back off to a word boundary when it does not throw away most of the room
+    if space > keep // 2 and not text[keep].isspace():
+        cut = cut[:space]
+    return cut.rstrip() + " " + TRUNCATION_MARK
+
+
+def _fit(sections: List[Section], budget: int) -> List[str]:
+    """
+    Trim section lines, lowest priority and longest first, until under
+    budget. Once every section is down to one line (e.g. a resume pasted as
+    one paragraph), the longest remaining line is cut instead.
+    """
+    truncated = []
+    sizes = {id(section): len(section.render()) for section in sections}
+    # Rendered length is the section sizes plus the blank lines between them
+    total = sum(sizes.values()) + 2 * (len(sections) - 1)
+    limit = budget * CHARS_PER_TOKEN
+    while total > limit:
+        trimmable = [s for s in sections if len(s.lines) - (s.lines[-1] == TRUNCATION_MARK) > 1]
+        if trimmable:
+            # Lower priority first; among equals, trim whichever is longest
+            target = min(trimmable, key=lambda s: (SECTION_PRIORITY.get(s.name, 1), -sizes[id(s)]))
+            if target.lines[-1] == TRUNCATION_MARK:
+                target.lines.pop()
+                sizes[id(target)] -= len(TRUNCATION_MARK) + 1
+            sizes[id(target)] -= len(target.lines.pop()) + 1
+            target.lines.append(TRUNCATION_MARK)
+            sizes[id(target)] += len(TRUNCATION_MARK) + 1
+        else:
+            target = max(sections, key=lambda s: len(s.lines[0]))
+            line = target.lines[0]
+            shortened = _shorten(line, max(len(line) - (total - limit), len(TRUNCATION_MARK)))
+            if len(shortened) >= len(line):
+                break
+            target.lines[0] = shortened
+            sizes[id(target)] -= len(line) - len(shortened)
+            if len(target.lines) > 1 and target.lines[-1] == TRUNCATION_MARK and shortened.endswith(TRUNCATION_MARK):
+                # The cut line already marks that the section continues
+                target.lines.pop()
+                sizes[id(target)] -= len(TRUNCATION_MARK) + 1
+        total = sum(sizes.values()) + 2 * (len(sections) - 1)
+        if target.name not in truncated:
+            truncated.append(target.name)
+    return truncated
+
+
+def compact_resume(text: str, token_budget: Optional[int] = None, feature: str = "resume") -> CompactedText:
+    budget = settings.resume_prompt_token_budget if token_budget is None else token_budget
+    original_tokens = estimate_tokens(text)
+
+    if not settings.resume_compaction_enabled:
+        return CompactedText(text, original_tokens, original_tokens, [], [], [])
+
+    sections = split_sections(strip_noise(normalize_lines(text)))
+    dropped: List[str] = []
+    if budget > 0 and estimate_tokens(_render(sections)) > budget:
+        for section in sorted(sections, key=lambda s: SECTION_PRIORITY.get(s.name, 1)):
+            if SECTION_PRIORITY.get(section.name, 1) > 0 or estimate_tokens(_render(sections)) <= budget:
+                break
+            sections.remove(section)
+            dropped.append(section.name)
+    truncated = _fit(sections, budget) if budget > 0 else []
+
+    compacted = _render(sections)
+    if budget > 0 and estimate_tokens(compacted) > budget:
+        # Headings and separators alone can still exceed a tiny budget
+        compacted = _shorten(compacted, budget * CHARS_PER_TOKEN)
+        truncated = truncated or [section.name for section in sections]
+    result = CompactedText(
+        text=compacted,
+        original_tokens=original_tokens,
+        tokens=estimate_tokens(compacted),
+        sections=[section.name for section in sections],
+        dropped_sections=dropped,
+        truncated_sections=truncated,
+    )
+    prompt_tokens_original.inc(feature, amount=result.original_tokens)
+    prompt_tokens_sent.inc(feature, amount=result.tokens)
+    return result
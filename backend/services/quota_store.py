@@ -0,0 +1,346 @@
+"""
+Shared counter store for rate limits and tier quotas.
+
+Every limit is a sliding window approximated from two fixed windows: the
+count of the current window plus the previous window's count weighted by
+how much of it still overlaps the sliding window. Each key therefore needs
+one row (current window start, current count, previous count) and never
+has to be cleaned up per request.
+
+``QuotaStore.hit`` evaluates several limits at once (for example the route
+limit and the caller's tier quotas) and only counts the request when all of
+them allow it; ``QuotaStore.refund`` takes a counted request back (its
+handler failed). With the SQLite store this runs in a single ``BEGIN
+IMMEDIATE`` transaction on a file shared by every worker process, so
+``uvicorn --workers N`` enforces one limit instead of N.
+"""
+import logging
+import math
+from abc import ABC, abstractmethod
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+}
+
+_RATE = re.compile(r"^\s*(\d+)\s*(?:/|per)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Rate:
+    limit: int
+    period: int
+    text: str
+
+
+def parse_rate(text: str) -> Rate:
+    """Parse ``"5/minute"``, ``"100 per day"`` or ``"10/5 minutes"``."""
+    match = _RATE.match(text)
+    if match is None:
+        raise ValueError(f"Invalid rate limit: {text!r}")
+    amount, multiple, unit = match.groups()
+    return Rate(limit=int(amount), period=int(multiple or 1) * _PERIODS[unit.lower()], text=text.strip())
+
+
+def parse_rates(text: str) -> List[Rate]:
+    """Parse one or more rates separated by ``;`` or ``,``."""
+    return [parse_rate(part) for part in re.split(r"[;,]", text) if part.strip()]
+
+
+@dataclass(frozen=True)
+class QuotaCheck:
+    key: str
+    rate: Rate
+    # Requests this check counts per hit (e.g. one per bullet of a batch)
+    cost: int = 1
+
+
+@dataclass
+class QuotaDecision:
+    allowed: bool
+    # First check that rejected the request, and when to try again
+    rejected: Optional[QuotaCheck] = None
+    retry_after: int = 0
+    # When the request was counted, so a refund finds the window it landed in
+    counted_at: float = 0.0
+
+
+def _window_start(now: float, period: int) -> int:
+    return int(now // period) * period
+
+
+def _roll(row: Optional[Tuple[int, int, int]], window: int, period: int) -> Tuple[int, int]:
+    """Return (current, previous) counts for ``window`` from a stored row."""
+    if row is None:
+        return 0, 0
+    stored_window, current, previous = row
+    if stored_window == window:
+        return current, previous
+    if stored_window == window - period:
+        return 0, current
+    return 0, 0
+
+
+def _weighted(current: int, previous: int, now: float, window: int, period: int) -> float:
+    overlap = 1.0 - (now - window) / period
+    return current + previous * overlap
+
+
+def _retry_after(current: int, previous: int, now: float, window: int, rate: Rate, cost: int) -> int:
+    """Seconds until the sliding count leaves room for ``cost`` more."""
+    if previous > 0 and current + cost <= rate.limit:
+        # The previous window's share decays linearly over this window
+        needed = (current + cost + previous - rate.limit) / previous
+        return max(1, math.ceil(window + needed * rate.period - now))
+    return max(1, math.ceil(window + rate.period - now))
+
+
+class QuotaStore(ABC):
+    backend = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.checks = 0
+        self.rejected = 0
+        self.errors = 0
+        self.total_check_seconds = 0.0
+        self.max_check_seconds = 0.0
+
+    @abstractmethod
+    def _hit(self, checks: Sequence[QuotaCheck], cost: int, now: float) -> QuotaDecision:
+        """Atomically decide and count ``checks``."""
+
+    def hit(self, checks: Sequence[QuotaCheck], cost: int = 1) -> QuotaDecision:
+        """Count one request against every check, or none of them if any would be exceeded."""
+        started = time.perf_counter()
+        now = time.time()
+        try:
+            decision = self._hit(checks, cost, now)
+            decision.counted_at = now
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.checks += 1
+                self.total_check_seconds += elapsed
+                self.max_check_seconds = max(self.max_check_seconds, elapsed)
+        if not decision.allowed:
+            with self._stats_lock:
+                self.rejected += 1
+        return decision
+
+    def _decide(
+        self,
+        checks: Sequence[QuotaCheck],
+        rows: Dict[str, Optional[Tuple[int, int, int]]],
+        cost: int,
+        now: float,
+    ) -> Tuple[QuotaDecision, Dict[str, Tuple[int, int, int]]]:
+        """Shared decision logic; returns the rows to write when allowed."""
+        updates: Dict[str, Tuple[int, int, int]] = {}
+        for check in checks:
+            period = check.rate.period
+            window = _window_start(now, period)
+            current, previous = _roll(rows.get(check.key), window, period)
+            check_cost = cost * check.cost
+            if _weighted(current, previous, now, window, period) + check_cost > check.rate.limit:
+                retry_after = _retry_after(current, previous, now, window, check.rate, check_cost)
+                return QuotaDecision(allowed=False, rejected=check, retry_after=retry_after), {}
+            updates[check.key] = (window, current + check_cost, previous)
+        return QuotaDecision(allowed=True), updates
+
+    @abstractmethod
+    def _refund(self, checks: Sequence[QuotaCheck], cost: int, counted_at: float) -> None:
+        """Atomically uncount ``checks``."""
+
+    def refund(self, checks: Sequence[QuotaCheck], counted_at: float, cost: int = 1) -> None:
+        """Take back a request that ``hit`` counted at ``counted_at``."""
+        self._refund(checks, cost, counted_at)
+
+    def _refunded(
+        self,
+        checks: Sequence[QuotaCheck],
+        rows: Dict[str, Optional[Tuple[int, int, int]]],
+        cost: int,
+        counted_at: float,
+    ) -> Dict[str, Tuple[int, int, int]]:
+        """Shared refund logic; returns the rows to write."""
+        updates: Dict[str, Tuple[int, int, int]] = {}
+        for check in checks:
+            row = rows.get(check.key)
+            if row is None:
+                continue
+            period = check.rate.period
+            counted_window = _window_start(counted_at, period)
+            stored_window, current, previous = row
+            amount = cost * check.cost
+            if stored_window == counted_window:
+                updates[check.key] = (stored_window, max(0, current - amount), previous)
+            elif stored_window == counted_window + period:
+                # The window has rolled over since; the request is in the previous count now
+                updates[check.key] = (stored_window, current, max(0, previous - amount))
+        return updates
+
+    @abstractmethod
+    def reset(self) -> None:
+        """Forget every counter."""
+
+    def stats(self) -> Dict[str, object]:
+        with self._stats_lock:
+            return {
+                "backend": self.backend,
+                "checks": self.checks,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "avg_check_ms": round(self.total_check_seconds / self.checks * 1000, 4) if self.checks else 0.0,
+                "max_check_ms": round(self.max_check_seconds * 1000, 4),
+            }
+
+
+class MemoryQuotaStore(QuotaStore):
+    """Per-process store; only correct with a single worker."""
+
+    backend = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._rows: Dict[str, Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _hit(self, checks: Sequence[QuotaCheck], cost: int, now: float) -> QuotaDecision:
+        with self._lock:
+            rows = {check.key: self._rows.get(check.key) for check in checks}
+            decision, updates = self._decide(checks, rows, cost, now)
+            self._rows.update(updates)
+        return decision
+
+    def _refund(self, checks: Sequence[QuotaCheck], cost: int, counted_at: float) -> None:
+        with self._lock:
+            rows = {check.key: self._rows.get(check.key) for check in checks}
+            self._rows.update(self._refunded(checks, rows, cost, counted_at))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._rows.clear()
+
+
+class SQLiteQuotaStore(QuotaStore):
+    """Store shared by every process that opens the same SQLite file."""
+
+    backend = "sqlite"
+
+    # Drop keys that have gone quiet every this many checks
+    PURGE_EVERY = 10000
+
+    def __init__(self, path: str, busy_timeout_ms: int):
+        super().__init__()
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._max_period = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly below
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota_windows ("
+                " key TEXT PRIMARY KEY,"
+                " window_start INTEGER NOT NULL,"
+                " current INTEGER NOT NULL,"
+                " previous INTEGER NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _hit(self, checks: Sequence[QuotaCheck], cost: int, now: float) -> QuotaDecision:
+        conn = self._connection()
+        keys = [check.key for check in checks]
+        self._max_period = max(self._max_period, *(check.rate.period for check in checks))
+        if self.checks and self.checks % self.PURGE_EVERY == 0:
+            # Rows older than two periods no longer affect any window
+            self.purge(2 * self._max_period)
+        # Take the write lock up front so read-decide-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            placeholders = ",".join("?" for _ in keys)
+            rows = {
+                key: (window, current, previous)
+                for key, window, current, previous in conn.execute(
+                    f"SELECT key, window_start, current, previous FROM quota_windows WHERE key IN ({placeholders})",
+                    keys,
+                )
+            }
+            decision, updates = self._decide(checks, rows, cost, now)
+            if updates:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO quota_windows (key, window_start, current, previous) VALUES (?, ?, ?, ?)",
+                    [(key, *row) for key, row in updates.items()],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    def _refund(self, checks: Sequence[QuotaCheck], cost: int, counted_at: float) -> None:
+        conn = self._connection()
+        keys = [check.key for check in checks]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            placeholders = ",".join("?" for _ in keys)
+            rows = {
+                key: (window, current, previous)
+                for key, window, current, previous in conn.execute(
+                    f"SELECT key, window_start, current, previous FROM quota_windows WHERE key IN ({placeholders})",
+                    keys,
+                )
+            }
+            updates = self._refunded(checks, rows, cost, counted_at)
+            if updates:
+                conn.executemany(
+                    "UPDATE quota_windows SET window_start = ?, current = ?, previous = ? WHERE key = ?",
+                    [(*row, key) for key, row in updates.items()],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge(self, older_than_seconds: float) -> int:
+        """Delete keys that have not been hit for ``older_than_seconds``."""
+        conn = self._connection()
+        cursor = conn.execute(
+            "DELETE FROM quota_windows WHERE window_start < ?",
+            (int(time.time() - older_than_seconds),),
+        )
+        return cursor.rowcount
+
+    def reset(self) -> None:
+        self._connection().execute("DELETE FROM quota_windows")
+
+
+def build_quota_store(backend: str) -> QuotaStore:
+    if backend == "memory":
+        return MemoryQuotaStore()
+    if backend == "sqlite":
+        return SQLiteQuotaStore(settings.rate_limit_sqlite_path, settings.SQLITE_BUSY_TIMEOUT_MS)
+    raise ValueError(f"Unknown rate_limit_storage backend: {backend!r}")
+
+
+quota_store = build_quota_store(settings.rate_limit_storage)
@@ -0,0 +1,202 @@
+"""
+Incremental re-analysis of an edited resume.
+
+An incremental analysis is stored per section: every section of the
+(compacted) resume gets its own score and findings, tagged with a digest of
+the section's text. When the same user resubmits, the digests of the new
+sections are compared with those of their latest sectioned analysis in
+``AIHistory``; only sections that are new or whose text changed are sent to
+the LLM, and the stored findings of the rest are reused. The overall score
+is the weighted mean of the section scores, and the flat ``strengths`` /
+``weaknesses`` / ``suggestions`` lists are rebuilt from all sections, so
+the response has the same shape as a full analysis.
+
+The first incremental request of a user (or one after a plain
+``/resume/analyze``) analyzes every section once to seed the per-section
+results.
+"""
+import hashlib
+import logging
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from database import get_async_sessionmaker
+from models.history import AIHistory
+from services.ai_service import call_llm, resume_section_prompts
+from services.history_store import load_output
+from services.metrics import registry
+from services.prompt_compaction import estimate_tokens, normalize_lines, split_sections
+from services.scheduler import PRIORITY_FREE
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+FINDING_FIELDS = ("strengths", "weaknesses", "suggestions")
+
+# Contribution of each section to the overall score
+SECTION_WEIGHTS = {
+    "experience": 3.0,
+    "projects": 2.0,
+    "skills": 2.0,
+    "education": 1.0,
+    "summary": 1.0,
+    "header": 0.5,
+}
+
+resume_sections_total = registry.counter(
+    "resume_incremental_sections_total",
+    "Resume sections in incremental analyses, by whether they were analyzed or reused.",
+    ("outcome",),
+)
+
+
+@dataclass
+class ResumeSection:
+    name: str
+    text: str
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(f"{self.name}\n{self.text}".encode("utf-8")).hexdigest()[:16]
+
+
+def resume_sections(compacted_text: str) -> List[ResumeSection]:
+    """Sections of compacted resume text, with repeated headings merged."""
+    merged: Dict[str, List[str]] = {}
+    for section in split_sections(normalize_lines(compacted_text)):
+        merged.setdefault(section.name, []).extend(section.lines)
+    return [ResumeSection(name, "\n".join(lines)) for name, lines in merged.items()]
+
+
+async def load_previous_sections(user_email: str) -> Tuple[Optional[int], Dict[str, Dict[str, Any]]]:
+    """The user's latest sectioned resume analysis as (history id, {section name: analysis})."""
+    async with get_async_sessionmaker()() as db:
+        rows = (
+            await db.execute(
+                select(AIHistory.id, AIHistory.output_encoding, AIHistory.output_data, AIHistory.output_text)
+                .where(AIHistory.user_email == user_email, AIHistory.feature_type == "resume")
+                .order_by(AIHistory.created_at.desc(), AIHistory.id.desc())
+                .limit(settings.resume_incremental_lookback)
+            )
+        ).all()
+
+    for row in rows:
+        try:
+            output = load_output(row)
+        except (ValueError, zlib.error):
+            continue
+        sections = output.get("sections") if isinstance(output, dict) else None
+        if isinstance(sections, list):
+            return row.id, {
+                item["section"]: item
+                for item in sections
+                if isinstance(item, dict) and isinstance(item.get("section"), str) and item.get("digest")
+            }
+    return None, {}
+
+
+def _clean_section(item: Dict[str, Any]) -> Dict[str, Any]:
+    score = item.get("score")
+    return {
+        "score": min(100, max(0, int(score))) if isinstance(score, (int, float)) else None,
+        **{
+            field: [value for value in item.get(field, []) if isinstance(value, str)]
+            if isinstance(item.get(field), list) else []
+            for field in FINDING_FIELDS
+        },
+    }
+
+
+async def _analyze_sections(
+    changed: List[ResumeSection],
+    other_names: List[str],
+    priority: int,
+) -> Dict[str, Dict[str, Any]]:
+    prompts = resume_section_prompts([(s.name, s.text) for s in changed], other_names)
+    response = await call_llm(*prompts, feature="resume_sections", priority=priority)
+    items = response.get("sections") if isinstance(response, dict) else None
+    if not isinstance(items, list):
+        error_msg = "LLM returned no section analysis"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    by_name = {
+        item["section"].strip().lower(): item
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("section"), str)
+    }
+    return {s.name: _clean_section(by_name[s.name]) for s in changed if s.name in by_name}
+
+
+def _merge(
+    sections: List[ResumeSection],
+    previous: Dict[str, Dict[str, Any]],
+    fresh: Dict[str, Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    merged = []
+    weighted = 0.0
+    total_weight = 0.0
+    flat: Dict[str, List[str]] = {field: [] for field in FINDING_FIELDS}
+    for section in sections:
+        if section.name in fresh:
+            analysis = {**fresh[section.name], "digest": section.digest}
+        elif section.name in previous and previous[section.name].get("digest") == section.digest:
+            analysis = {**_clean_section(previous[section.name]), "digest": section.digest}
+        else:
+            # The model skipped it; leave the digest out so the next request retries it
+            analysis = {"score": None, **{field: [] for field in FINDING_FIELDS}, "digest": None}
+        merged.append({"section": section.name, **analysis})
+
+        if analysis["score"] is not None:
+            weight = SECTION_WEIGHTS.get(section.name, 1.0)
+            weighted += weight * analysis["score"]
+            total_weight += weight
+        for field in FINDING_FIELDS:
+            for finding in analysis[field]:
+                if finding not in flat[field]:
+                    flat[field].append(finding)
+
+    score = round(weighted / total_weight) if total_weight else 0
+    return merged, {"score": score, **flat}
+
+
+async def analyze_resume_incremental(
+    compacted_text: str,
+    user_email: str,
+    priority: int = PRIORITY_FREE,
+) -> Dict[str, Any]:
+    """
+    Analyze only the sections that changed since the user's last sectioned
+    analysis and merge the result with the stored findings of the rest.
+    """
+    sections = resume_sections(compacted_text)
+    base_id, previous = await load_previous_sections(user_email)
+    changed = [
+        s for s in sections
+        if s.name not in previous or previous[s.name].get("digest") != s.digest
+    ]
+    unchanged_names = [s.name for s in sections if s not in changed]
+
+    fresh = await _analyze_sections(changed, unchanged_names, priority) if changed else {}
+    merged, result = _merge(sections, previous, fresh)
+
+    resume_sections_total.inc("analyzed", amount=len(changed))
+    resume_sections_total.inc("reused", amount=len(unchanged_names))
+    logger.info(
+        f"Incremental resume analysis for {user_email}: "
+        f"{len(changed)} analyzed, {len(unchanged_names)} reused"
+    )
+    return {
+        **result,
+        "sections": merged,
+        "incremental": {
+            "base_history_id": base_id,
+            "analyzed_sections": [s.name for s in changed],
+            "reused_sections": unchanged_names,
+            "prompt_tokens": sum(estimate_tokens(s.text) for s in changed),
+        },
+    }
@@ -0,0 +1,165 @@
+"""
+Bounded, priority-aware admission control for upstream LLM work.
+
+At most ``llm_max_concurrency`` generations run against Ollama at once.
+Further requests wait in a bounded priority queue (paid tiers ahead of
+free tier, background jobs last). When the queue is full, or a request has
+waited longer than ``llm_queue_timeout``, it is rejected immediately with
+503 and a ``Retry-After`` hint instead of piling onto an overloaded model.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from services.metrics import llm_queue_wait, registry
+from settings import settings
+
+PRIORITY_PAID = 0
+PRIORITY_FREE = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_PAID: "paid",
+    PRIORITY_FREE: "free",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+def priority_for_tier(tier: Optional[str]) -> int:
+    if tier is None or tier == "free":
+        return PRIORITY_FREE
+    return PRIORITY_PAID
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._queued_by_priority: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+        self._seq = itertools.count()
+
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._avg_service_seconds = 10.0
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued_by_priority.values())
+
+    def _retry_after(self) -> int:
+        backlog = self.queued + 1
+        return max(1, math.ceil(self._avg_service_seconds * backlog / max(1, self.max_concurrency)))
+
+    def _reject(self, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=detail,
+            headers={"Retry-After": str(self._retry_after())},
+        )
+
+    def _record_wait(self, waited: float, priority: int) -> None:
+        llm_queue_wait.observe(waited, PRIORITY_NAMES.get(priority, str(priority)))
+        self.admitted += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    async def acquire(self, priority: int = PRIORITY_FREE) -> None:
+        if self._active < self.max_concurrency and self.queued == 0:
+            self._active += 1
+            self._record_wait(0.0, priority)
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected_full += 1
+            raise self._reject("LLM service is at capacity. Please retry shortly.")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._queued_by_priority[priority] = self._queued_by_priority.get(priority, 0) + 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on.
+                self.release()
+            else:
+                future.cancel()
+                self._queued_by_priority[priority] -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_timeout += 1
+                raise self._reject("Timed out waiting for LLM capacity. Please retry shortly.")
+            raise
+        self._record_wait(time.monotonic() - started, priority)
+
+    def release(self) -> None:
+        while self._queue:
+            priority, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._queued_by_priority[priority] -= 1
+            future.set_result(None)
+            return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_FREE) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * elapsed
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queued": self.queued,
+            "queued_by_priority": {
+                PRIORITY_NAMES.get(p, str(p)): n for p, n in self._queued_by_priority.items()
+            },
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 4),
+            "avg_service_seconds": round(self._avg_service_seconds, 4),
+        }
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=settings.llm_max_concurrency,
+    max_queue=settings.llm_max_queue,
+    queue_timeout=settings.llm_queue_timeout,
+)
+
+registry.gauge(
+    "llm_scheduler_active",
+    "LLM generations currently holding a scheduler slot.",
+    callback=lambda: [((), llm_scheduler._active)],
+)
+registry.gauge(
+    "llm_scheduler_queued",
+    "Requests waiting for an LLM scheduler slot, by priority.",
+    ("priority",),
+    callback=lambda: [
+        ((PRIORITY_NAMES.get(p, str(p)),), n) for p, n in llm_scheduler._queued_by_priority.items()
+    ],
+)
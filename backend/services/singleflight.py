@@ -0,0 +1,70 @@
+"""
+Single-flight coalescing of identical in-flight LLM calls.
+
+Concurrent callers that present the same key share one upstream call. The
+call runs in its own task, so a waiter that is cancelled (e.g. its client
+went away) only stops waiting; the shared call keeps running for everyone
+else and is cancelled only when no waiters remain. Results and exceptions
+are delivered to every waiter.
+"""
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None or call.task.done():
+            task = asyncio.ensure_future(fn())
+            call = _Call(task)
+            self._calls[key] = call
+            task.add_done_callback(lambda t, c=call: self._on_done(key, c, t))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+        return copy.deepcopy(result)
+
+    def _on_done(self, key: str, call: _Call, task: "asyncio.Task[Any]") -> None:
+        self._forget(key, call)
+        if not task.cancelled():
+            # Mark the exception as retrieved when every waiter has left.
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+llm_singleflight = SingleFlight()
@@ -0,0 +1,76 @@
+"""
+Server-Sent Events helpers for streamed LLM generations.
+
+The stream emits one ``token`` event per Ollama chunk, followed by either a
+``done`` event carrying the parsed JSON result or an ``error`` event.
+``on_complete`` runs only after the final JSON parses, so a request is
+charged at most once; ``on_abort`` runs instead for a broken or abandoned
+stream (e.g. to refund a credit reservation).
+"""
+import asyncio
+import json
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from services.ai_service import parse_llm_content
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_generation(
+    chunks: AsyncIterator[str],
+    on_complete: Callable[[Dict[str, Any]], None],
+    on_abort: Optional[Callable[[], None]] = None,
+    feature: Optional[str] = None,
+) -> AsyncIterator[str]:
+    parts = []
+    completed = False
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event("token", {"content": chunk})
+        result = parse_llm_content("".join(parts), feature)
+        await run_in_threadpool(on_complete, result)
+        completed = True
+    except HTTPException as e:
+        yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+        return
+    except Exception as e:
+        logger.error(f"Streaming generation failed: {str(e)}")
+        yield sse_event("error", {"status_code": 500, "detail": str(e)})
+        return
+    finally:
+        if not completed and on_abort is not None:
+            # Not awaited: the generator may be closing because the client left
+            asyncio.get_running_loop().run_in_executor(None, on_abort)
+
+    yield sse_event("done", result)
+
+
+def sse_response(
+    chunks: AsyncIterator[str],
+    on_complete: Callable[[Dict[str, Any]], None],
+    on_abort: Optional[Callable[[], None]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    feature: Optional[str] = None,
+) -> StreamingResponse:
+    return StreamingResponse(
+        stream_generation(chunks, on_complete, on_abort, feature),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, **(headers or {})},
+    )
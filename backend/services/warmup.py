@@ -0,0 +1,193 @@
+"""
+Model warm-up and keep-alive for the Ollama backends.
+
+At startup every configured model (``llm_warmup_models``, default
+``model_name``) is loaded on every backend that serves it by sending Ollama
+an empty ``/api/generate`` request, which loads the model and keeps it
+resident for ``ollama_keep_alive``. ``/health`` reports not-ready (503)
+until each model is warm on at least one backend, so a rolling deploy does
+not send users to an instance whose first request would pay the model load.
+
+Chat requests carry the same ``keep_alive``, so busy backends stay loaded on
+their own. A backend that served no requests during the last
+``llm_rewarm_interval_seconds`` gets the warm-up request again, which
+extends its keep-alive or reloads a model that was evicted.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from services.llm_client import get_client
+from services.llm_pool import Backend, BackendPool, llm_pool
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WarmState:
+    warm: bool = False
+    warmed_at: Optional[float] = None
+    load_seconds: Optional[float] = None
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+
+class ModelWarmer:
+    def __init__(
+        self,
+        pool: BackendPool,
+        models: List[str],
+        enabled: bool,
+        rewarm_interval: float,
+        retry_interval: float,
+        timeout: float,
+    ):
+        self.pool = pool
+        self.models = models
+        self.enabled = enabled
+        self.rewarm_interval = rewarm_interval
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+
+        self._states: Dict[Tuple[str, str], WarmState] = {}
+        self._last_requests: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.rewarms = 0
+
+    def _state(self, backend: Backend, model: str) -> WarmState:
+        return self._states.setdefault((backend.url, model), WarmState())
+
+    def _targets(self) -> List[Tuple[Backend, str]]:
+        return [
+            (backend, model)
+            for model in self.models
+            for backend in self.pool.backends
+            if not backend.drained and backend.serves(model)
+        ]
+
+    async def warm(self, backend: Backend, model: str) -> bool:
+        state = self._state(backend, model)
+        state.attempts += 1
+        started = time.monotonic()
+        try:
+            response = await get_client().post(
+                f"{backend.url}/api/generate",
+                json={"model": model, "keep_alive": settings.ollama_keep_alive},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if state.warm or state.attempts == 1:
+                logger.error(f"Warm-up of {model} on {backend.url} failed: {str(e)}")
+            state.warm = False
+            state.last_error = f"{type(e).__name__}: {e}"
+            return False
+
+        if not state.warm:
+            logger.info(f"{model} warm on {backend.url} ({time.monotonic() - started:.2f}s)")
+        state.warm = True
+        state.warmed_at = time.time()
+        state.load_seconds = round(time.monotonic() - started, 3)
+        state.last_error = None
+        return True
+
+    async def warm_all(self, only_cold: bool = False) -> None:
+        targets = [
+            (backend, model)
+            for backend, model in self._targets()
+            if not only_cold or not self._state(backend, model).warm
+        ]
+        await asyncio.gather(*(self.warm(backend, model) for backend, model in targets))
+
+    async def rewarm_idle(self) -> None:
+        """Re-send warm-up to backends that had no traffic since the last pass."""
+        targets = []
+        for backend, model in self._targets():
+            idle = self._last_requests.get(backend.url) == backend.requests
+            if idle or not self._state(backend, model).warm:
+                targets.append((backend, model))
+        for backend in self.pool.backends:
+            self._last_requests[backend.url] = backend.requests
+        if targets:
+            self.rewarms += len(targets)
+            await asyncio.gather(*(self.warm(backend, model) for backend, model in targets))
+
+    @property
+    def ready(self) -> bool:
+        if not self.enabled:
+            return True
+        return all(
+            any(
+                self._state(backend, model).warm
+                for backend in self.pool.backends
+                if not backend.drained and backend.serves(model)
+            )
+            for model in self.models
+        )
+
+    async def _run(self) -> None:
+        try:
+            await self.warm_all()
+        except Exception as e:
+            logger.error(f"Model warm-up failed: {str(e)}")
+        for backend in self.pool.backends:
+            self._last_requests[backend.url] = backend.requests
+        while True:
+            if not self.ready:
+                await asyncio.sleep(self.retry_interval)
+                try:
+                    await self.warm_all(only_cold=True)
+                except Exception as e:
+                    # Keep retrying; the readiness probe stays red until a pass succeeds
+                    logger.error(f"Model warm-up retry failed: {str(e)}")
+                continue
+            await asyncio.sleep(self.rewarm_interval)
+            try:
+                await self.rewarm_idle()
+            except Exception as e:
+                logger.error(f"Model re-warm failed: {str(e)}")
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "keep_alive": settings.ollama_keep_alive,
+            "rewarm_interval_seconds": self.rewarm_interval,
+            "rewarms": self.rewarms,
+            "models": {
+                model: {
+                    backend.url: vars(self._state(backend, model))
+                    for backend in self.pool.backends
+                    if backend.serves(model)
+                }
+                for model in self.models
+            },
+        }
+
+
+model_warmer = ModelWarmer(
+    pool=llm_pool,
+    models=settings.llm_warmup_models or [settings.model_name],
+    enabled=settings.llm_warmup_enabled,
+    rewarm_interval=settings.llm_rewarm_interval_seconds,
+    retry_interval=settings.llm_warmup_retry_seconds,
+    timeout=settings.llm_warmup_timeout,
+)
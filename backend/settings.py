@@ -8,14 +8,153 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+
+    # Password hashing (bcrypt cost; hashes are upgraded on login when it changes)
+    password_hash_rounds: int = 12
+    # Dedicated hashing processes (0 runs bcrypt on the threadpool) and queued+running cap
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 16
+
+    # Auth-relevant user fields cached per email (0 disables)
+    user_cache_ttl_seconds: float = 30.0
+    user_cache_max_entries: int = 10000
     
     # Database Configuration
     DATABASE_URL: str = "sqlite:///./app2.db"
+    # Async URL for AsyncSession; derived from DATABASE_URL (aiosqlite/asyncpg) when empty
+    ASYNC_DATABASE_URL: str = ""
+
+    # Connection pool (server databases)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+
+    # SQLite pragmas applied to every connection
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 65536
     
+    # Rate limits and tier quotas ("sqlite" is shared by all workers, "memory" is per process)
+    rate_limit_enabled: bool = True
+    rate_limit_storage: str = "sqlite"
+    rate_limit_sqlite_path: str = "./rate_limits.db"
+    # Extra rate windows per tier across the AI routes and bulk job items, e.g. {"free": "20/hour;100/day"}
+    # (the free tier's lifetime request allowance is enforced with the credits, not here)
+    rate_limit_tier_quotas: dict[str, str] = {}
+
+    # Idempotency-Key on the AI POST routes; the SQLite store is shared by all workers
+    idempotency_enabled: bool = True
+    idempotency_sqlite_path: str = "./idempotency.db"
+    idempotency_ttl_seconds: float = 24 * 3600.0
+    # A key whose request never finished (crashed worker) can be reused after this long
+    idempotency_in_progress_ttl: float = 900.0
+    # How long a retry waits for a request with the same key running in another worker
+    idempotency_wait_timeout: float = 120.0
+    idempotency_poll_interval: float = 0.5
+
     # AI Service Configuration
     provider: str = "ollama"
     ollama_base_url: str = "http://localhost:11434"
     model_name: str = "llama3:8b"
+    # Several Ollama nodes, e.g. [{"url": "http://gpu1:11434", "weight": 2, "models": ["llama3:8b"]}];
+    # empty means just ollama_base_url; "weight": 0 drains a node (no new requests)
+    ollama_backends: list[dict] = []
+    ollama_health_check_interval: float = 15.0
+    ollama_circuit_failure_threshold: int = 3
+    ollama_circuit_reset_seconds: float = 30.0
+    # Extra attempts on other backends when a node could not start the generation
+    ollama_retry_attempts: int = 1
+
+    # Constrained decoding via Ollama's "format": "schema" (per-feature JSON schema),
+    # "json" (any JSON object) or "off"; unparseable output is repaired locally, never regenerated
+    llm_structured_output: str = "schema"
+    llm_json_repair_enabled: bool = True
+
+    # Model warm-up: /health stays 503 until each model is loaded on a backend
+    ollama_keep_alive: str = "30m"
+    llm_warmup_enabled: bool = True
+    llm_warmup_models: list[str] = []  # defaults to [model_name]
+    llm_warmup_timeout: float = 300.0
+    llm_warmup_retry_seconds: float = 10.0
+    # Idle backends get the warm-up request again this often (refreshes keep_alive)
+    llm_rewarm_interval_seconds: float = 300.0
+
+    # Resume text is cleaned up (whitespace, page numbers, repeated headers) and cut
+    # section by section to this many estimated tokens before prompting; 0 disables the cap
+    resume_compaction_enabled: bool = True
+    resume_prompt_token_budget: int = 1500
+    # {"incremental": true} on /resume/analyze sends only sections changed since the
+    # user's last incremental analysis (searched among their newest resume history rows)
+    resume_incremental_enabled: bool = True
+    resume_incremental_lookback: int = 5
+
+    # History storage and API
+    history_preview_chars: int = 200
+    history_compress_min_bytes: int = 1024
+
+    # Write-behind batching of history rows and usage counters
+    history_write_behind_enabled: bool = False
+    history_write_behind_batch_size: int = 100
+    history_write_behind_interval_seconds: float = 0.5
+    history_write_behind_max_pending: int = 5000
+    history_write_behind_max_retries: int = 3
+
+    # Credit reservations (must outlive the slowest generation)
+    credit_reservation_ttl_seconds: float = 600.0
+    credit_reservation_sweep_seconds: float = 60.0
+
+    # LLM HTTP client (connection pool + timeouts, seconds)
+    ollama_timeout: float = 60.0
+    ollama_connect_timeout: float = 5.0
+    ollama_max_connections: int = 200
+    ollama_max_keepalive_connections: int = 50
+    ollama_keepalive_expiry: float = 30.0
+
+    # LLM result cache (in-process LRU + persistent SQLite tier)
+    llm_cache_enabled: bool = True
+    llm_cache_disabled_features: list[str] = []
+    llm_cache_max_entries: int = 1024
+    llm_cache_ttl_seconds: float = 3600.0
+    llm_cache_path: str = "./llm_cache.db"
+    llm_cache_persistent_ttl_seconds: float = 7 * 24 * 3600.0
+
+    # Share one upstream call between identical concurrent requests
+    llm_singleflight_enabled: bool = True
+
+    # LLM work scheduler (match llm_max_concurrency to OLLAMA_NUM_PARALLEL)
+    llm_max_concurrency: int = 4
+    llm_max_queue: int = 64
+    llm_queue_timeout: float = 30.0
+
+    # Budget for a route's LLM work (queue wait + generation), 0 disables; past it the call
+    # is cancelled with 504. Sync routes also cancel the upstream call when the client leaves.
+    request_deadline_seconds: float = 90.0
+    abort_on_client_disconnect: bool = True
+
+    # Batch bullet enhancement (/projects/enhance/batch)
+    projects_batch_max_bullets: int = 20
+    projects_batch_pack_threshold: int = 8
+    projects_batch_concurrency: int = 4
+
+    # Bulk resume jobs (/jobs): background pipeline at the lowest scheduler priority
+    bulk_jobs_enabled: bool = True
+    bulk_job_concurrency: int = 2
+    bulk_job_max_items: int = 1000
+    bulk_job_max_upload_bytes: int = 10 * 1024 * 1024
+    bulk_job_max_attempts: int = 3
+    # A job whose worker stops renewing its lease this long is resumed by another worker
+    bulk_job_lease_seconds: float = 300.0
+    bulk_job_poll_interval: float = 2.0
+
+    # Local pre-scorer batch endpoint (/analyze/batch)
+    ml_batch_max_items: int = 1000
+
+    # Bearer token for /metrics and the /health/* stats endpoints; empty disables them (404).
+    # /health and /health/live stay public for load balancers and orchestrators.
+    stats_token: str = ""
 
     model_config = SettingsConfigDict(
         env_file=".env",
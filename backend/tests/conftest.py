@@ -0,0 +1,86 @@
+"""
+Shared test setup.
+
+Settings are read once at import time, so the environment is pointed at a
+scratch directory before any backend module is imported. Everything runs
+in-process: SQLite databases, the memory rate-limit store, no model warm-up
+and bcrypt on the threadpool.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+
+os.environ.update(
+    {
+        "SECRET_KEY": "test-secret-key-with-at-least-32-bytes",
+        "DATABASE_URL": f"sqlite:///{os.path.join(SCRATCH_DIR, 'app.db')}",
+        "ASYNC_DATABASE_URL": "",
+        "ollama_base_url": "http://127.0.0.1:9",
+        "llm_warmup_enabled": "false",
+        "llm_cache_path": os.path.join(SCRATCH_DIR, "llm_cache.db"),
+        "idempotency_sqlite_path": os.path.join(SCRATCH_DIR, "idempotency.db"),
+        "rate_limit_storage": "memory",
+        "rate_limit_sqlite_path": os.path.join(SCRATCH_DIR, "rate_limits.db"),
+        "password_hash_rounds": "4",
+        "password_hash_workers": "0",
+        "history_write_behind_enabled": "false",
+        "user_cache_ttl_seconds": "0",
+    }
+)
+sys.path.insert(0, BACKEND_DIR)
+
+import main  # noqa: E402  (creates the tables)
+from database import SessionLocal  # noqa: E402
+from models.user import User  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_user():
+    """Create a user directly in the database; returns its email."""
+    def create(credits=20, tier="free", request_count=0, email=None):
+        email = email or f"user-{uuid.uuid4().hex[:12]}@example.com"
+        db = SessionLocal()
+        try:
+            db.add(
+                User(
+                    email=email,
+                    hashed_password="unused",
+                    is_active=True,
+                    tier=tier,
+                    credits=credits,
+                    request_count=request_count,
+                    total_requests=0,
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+        return email
+
+    return create
+
+
+@pytest.fixture
+def load_user():
+    def load(email):
+        db = SessionLocal()
+        try:
+            return db.query(User).filter(User.email == email).one()
+        finally:
+            db.close()
+
+    return load
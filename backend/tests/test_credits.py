@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+
+from database import SessionLocal
+from models.credit import CreditReservation
+from services import credits
+from services.credits import (
+    FREE_TIER_REQUEST_LIMIT,
+    commit_reservation,
+    expire_reservations,
+    refund_reservation,
+    reserve_credits,
+)
+
+
+def _reservation_status(reservation_id):
+    db = SessionLocal()
+    try:
+        return db.get(CreditReservation, reservation_id).status
+    finally:
+        db.close()
+
+
+def _expire(reservation):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(CreditReservation)
+            .where(CreditReservation.id == reservation.id)
+            .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_reserve_and_commit_charges_once(make_user, load_user):
+    email = make_user(credits=5)
+    reservation = reserve_credits(email, "resume")
+    assert load_user(email).credits == 4
+
+    assert commit_reservation(reservation, "input", {"score": 1}, record_history=False) is True
+    user = load_user(email)
+    assert (user.credits, user.request_count, user.total_requests) == (4, 1, 1)
+    assert _reservation_status(reservation.id) == "committed"
+
+    # Settled reservations are not refunded again
+    refund_reservation(reservation)
+    assert load_user(email).credits == 4
+
+
+def test_commit_refunds_unused_credits(make_user, load_user):
+    email = make_user(credits=10)
+    reservation = reserve_credits(email, "project_batch", 4)
+    commit_reservation(reservation, ["a", "b", "c", "d"], ["a"], used=1, record_history=False)
+    user = load_user(email)
+    assert (user.credits, user.request_count) == (9, 1)
+
+
+def test_refund_restores_credits_and_request_count(make_user, load_user):
+    email = make_user(credits=3)
+    reservation = reserve_credits(email, "resume")
+    refund_reservation(reservation)
+    user = load_user(email)
+    assert (user.credits, user.request_count) == (3, 0)
+    assert _reservation_status(reservation.id) == "refunded"
+
+
+def test_reserve_rejects_when_out_of_credits(make_user, load_user):
+    email = make_user(credits=1)
+    reserve_credits(email, "resume")
+    with pytest.raises(HTTPException) as single:
+        reserve_credits(email, "resume")
+    assert single.value.status_code == 403
+    with pytest.raises(HTTPException) as batch:
+        reserve_credits(make_user(credits=2), "project_batch", 3)
+    assert batch.value.status_code == 403
+    assert load_user(email).credits == 0
+
+
+def test_free_tier_lifetime_cap(make_user):
+    email = make_user(credits=100, request_count=FREE_TIER_REQUEST_LIMIT - 1)
+    reservation = reserve_credits(email, "resume")
+    with pytest.raises(HTTPException) as exc:
+        reserve_credits(email, "resume")
+    assert exc.value.status_code == 429
+    # A refunded request gives its slot back
+    refund_reservation(reservation)
+    reserve_credits(email, "resume")
+
+    # Paid tiers are not capped
+    reserve_credits(make_user(credits=100, tier="pro", request_count=10 * FREE_TIER_REQUEST_LIMIT), "resume")
+
+
+def test_failed_checkpoint_refunds(make_user, load_user):
+    email = make_user(credits=5)
+    reservation = reserve_credits(email, "resume")
+    assert commit_reservation(reservation, None, None, record_history=False, checkpoint=lambda db: False) is False
+    user = load_user(email)
+    assert (user.credits, user.request_count, user.total_requests) == (5, 0, 0)
+    assert _reservation_status(reservation.id) == "refunded"
+
+
+def test_expire_reservations_refunds_orphans(make_user, load_user):
+    email = make_user(credits=5)
+    reservation = reserve_credits(email, "resume")
+    _expire(reservation)
+    assert expire_reservations() >= 1
+    assert load_user(email).credits == 5
+    assert _reservation_status(reservation.id) == "expired"
+
+
+def test_commit_after_expiry_charges_again(make_user, load_user):
+    email = make_user(credits=5)
+    reservation = reserve_credits(email, "resume")
+    _expire(reservation)
+    expire_reservations()
+
+    assert commit_reservation(reservation, None, None, record_history=False) is True
+    user = load_user(email)
+    assert (user.credits, user.request_count, user.total_requests) == (4, 1, 1)
+
+
+def test_commit_after_expiry_never_goes_negative(make_user, load_user):
+    email = make_user(credits=3)
+    reservation = reserve_credits(email, "resume", 3)
+    _expire(reservation)
+    expire_reservations()
+    # The refunded credits are spent elsewhere before the late commit
+    reserve_credits(email, "resume", 2)
+
+    commit_reservation(reservation, None, None, record_history=False)
+    user = load_user(email)
+    assert user.credits == 0
+    assert user.request_count == 5
+
+
+def test_reservation_context_refunds_on_error(make_user, load_user):
+    email = make_user(credits=2)
+
+    async def failing_request():
+        async with credits.credit_reservation(email, "resume"):
+            raise RuntimeError("generation failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing_request())
+    assert load_user(email).credits == 2
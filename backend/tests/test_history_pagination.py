@@ -0,0 +1,102 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database import SessionLocal
+from models.history import AIHistory
+from services.history_store import build_history_entry
+
+
+@pytest.fixture
+def auth(client):
+    email = f"history-{uuid.uuid4().hex[:12]}@example.com"
+    response = client.post("/auth/register", json={"email": email, "password": "password"})
+    assert response.status_code == 200, response.text
+    return email, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _add_history(email, count, start, step=timedelta(seconds=1)):
+    """Insert ``count`` rows, several sharing each timestamp; returns ids newest first."""
+    db = SessionLocal()
+    try:
+        rows = []
+        for i in range(count):
+            entry = build_history_entry(db, email, "resume", f"resume {i}", {"score": i})
+            # Pairs of rows share a created_at to exercise the id tie-break
+            entry.created_at = start + step * (i // 2)
+            db.add(entry)
+            db.flush()
+            rows.append((entry.created_at, entry.id))
+        db.commit()
+    finally:
+        db.close()
+    return [record_id for _, record_id in sorted(rows, reverse=True)]
+
+
+def _all_pages(client, headers, **params):
+    pages, cursor = [], None
+    while True:
+        query = {**params, **({"cursor": cursor} if cursor else {})}
+        body = client.get("/history/", params=query, headers=headers).json()
+        pages.append(body["items"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once_newest_first(client, auth):
+    email, headers = auth
+    expected = _add_history(email, 25, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    _add_history("someone-else@example.com", 5, datetime(2026, 1, 2, tzinfo=timezone.utc))
+
+    pages = _all_pages(client, headers, limit=10)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [item["id"] for page in pages for item in page] == expected
+
+
+def test_rows_added_while_paging_do_not_shift_pages(client, auth):
+    email, headers = auth
+    _add_history(email, 6, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    first = client.get("/history/", params={"limit": 3}, headers=headers).json()
+    _add_history(email, 2, datetime(2026, 6, 1, tzinfo=timezone.utc))
+
+    second = client.get("/history/", params={"limit": 3, "cursor": first["next_cursor"]}, headers=headers).json()
+    seen = [item["id"] for item in first["items"] + second["items"]]
+    assert len(set(seen)) == 6
+    assert second["next_cursor"] is None
+
+
+def test_summary_and_full_modes(client, auth):
+    email, headers = auth
+    _add_history(email, 1, datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+    summary = client.get("/history/", headers=headers).json()["items"][0]
+    assert summary["input_preview"] == "resume 0"
+    assert "output" not in summary
+
+    full = client.get("/history/", params={"mode": "full"}, headers=headers).json()["items"][0]
+    assert full["input"] == "resume 0"
+    assert full["output"] == {"score": 0}
+    assert full["input_text"] == "resume 0"
+    assert full["output_text"] == '{"score": 0}'
+
+
+def test_legacy_rows_keep_their_text(client, auth):
+    email, headers = auth
+    db = SessionLocal()
+    try:
+        db.add(AIHistory(user_email=email, feature_type="resume", input_text="123", output_text="{'score': 5}"))
+        db.commit()
+    finally:
+        db.close()
+
+    item = client.get("/history/", params={"mode": "full"}, headers=headers).json()["items"][0]
+    assert item["input"] == "123"
+    assert item["input_text"] == "123"
+    assert item["output"] == {"score": 5}
+
+
+def test_invalid_cursor(client, auth):
+    _, headers = auth
+    assert client.get("/history/", params={"cursor": "!!"}, headers=headers).status_code == 400
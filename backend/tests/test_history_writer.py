@@ -0,0 +1,53 @@
+from database import SessionLocal
+from models.history import AIHistory
+from services import history_writer as history_writer_module
+from services.history_writer import HistoryWriter, PendingHistory
+
+
+def _writer():
+    return HistoryWriter(batch_size=100, flush_interval=0.1, max_pending=1000, max_retries=2)
+
+
+def _rows(email):
+    db = SessionLocal()
+    try:
+        return db.query(AIHistory).filter(AIHistory.user_email == email).order_by(AIHistory.id).all()
+    finally:
+        db.close()
+
+
+def test_flush_writes_rows_with_their_submit_time(make_user):
+    email = make_user()
+    writer = _writer()
+    writer.submit(PendingHistory(email, "resume", "input", {"score": 1}, 1))
+    submitted_at = writer._pending[0].created_at
+
+    assert writer.flush() == 1
+    rows = _rows(email)
+    assert len(rows) == 1
+    assert rows[0].created_at.replace(tzinfo=None) == submitted_at.replace(tzinfo=None)
+
+
+def test_bad_row_is_isolated_and_dead_lettered(make_user, monkeypatch):
+    email = make_user()
+    real_write = history_writer_module.write_history_batch
+
+    def write_unless_bad(batch):
+        if any(item.input_payload == "bad" for item in batch):
+            raise RuntimeError("constraint failed")
+        real_write(batch)
+
+    monkeypatch.setattr(history_writer_module, "write_history_batch", write_unless_bad)
+    writer = _writer()
+    for i in range(5):
+        writer.submit(PendingHistory(email, "resume", "bad" if i == 2 else f"input {i}", {"i": i}, 1))
+
+    # First failure re-queues the whole batch
+    assert writer.flush() == 0
+    assert len(writer._pending) == 5
+    # Out of retries: written in halves, the bad row is dropped
+    assert writer.flush() == 4
+    assert writer._pending == []
+    assert len(_rows(email)) == 4
+    assert writer.stats()["failures"] == 2
+    assert writer.stats()["dead_lettered"] >= 1
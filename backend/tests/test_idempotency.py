@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from services.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER, IdempotencyStore
+from user_cache import CachedUser
+
+IDENT = ("user@example.com", "tests.route", "key-1")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(
+        path=str(tmp_path / "idempotency.db"),
+        ttl_seconds=60,
+        in_progress_ttl=60,
+        wait_timeout=2,
+        poll_interval=0.01,
+        enabled=True,
+    )
+
+
+def test_runs_once_and_replays(store):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return {"n": len(calls)}, {"status_code": None, "headers": [["x-extra", "1"]]}
+
+    async def scenario():
+        first = await store.run(IDENT, "fp", call)
+        second = await store.run(IDENT, "fp", call)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ({"n": 1}, {"status_code": None, "headers": [["x-extra", "1"]]}, False)
+    assert second == ({"n": 1}, {"status_code": None, "headers": [["x-extra", "1"]]}, True)
+    assert len(calls) == 1
+
+
+def test_concurrent_retry_attaches_to_the_running_call(store):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": True}, {}
+
+    async def scenario():
+        return await asyncio.gather(store.run(IDENT, "fp", call), store.run(IDENT, "fp", call))
+
+    results = asyncio.run(scenario())
+    assert sorted(replayed for _, _, replayed in results) == [False, True]
+    assert len(calls) == 1
+
+
+def test_different_body_with_same_key_is_rejected(store):
+    async def call():
+        return {"ok": True}, {}
+
+    async def scenario():
+        await store.run(IDENT, "fp-1", call)
+        await store.run(IDENT, "fp-2", call)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(scenario())
+    assert exc.value.status_code == 422
+
+
+def test_failed_call_is_not_stored(store):
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise HTTPException(status_code=503, detail="busy")
+        return {"ok": True}, {}
+
+    async def scenario():
+        with pytest.raises(HTTPException):
+            await store.run(IDENT, "fp", call)
+        return await store.run(IDENT, "fp", call)
+
+    assert asyncio.run(scenario()) == ({"ok": True}, {}, False)
+    assert len(attempts) == 2
+
+
+class Body(BaseModel):
+    text: str
+
+
+def _app(store):
+    app = FastAPI()
+    calls = []
+
+    def current_user() -> CachedUser:
+        return CachedUser(
+            id=1, email="user@example.com", is_active=True, tier="free", credits=1, request_count=0, total_requests=0
+        )
+
+    @app.post("/generate")
+    @store.idempotent()
+    async def generate(body: Body, request: Request, response: Response, user: CachedUser = Depends(current_user)):
+        calls.append(body.text)
+        response.headers["X-Prompt-Tokens-Sent"] = "42"
+        response.status_code = 201
+        return {"echo": body.text}
+
+    return app, calls
+
+
+def test_replay_restores_route_status_and_headers(store):
+    app, calls = _app(store)
+    with TestClient(app) as client:
+        headers = {IDEMPOTENCY_HEADER: "abc"}
+        first = client.post("/generate", json={"text": "hi"}, headers=headers)
+        replay = client.post("/generate", json={"text": "hi"}, headers=headers)
+        unkeyed = client.post("/generate", json={"text": "hi"})
+
+    assert first.status_code == replay.status_code == 201
+    assert first.json() == replay.json() == {"echo": "hi"}
+    assert first.headers["x-prompt-tokens-sent"] == replay.headers["x-prompt-tokens-sent"] == "42"
+    assert REPLAYED_HEADER.lower() not in first.headers
+    assert replay.headers[REPLAYED_HEADER] == "true"
+    assert unkeyed.status_code == 201
+    assert calls == ["hi", "hi"]
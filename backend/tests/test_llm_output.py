@@ -0,0 +1,23 @@
+import pytest
+
+from services.llm_output import decode
+
+
+@pytest.mark.parametrize(
+    "content, expected, step",
+    [
+        ('{"score": 7}', {"score": 7}, None),
+        ('```json\n{"score": 7}\n```', {"score": 7}, "strip_fences"),
+        ('Here is the analysis: {"score": 7, "note": "a } in text"} Hope it helps!', {"score": 7, "note": "a } in text"}, "extract_object"),
+        ('{"tags": ["a", "b",], "score": 7,}', {"tags": ["a", "b"], "score": 7}, "trailing_commas"),
+        ('Sure!\n```\n{"text": "keep, ]", "n": [1,],}\n```', {"text": "keep, ]", "n": [1]}, "trailing_commas"),
+    ],
+)
+def test_decode_repairs(content, expected, step):
+    assert decode(content) == (expected, step)
+
+
+@pytest.mark.parametrize("content", ["no json here", "[1, 2, 3]", '{"score": '])
+def test_decode_rejects_unrepairable(content):
+    with pytest.raises(ValueError):
+        decode(content)
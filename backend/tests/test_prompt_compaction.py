@@ -0,0 +1,45 @@
+import pytest
+
+from services.prompt_compaction import TRUNCATION_MARK, compact_resume, normalize_lines, strip_noise
+
+LONG_LINE = " ".join(["python"] * 5000)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        LONG_LINE,
+        f"Experience\n{LONG_LINE}\nSkills\n{LONG_LINE}",
+        f"Experience\n- built things\n- {LONG_LINE}\nProjects\n- a\n- {LONG_LINE}",
+    ],
+)
+@pytest.mark.parametrize("budget", [1, 10, 50, 500])
+def test_result_never_exceeds_budget(text, budget):
+    result = compact_resume(text, token_budget=budget)
+    assert result.tokens <= budget
+    assert result.truncated_sections
+
+
+def test_single_line_is_cut_at_a_word_boundary():
+    result = compact_resume(LONG_LINE, token_budget=100)
+    assert result.text.endswith(" " + TRUNCATION_MARK)
+    assert all(word == "python" for word in result.text[: -len(TRUNCATION_MARK)].split())
+
+
+def test_text_under_budget_is_unchanged_apart_from_cleanup():
+    result = compact_resume("Experience\n• Built APIs\nSkills\n• Python", token_budget=1000)
+    assert result.text == "Experience:\n- Built APIs\n\nSkills:\n- Python"
+    assert result.truncated_sections == []
+
+
+def test_strip_noise_keeps_repeated_bullets_but_drops_page_chrome():
+    text = (
+        "Jane Doe\njane@example.com | +1 555 123 4567\nExperience\nAcme\n- Built REST APIs\n"
+        "Beta\n- Built REST APIs\n- Built REST APIs\nPage 1 of 2\nJane Doe\njane@example.com | +1 555 123 4567\n"
+        "Projects\n- Side project\n"
+    )
+    lines = strip_noise(normalize_lines(text))
+    assert lines.count("- Built REST APIs") == 2
+    assert lines.count("Jane Doe") == 1
+    assert lines.count("jane@example.com | +1 555 123 4567") == 1
+    assert "Page 1 of 2" not in lines
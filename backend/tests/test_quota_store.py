@@ -0,0 +1,103 @@
+import pytest
+
+from services.quota_store import MemoryQuotaStore, QuotaCheck, SQLiteQuotaStore, parse_rate, parse_rates
+
+# A fixed point in time at the start of a day-aligned window
+T0 = 1_800_000_000 - (1_800_000_000 % 86400)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryQuotaStore()
+    return SQLiteQuotaStore(str(tmp_path / "quota.db"), busy_timeout_ms=1000)
+
+
+def test_parse_rates():
+    assert parse_rate("5/minute").limit == 5 and parse_rate("5/minute").period == 60
+    assert parse_rate("100 per day").period == 86400
+    assert parse_rate("10/5 minutes").period == 300
+    assert [rate.text for rate in parse_rates("5/minute; 100/day")] == ["5/minute", "100/day"]
+    with pytest.raises(ValueError):
+        parse_rate("five a minute")
+
+
+def test_limit_within_window(store):
+    check = QuotaCheck(key="route:a", rate=parse_rate("3/minute"))
+    assert [store._hit([check], 1, T0 + i).allowed for i in range(4)] == [True, True, True, False]
+
+
+def test_rejected_request_counts_against_no_check(store):
+    route = QuotaCheck(key="route:b", rate=parse_rate("10/minute"))
+    tier = QuotaCheck(key="tier:b", rate=parse_rate("1/day"))
+    assert store._hit([route, tier], 1, T0).allowed
+    decision = store._hit([route, tier], 1, T0 + 1)
+    assert not decision.allowed and decision.rejected == tier
+    # Only the first request was counted against the route limit
+    for i in range(9):
+        assert store._hit([route], 1, T0 + 2 + i).allowed
+    assert not store._hit([route], 1, T0 + 20).allowed
+
+
+def test_check_cost(store):
+    check = QuotaCheck(key="tier:c", rate=parse_rate("5/day"), cost=3)
+    assert store._hit([check], 1, T0).allowed
+    assert not store._hit([check], 1, T0 + 1).allowed
+    assert store._hit([QuotaCheck(key="tier:c", rate=parse_rate("5/day"), cost=2)], 1, T0 + 2).allowed
+
+
+def test_previous_window_is_weighted(store):
+    check = QuotaCheck(key="route:d", rate=parse_rate("10/minute"))
+    for i in range(10):
+        assert store._hit([check], 1, T0 + i).allowed
+    # Half-way into the next window half of the previous count still applies
+    allowed = sum(store._hit([check], 1, T0 + 90).allowed for _ in range(10))
+    assert allowed == 5
+    # Two windows later the old count no longer matters
+    assert sum(store._hit([check], 1, T0 + 180).allowed for _ in range(12)) == 10
+
+
+def test_retry_after_points_past_the_window(store):
+    check = QuotaCheck(key="route:e", rate=parse_rate("1/minute"))
+    store._hit([check], 1, T0 + 10)
+    decision = store._hit([check], 1, T0 + 20)
+    assert not decision.allowed
+    assert 1 <= decision.retry_after <= 120
+
+
+def test_refund_in_the_same_window(store):
+    check = QuotaCheck(key="tier:f", rate=parse_rate("2/day"))
+    assert store._hit([check], 1, T0).allowed
+    assert store._hit([check], 1, T0 + 1).allowed
+    store._refund([check], 1, T0 + 1)
+    assert store._hit([check], 1, T0 + 2).allowed
+    assert not store._hit([check], 1, T0 + 3).allowed
+
+
+def test_refund_after_the_window_rolled_over(store):
+    check = QuotaCheck(key="tier:g", rate=parse_rate("2/minute"))
+    store._hit([check], 1, T0)
+    store._hit([check], 1, T0 + 1)
+    # A new window starts; the counted request now sits in the previous count
+    store._hit([check], 1, T0 + 119)
+    store._refund([check], 1, T0 + 1)
+    assert _counts(store, check.key) == (1, 1)
+
+
+def test_hit_and_refund_public_api(store):
+    check = QuotaCheck(key="tier:h", rate=parse_rate("1/day"))
+    decision = store.hit([check])
+    assert decision.allowed and decision.counted_at > 0
+    assert not store.hit([check]).allowed
+    store.refund([check], decision.counted_at)
+    assert store.hit([check]).allowed
+    assert store.stats()["rejected"] == 1
+
+
+def _counts(store, key):
+    """(current, previous) as stored for ``key``."""
+    if isinstance(store, MemoryQuotaStore):
+        return store._rows[key][1:]
+    return store._connection().execute(
+        "SELECT current, previous FROM quota_windows WHERE key = ?", (key,)
+    ).fetchone()
@@ -0,0 +1,88 @@
+"""
+Short-lived cache of the auth-relevant fields of a user.
+
+Authenticated requests need only a handful of columns (active flag, tier,
+credit/usage snapshot) to pass auth and the pre-flight credit checks. The
+cache keeps those per email for ``user_cache_ttl_seconds`` so the hot path
+skips the ``users`` SELECT. Anything that changes credits, tier or the
+active flag must call ``invalidate``; the TTL bounds staleness across
+worker processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from settings import settings
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    email: str
+    is_active: bool
+    tier: str
+    credits: Optional[int]
+    request_count: int
+    total_requests: int
+
+    @classmethod
+    def from_model(cls, user) -> "CachedUser":
+        return cls(
+            id=user.id,
+            email=user.email,
+            is_active=bool(user.is_active),
+            tier=user.tier,
+            credits=user.credits,
+            request_count=user.request_count or 0,
+            total_requests=user.total_requests or 0,
+        )
+
+
+class UserCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, CachedUser]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[email]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(email)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: CachedUser) -> None:
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[user.email] = (time.monotonic(), user)
+            self._entries.move_to_end(user.email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email: str) -> None:
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(
+    max_entries=settings.user_cache_max_entries,
+    ttl_seconds=settings.user_cache_ttl_seconds,
+)